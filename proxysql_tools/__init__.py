@@ -1,6 +1,9 @@
 """proxysql_tools module"""
 import logging
 
+from pymysql.constants.CR import CR_SERVER_GONE_ERROR, CR_SERVER_LOST
+from pymysql.err import InterfaceError
+
 __author__ = """TwinDB Development Team"""
 __email__ = 'dev@twindb.com'
 __version__ = '0.3.12'
@@ -31,3 +34,14 @@ def execute(conn, query, *args):
     cursor = conn.cursor()
     cursor.execute(query, *args)
     return cursor.fetchall()
+
+
+def connection_lost(err):
+    """Check whether the error means the server closed the connection.
+    The statement may or may not have run then, so only read-only
+    (SELECT or SHOW) statements are retried on a new connection,
+    see :func:`proxysql_tools.connection.execute_reconnecting`."""
+    if isinstance(err, InterfaceError):
+        return True
+    return bool(err.args) and \
+        err.args[0] in (CR_SERVER_GONE_ERROR, CR_SERVER_LOST)
@@ -7,22 +7,32 @@ import click
 from pymysql import MySQLError
 
 from proxysql_tools import setup_logging, LOG, __version__
-from proxysql_tools.aws.aws import aws_notify_master
-from proxysql_tools.cli_entrypoint.galera import galera_register
+from proxysql_tools.cli_entrypoint.galera import galera_register, \
+    galera_register_daemon
 from proxysql_tools.galera.server import server_status, \
     server_set_wsrep_desync, server_set_admin_status
 from proxysql_tools.galera.user import get_users, create_user, delete_user, \
-    change_password, modify_user
+    change_password, modify_user, import_users, export_users, \
+    USER_FILE_FORMATS
 from proxysql_tools.proxysql.exceptions import ProxySQLBackendNotFound, \
     ProxySQLUserNotFound
-from proxysql_tools.proxysql.proxysql import ProxySQL
+from proxysql_tools.proxysql.proxysql import ProxySQL, \
+    PROXYSQL_USERS_BATCH_SIZE
 from proxysql_tools.proxysql.proxysqlbackend import BackendStatus
+from proxysql_tools.stats import STATS
 from proxysql_tools.util import get_proxysql_options
 from proxysql_tools.util.bug1258464 import bug1258464
+from proxysql_tools.util.runlock import RunLockError
 
 PASS_CFG = click.make_pass_decorator(ConfigParser, ensure=True)
 
 
+# noinspection PyUnusedLocal
+def store_stats_file(ctx, param, value):  # pylint: disable=unused-argument
+    """Keep --stats-file in the context, main() reads it from there."""
+    ctx.meta['stats_file'] = value
+
+
 @click.group(invoke_without_command=True)
 @click.option('--debug', help='Print debug messages', is_flag=True,
               default=False)
@@ -31,6 +41,9 @@ PASS_CFG = click.make_pass_decorator(ConfigParser, ensure=True)
               show_default=True)
 @click.option('--version', help='Show tool version and exit.', is_flag=True,
               default=False)
+@click.option('--stats-file', help='Save query statistics to this JSON file '
+                                   'when the command exits.',
+              expose_value=False, callback=store_stats_file)
 @PASS_CFG
 @click.pass_context
 def main(ctx, cfg, debug, config, version):
@@ -45,6 +58,11 @@ def main(ctx, cfg, debug, config, version):
 
     setup_logging(LOG, debug=debug)
 
+    stats_file = ctx.meta.get('stats_file')
+    if debug or stats_file:
+        STATS.enable()
+        ctx.call_on_close(lambda: report_stats(debug, stats_file))
+
     if os.path.exists(config):
         cfg.read(config)
     else:
@@ -52,6 +70,24 @@ def main(ctx, cfg, debug, config, version):
         exit(1)
 
 
+def report_stats(debug, stats_file):
+    """
+    Log a summary of query statistics and save them to a file.
+
+    :param debug: Log the summary.
+    :type debug: bool
+    :param stats_file: Save statistics to this file if given.
+    :type stats_file: str
+    """
+    if debug:
+        STATS.log_summary()
+    if stats_file:
+        try:
+            STATS.save(stats_file)
+        except IOError as err:
+            LOG.error('Failed to save statistics to %s: %s', stats_file, err)
+
+
 @main.command()
 @PASS_CFG
 def ping(cfg):
@@ -74,6 +110,10 @@ def aws():
 @PASS_CFG
 def notify_master(cfg):
     """The notify_master script for keepalived."""
+    # AWS dependencies are heavy to import. Other commands, especially
+    # those run by ProxySQL scheduler, don't need them.
+    from proxysql_tools.aws.aws import aws_notify_master
+
     LOG.debug('Switching to master role and executing keepalived '
               'notify_master script.')
     aws_notify_master(cfg)
@@ -85,16 +125,29 @@ def galera():
 
 
 @galera.command()
+@click.option('--daemon', help='Do not exit, register nodes continuously.',
+              is_flag=True, default=False)
+@click.option('--interval', type=float,
+              help='Seconds between register passes in daemon mode. '
+                   'Overrides register_interval from the config.  '
+                   '[default: 1]')
+@click.option('--metrics-port', type=int,
+              help='Serve Prometheus metrics on this port in daemon mode. '
+                   'Overrides metrics_port from the config.')
 @PASS_CFG
-def register(cfg):
+def register(cfg, daemon, interval, metrics_port):
     """Registers Galera cluster nodes with ProxySQL."""
 
     try:
-        galera_register(cfg)
-    except NotImplementedError as err:
+        if daemon:
+            galera_register_daemon(cfg, interval=interval,
+                                   metrics_port=metrics_port)
+        else:
+            galera_register(cfg)
+    except (NotImplementedError, RunLockError) as err:
         LOG.error(err)
         exit(1)
-    except (NoOptionError, NoSectionError) as err:
+    except (NoOptionError, NoSectionError, ValueError) as err:
         LOG.error('Failed to parse config: %s', err)
         exit(1)
 
@@ -310,9 +363,6 @@ def set_password(cfg, username, password):
     except (NoOptionError, NoSectionError) as err:
         LOG.error('Failed to parse config: %s', err)
         exit(1)
-    except ProxySQLBackendNotFound as err:
-        LOG.error('ProxySQL backends not found: %s', err)
-        exit(1)
 
 
 @user.command()
@@ -350,3 +400,70 @@ def modify(ctx, cfg, username):
     except ValueError:
         LOG.error("Invalid input")
         exit(1)
+
+
+def _user_file_format(file_format, stream):
+    """Format given by --format or guessed by the file name."""
+    if file_format:
+        return file_format
+    if getattr(stream, 'name', '').endswith(('.json', '.jsonl')):
+        return 'json'
+    return 'csv'
+
+
+@user.command(name='import')
+@click.argument('users_file', type=click.File('rb'))
+@click.option('--format', 'file_format', type=click.Choice(USER_FILE_FORMATS),
+              help='Format of the file. By default it\'s guessed by '
+                   'the file extension: .json or .jsonl for json, '
+                   'csv otherwise.')
+@click.option('--batch-size', default=PROXYSQL_USERS_BATCH_SIZE, show_default=True,
+              help='Number of users written by one statement.')
+@PASS_CFG
+def user_import(cfg, users_file, file_format, batch_size):
+    """
+    Add or replace users from a file.
+
+    USERS_FILE is a CSV file with a header line or a file with one
+    JSON object per line. Columns are named as in mysql_users and
+    only username is required. Plain text passwords are hashed.
+    Use - to read from standard input.
+    """
+    try:
+        count = import_users(cfg, users_file,
+                             _user_file_format(file_format, users_file),
+                             batch_size=batch_size)
+        LOG.info('Imported %d users', count)
+    except MySQLError as err:
+        LOG.error('Failed to talk to database: %s', err)
+        exit(1)
+    except (NoOptionError, NoSectionError) as err:
+        LOG.error('Failed to parse config: %s', err)
+        exit(1)
+    except ValueError as err:
+        LOG.error(err)
+        exit(1)
+
+
+@user.command(name='export')
+@click.argument('users_file', type=click.File('wb'), default='-')
+@click.option('--format', 'file_format', type=click.Choice(USER_FILE_FORMATS),
+              help='Format of the file. By default it\'s guessed by '
+                   'the file extension: .json or .jsonl for json, '
+                   'csv otherwise.')
+@PASS_CFG
+def user_export(cfg, users_file, file_format):
+    """
+    Write users to a file that "user import" accepts.
+    USERS_FILE is standard output by default.
+    """
+    try:
+        count = export_users(cfg, users_file,
+                             _user_file_format(file_format, users_file))
+        LOG.info('Exported %d users', count)
+    except MySQLError as err:
+        LOG.error('Failed to talk to database: %s', err)
+        exit(1)
+    except (NoOptionError, NoSectionError) as err:
+        LOG.error('Failed to parse config: %s', err)
+        exit(1)
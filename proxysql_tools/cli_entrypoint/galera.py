@@ -1,49 +1,601 @@
 """Galera entrypoints"""
-from ConfigParser import NoOptionError
+import os
+import signal
+import tempfile
+import time
+from ConfigParser import NoOptionError, NoSectionError
+from threading import Event
 
 from proxysql_tools import LOG
-from proxysql_tools.galera.galera_cluster import GaleraCluster
-from proxysql_tools.load_balancing_mode import singlewriter
+from proxysql_tools.galera.exceptions import GaleraPassTimeout
+from proxysql_tools.galera.galera_cluster import GaleraCluster, \
+    probe_clusters
+from proxysql_tools.load_balancing_mode import singlewriter, weighted, \
+    multiwriter, FlowControlLimits, ReaderLagLimits
+from proxysql_tools.metrics import RegisterMetrics, start_metrics_server
 from proxysql_tools.proxysql.proxysql import ProxySQL, ProxySQLMySQLBackend
 from proxysql_tools.util import get_proxysql_options, get_hostgroups_id
+from proxysql_tools.util.runlock import RunLock, RunCounters, \
+    private_directory
+
+# Default number of seconds between register passes in daemon mode.
+REGISTER_INTERVAL = 1.0
+
+# Only one register run or daemon may hold this lock at a time.
+# By default runs that manage the same hostgroups share a lock,
+# e.g. galera-register-10-11.lock. It's kept in REGISTER_LOCK_DIR,
+# a directory of the user that runs the tool, e.g. /tmp/proxysql-tool-999,
+# so other users can't plant or hold the lock.
+REGISTER_LOCK_DIR = 'proxysql-tool-%d'
+REGISTER_LOCK_FILE = 'galera-register-%s.lock'
+
+# Share of the time left for a pass that is kept for reconciling
+# ProxySQL after the probe, so nodes that don't answer can't use it up.
+APPLY_SHARE = 0.25
+
+LOAD_BALANCING_MODES = ('singlewriter', 'weighted', 'multiwriter')
+
+# Sections of clusters other than the one in [galera] start with this
+CLUSTER_SECTION_PREFIX = 'galera:'
 
 
 def galera_register(cfg):
-    """Registers Galera cluster nodes with ProxySQL."""
+    """
+    Registers nodes of all configured Galera clusters with ProxySQL.
+
+    The run exits at once if a previous run or a daemon is still alive,
+    see :func:`get_run_guard`. With option ``pass_timeout`` the run
+    gives up without changing ProxySQL if it can't finish in time,
+    see :func:`register_clusters`. Both events are counted
+    in the counters file.
+
+    :param cfg: ProxySQL Tools configuration
+    :type cfg: ConfigParser.ConfigParser
+    """
+    lock, counters = get_run_guard(cfg)
+    if not lock.acquire():
+        totals = counters.increment('skipped')
+        LOG.warning('Previous register run (PID %s) is still alive. '
+                    'Skipping this run. Runs skipped so far: %s',
+                    lock.owner(), totals.get('skipped'))
+        return
+
+    try:
+        clusters = get_galera_clusters(cfg)
+        pass_timeout = get_pass_timeout(cfg, clusters)
+
+        timed_register_pass(clusters, _get_proxysql(cfg, pass_timeout),
+                            pass_timeout, counters)
+    finally:
+        lock.release()
+
+
+def galera_register_daemon(cfg, interval=None, metrics_port=None):
+    """
+    Keeps Galera cluster nodes registered with ProxySQL.
+
+    Unlike :func:`galera_register` it doesn't exit after one pass.
+    The cluster and ProxySQL objects, and their connections, are created
+    once and reused by a register pass every ``interval`` seconds
+    until the process gets SIGTERM or SIGINT. A pass registers
+    all configured clusters, see :func:`register_clusters`.
+
+    :param cfg: ProxySQL Tools configuration
+    :type cfg: ConfigParser.ConfigParser
+    :param interval: Seconds between start of two passes. If not given,
+        it's read from option ``register_interval`` of section ``galera``.
+    :type interval: float
+    :param metrics_port: Serve Prometheus metrics on this port.
+        If not given, it's read from option ``metrics_port`` of section
+        ``galera``. Without the option metrics are not served.
+    :type metrics_port: int
+    """
+    lock, counters = get_run_guard(cfg)
+    if not lock.acquire():
+        LOG.error('Another register run or daemon (PID %s) is alive. '
+                  'Exiting.', lock.owner())
+        return
+    try:
+        _register_daemon(cfg, counters, interval, metrics_port)
+    finally:
+        lock.release()
+
+
+def _register_daemon(cfg, counters, interval, metrics_port):
+    """Loop of :func:`galera_register_daemon` under the run lock."""
+    if interval is None:
+        try:
+            interval = cfg.getfloat('galera', 'register_interval')
+        except (NoOptionError, NoSectionError):
+            interval = REGISTER_INTERVAL
+    if metrics_port is None:
+        try:
+            metrics_port = cfg.getint('galera', 'metrics_port')
+        except (NoOptionError, NoSectionError):
+            pass
+
+    clusters = get_galera_clusters(cfg)
+    pass_timeout = get_pass_timeout(cfg, clusters)
+
+    proxysql = _get_proxysql(cfg, pass_timeout)
+
+    metrics = [RegisterMetrics(options['writer_hostgroup_id'], cluster=name)
+               for name, _, options in clusters]
+    metrics_server = None
+    if metrics_port is not None:
+        metrics_server = start_metrics_server(metrics, metrics_port)
+
+    stop = Event()
+
+    # noinspection PyUnusedLocal
+    def stop_daemon(signum, frame):  # pylint: disable=unused-argument
+        """Finish the current pass and exit."""
+        LOG.info('Got signal %d. Exiting.', signum)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, stop_daemon)
+    signal.signal(signal.SIGINT, stop_daemon)
+
+    LOG.info('Registering Galera nodes every %s seconds', interval)
+    while not stop.is_set():
+        started = time.time()
+        _daemon_pass(clusters, proxysql, pass_timeout, counters, metrics)
+        stop.wait(max(0, interval - (time.time() - started)))
+
+    if metrics_server is not None:
+        metrics_server.shutdown()
+        metrics_server.server_close()
+    _close_connections(clusters, proxysql)
+
+
+def _get_proxysql(cfg, pass_timeout):
+    """
+    ProxySQL from section ``proxysql`` of the config. A query may take
+    no longer than a whole pass, so an admin interface that hangs can't
+    keep the run lock forever.
+    """
+    kwargs = get_proxysql_options(cfg)
+    LOG.debug('ProxySQL config %r', kwargs)
+    return ProxySQL(timeout=pass_timeout, **kwargs)
+
+
+def _close_connections(clusters, proxysql):
+    """Close connections to ProxySQL and all Galera nodes."""
+    proxysql.close()
+    for _, galera_cluster, _ in clusters:
+        for node in galera_cluster.nodes:
+            node.close()
+
+
+def _daemon_pass(clusters, proxysql, pass_timeout, counters, metrics):
+    """
+    One pass of the register daemon. Errors are logged and recorded
+    in metrics of the clusters, so the next pass runs anyway.
+    A pass that runs out of time is recorded as an overrun,
+    not as an error.
+    """
+    started = time.time()
+    overrun = False
+    try:
+        results = timed_register_pass(clusters, proxysql, pass_timeout,
+                                      counters)
+        overrun = results is None
+    except Exception:  # pylint: disable=broad-except
+        LOG.exception('Register pass failed')
+        results = None
+    duration = time.time() - started
+    for i, (_, galera_cluster, _) in enumerate(clusters):
+        backends = None if results is None else results[i]
+        metrics[i].record_pass(galera_cluster, backends, duration,
+                               failed=backends is None and not overrun,
+                               overrun=overrun)
+
+
+def timed_register_pass(clusters, proxysql, pass_timeout, counters):
+    """
+    Register clusters within ``pass_timeout`` seconds,
+    see :func:`register_clusters`. A pass that runs out of time
+    is logged and counted as ``overruns``.
+
+    :param clusters: (name, GaleraCluster, balancing options) of each
+        cluster as returned by :func:`get_galera_clusters`.
+    :type clusters: list(tuple)
+    :param proxysql: ProxySQL instance
+    :type proxysql: ProxySQL
+    :param pass_timeout: Seconds the pass may take or None.
+    :type pass_timeout: float
+    :param counters: Counters of the run guard.
+    :type counters: RunCounters
+    :return: Backends of each cluster after the pass or None
+        if the pass ran out of time.
+    :rtype: list(ProxySQLMySQLBackendSet)
+    """
+    deadline = None
+    if pass_timeout is not None:
+        deadline = time.time() + pass_timeout
+    try:
+        return register_clusters(clusters, proxysql, deadline=deadline)
+    except GaleraPassTimeout as err:
+        totals = counters.increment('overruns')
+        LOG.error('%s. Giving up. Passes overrun so far: %s',
+                  err, totals.get('overruns'))
+        return None
+
+
+def register_clusters(clusters, proxysql, deadline=None):
+    """
+    Register nodes of several Galera clusters with one ProxySQL.
+
+    All clusters are probed concurrently. Then each of them is reconciled
+    with its hostgroups by :func:`register_pass` over the same ProxySQL
+    admin connection and all changes are loaded to runtime at once.
+    If a cluster fails, whatever the error, it's logged and not loaded
+    changes of its hostgroups are discarded. Other clusters are still
+    registered.
+
+    Probes end early enough to leave :data:`APPLY_SHARE` of the time
+    until the deadline for reconciling ProxySQL. Nodes that haven't
+    answered by then are unreachable for this pass, so a writer that
+    hangs is still failed over within the deadline. If the deadline
+    has passed when ProxySQL is about to be changed, the pass gives up
+    and ProxySQL runtime stays intact, because decisions made on late
+    data may be wrong already.
+
+    :param clusters: (name, GaleraCluster, balancing options) of each
+        cluster as returned by :func:`get_galera_clusters`.
+    :type clusters: list(tuple)
+    :param proxysql: ProxySQL instance
+    :type proxysql: ProxySQL
+    :param deadline: Unix time when the pass must end.
+    :type deadline: float
+    :return: Backends of each cluster after the pass,
+        None for clusters that failed.
+    :rtype: list(ProxySQLMySQLBackendSet)
+    :raise GaleraPassTimeout: if the deadline passes before all clusters
+        are reconciled.
+    :raise MySQLError: if changes of a failed cluster can't be discarded.
+        Then changes of all clusters are discarded.
+    """
+    probe_deadline = None
+    if deadline is not None:
+        probe_deadline = deadline \
+            - max(0, deadline - time.time()) * APPLY_SHARE
+    probe_clusters([galera_cluster for _, galera_cluster, _ in clusters],
+                   deadline=probe_deadline)
+    results = []
+    with proxysql.changeset():
+        for name, galera_cluster, options in clusters:
+            if deadline is not None and time.time() >= deadline:
+                raise GaleraPassTimeout('Register pass did not finish '
+                                        'in time')
+            try:
+                results.append(register_pass(galera_cluster, proxysql,
+                                             probe=False, **options))
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception('Failed to register cluster %s',
+                              name or 'galera')
+                proxysql.discard_servers(hostgroup_ids=[
+                    options[key] for key in ('writer_hostgroup_id',
+                                             'reader_hostgroup_id')
+                    if key in options
+                ])
+                results.append(None)
+    return results
+
+
+def register_pass(galera_cluster, proxysql, load_balancing_mode,  # pylint: disable=too-many-arguments
+                  writer_hostgroup_id, reader_hostgroup_id,
+                  ignore_writer=None, flow_control=None, reader_lag=None,
+                  max_writers=None, writer_weights=None, probe=True):
+    """
+    Probe the Galera cluster and reconcile ProxySQL backends with it.
+
+    :param galera_cluster: GaleraCluster instance.
+    :type galera_cluster: GaleraCluster
+    :param proxysql: ProxySQL instance
+    :type proxysql: ProxySQL
+    :param load_balancing_mode: Balancing mode name.
+    :type load_balancing_mode: str
+    :param writer_hostgroup_id: Writer hostgroup_id
+    :type writer_hostgroup_id: int
+    :param reader_hostgroup_id: Reader hostgroup_id
+    :type reader_hostgroup_id: int
+    :param ignore_writer: Do not make this backend writer
+    :type ignore_writer: ProxySQLMySQLBackend
+    :param flow_control: Take readers offline when their nodes
+        exceed these limits.
+    :type flow_control: FlowControlLimits
+    :param reader_lag: Take readers offline when they lag
+        more than these limits.
+    :type reader_lag: ReaderLagLimits
+    :param max_writers: Maximum number of writers in multiwriter mode.
+    :type max_writers: int
+    :param writer_weights: Weights of writers by (host, port)
+        in multiwriter mode.
+    :type writer_weights: dict
+    :param probe: Probe the cluster first. If False, the caller
+        has probed it.
+    :type probe: bool
+    :return: Backends of the writer and reader hostgroups after the pass.
+    :rtype: ProxySQLMySQLBackendSet
+    :raise NotImplementedError: if the balancing mode is not supported.
+    """
+    if load_balancing_mode not in LOAD_BALANCING_MODES:
+        raise NotImplementedError('Balancing mode %s not implemented yet.'
+                                  % load_balancing_mode)
+    kwargs = {
+        'ignore_writer': ignore_writer,
+        'flow_control': flow_control,
+        'reader_lag': reader_lag
+    }
+    if load_balancing_mode == 'multiwriter':
+        balance = multiwriter
+        kwargs['max_writers'] = max_writers
+        kwargs['writer_weights'] = writer_weights
+    elif load_balancing_mode == 'weighted':
+        balance = weighted
+    else:
+        balance = singlewriter
+
+    if probe:
+        galera_cluster.probe()
+    with proxysql.changeset():
+        return balance(galera_cluster, proxysql,
+                       writer_hostgroup_id, reader_hostgroup_id, **kwargs)
+
+
+def get_run_guard(cfg):
+    """
+    Lock that keeps register runs from overlapping and counters
+    of runs that were skipped or overran their time budget.
+
+    The lock file is option ``lock_file`` of section ``galera``.
+    Without the option it's :data:`REGISTER_LOCK_FILE` named after
+    hostgroups of all configured clusters, so runs of configs that
+    manage other hostgroups don't block each other. It's kept in
+    :data:`REGISTER_LOCK_DIR` under the temporary directory, which is
+    created if needed and may be accessed only by the current user.
+    Counters are saved in the same path with suffix ``.counters``.
+
+    :param cfg: ProxySQL Tools configuration
+    :type cfg: ConfigParser.ConfigParser
+    :rtype: tuple(RunLock, RunCounters)
+    :raise RunLockError: if the default lock directory
+        belongs to another user.
+    """
+    try:
+        lock_file = cfg.get('galera', 'lock_file')
+    except (NoOptionError, NoSectionError):
+        hostgroups = []
+        for section in get_cluster_sections(cfg):
+            hostgroups.extend(get_hostgroups_id(cfg, section))
+        lock_dir = os.path.join(tempfile.gettempdir(),
+                                REGISTER_LOCK_DIR % os.geteuid())
+        private_directory(lock_dir)
+        lock_file = os.path.join(
+            lock_dir,
+            REGISTER_LOCK_FILE % '-'.join(str(hostgroup_id)
+                                          for hostgroup_id
+                                          in sorted(hostgroups)))
+    return RunLock(lock_file), RunCounters(lock_file + '.counters')
 
+
+def get_pass_timeout(cfg, clusters):
+    """
+    Seconds a register pass may take, option ``pass_timeout``
+    of section ``galera``.
+
+    :param cfg: ProxySQL Tools configuration
+    :type cfg: ConfigParser.ConfigParser
+    :param clusters: Clusters as returned by :func:`get_galera_clusters`.
+    :type clusters: list(tuple)
+    :return: Seconds or None if passes have no time budget.
+    :rtype: float
+    :raise ValueError: if a cluster has a probe timeout that isn't
+        shorter than the pass timeout. Such a pass would give up
+        whenever a node hangs, so the writer would never fail over.
+    """
+    try:
+        pass_timeout = cfg.getfloat('galera', 'pass_timeout')
+    except (NoOptionError, NoSectionError):
+        return None
+    for name, galera_cluster, _ in clusters:
+        if pass_timeout <= galera_cluster.probe_timeout:
+            raise ValueError('pass_timeout %s must be longer than '
+                             'probe_timeout %s of cluster %s'
+                             % (pass_timeout, galera_cluster.probe_timeout,
+                                name or 'galera'))
+    return pass_timeout
+
+
+def get_cluster_sections(cfg):
+    """
+    Sections of the config that describe Galera clusters,
+    see :func:`get_galera_clusters`.
+
+    :param cfg: ProxySQL Tools configuration
+    :type cfg: ConfigParser.ConfigParser
+    :rtype: list(str)
+    """
+    sections = [section for section in cfg.sections()
+                if section.startswith(CLUSTER_SECTION_PREFIX)]
+    if not sections or cfg.has_option('galera', 'cluster_host'):
+        sections.insert(0, 'galera')
+    return sections
+
+
+def get_galera_clusters(cfg):
+    """
+    Read all Galera clusters from the config.
+
+    A cluster is described by the ``galera`` section or by a section
+    named ``galera:<name>``. The ``galera`` section describes a cluster
+    if it has option ``cluster_host``, otherwise it only keeps options
+    of the register daemon. Each cluster must have its own hostgroups.
+
+    :param cfg: ProxySQL Tools configuration
+    :type cfg: ConfigParser.ConfigParser
+    :return: (name, GaleraCluster, balancing options) of each cluster.
+        The name of the cluster in the ``galera`` section is None.
+    :rtype: list(tuple)
+    :raise NoSectionError: if no cluster is configured.
+    :raise ValueError: if clusters share a hostgroup.
+    """
+    clusters = []
+    hostgroups = {}
+    for section in get_cluster_sections(cfg):
+        name = section[len(CLUSTER_SECTION_PREFIX):] \
+            if section.startswith(CLUSTER_SECTION_PREFIX) else None
+        options = get_balancing_options(cfg, section)
+        for key in ('writer_hostgroup_id', 'reader_hostgroup_id'):
+            hostgroup_id = options[key]
+            if hostgroup_id in hostgroups:
+                raise ValueError('Hostgroup %d of section %s is already '
+                                 'used by section %s'
+                                 % (hostgroup_id, section,
+                                    hostgroups[hostgroup_id]))
+            hostgroups[hostgroup_id] = section
+        clusters.append((name, get_galera_cluster(cfg, section), options))
+    return clusters
+
+
+def get_galera_cluster(cfg, section='galera'):
+    """
+    Create GaleraCluster from a section of the config.
+
+    :param cfg: ProxySQL Tools configuration
+    :type cfg: ConfigParser.ConfigParser
+    :param section: Section that describes the cluster.
+    :type section: str
+    :rtype: GaleraCluster
+    """
     kwargs = {}
     try:
-        kwargs['user'] = cfg.get('galera', 'cluster_username')
+        kwargs['user'] = cfg.get(section, 'cluster_username')
     except NoOptionError:
         pass
     try:
-        kwargs['password'] = cfg.get('galera', 'cluster_password')
+        kwargs['password'] = cfg.get(section, 'cluster_password')
+    except NoOptionError:
+        pass
+    try:
+        kwargs['probe_timeout'] = cfg.getfloat(section, 'probe_timeout')
+    except NoOptionError:
+        pass
+    try:
+        kwargs['discover'] = cfg.getboolean(section, 'discover_nodes')
+    except NoOptionError:
+        pass
+    try:
+        kwargs['discovery_ttl'] = cfg.getfloat(section, 'discovery_ttl')
     except NoOptionError:
         pass
 
     LOG.debug('Galera config %r', kwargs)
-    galera_cluster = GaleraCluster(cfg.get('galera', 'cluster_host'),
-                                   **kwargs)
+    return GaleraCluster(cfg.get(section, 'cluster_host'), **kwargs)
 
-    kwargs = get_proxysql_options(cfg)
-    LOG.debug('ProxySQL config %r', kwargs)
-    proxysql = ProxySQL(**kwargs)
 
-    load_balancing_mode = cfg.get('galera', 'load_balancing_mode')
-    writer_hostgroup_id, reader_hostgroup_id = get_hostgroups_id(cfg)
+def get_balancing_options(cfg, section='galera'):
+    """
+    Read load balancing options for :func:`register_pass` from the config.
+
+    :param cfg: ProxySQL Tools configuration
+    :type cfg: ConfigParser.ConfigParser
+    :param section: Section that describes the cluster.
+    :type section: str
+    :rtype: dict
+    :raise NotImplementedError: if the balancing mode is not supported.
+    :raise ValueError: if ``max_writers`` is less than one.
+    """
+    writer_hostgroup_id, reader_hostgroup_id = get_hostgroups_id(cfg,
+                                                                 section)
+    load_balancing_mode = cfg.get(section, 'load_balancing_mode')
+    if load_balancing_mode not in LOAD_BALANCING_MODES:
+        raise NotImplementedError('Balancing mode %s of section %s '
+                                  'not implemented yet.'
+                                  % (load_balancing_mode, section))
+    kwargs = {
+        'load_balancing_mode': load_balancing_mode,
+        'writer_hostgroup_id': writer_hostgroup_id,
+        'reader_hostgroup_id': reader_hostgroup_id
+    }
+    try:
+        host, port = cfg.get(section, 'writer_blacklist').split(':')
+        kwargs['ignore_writer'] = ProxySQLMySQLBackend(
+            host,
+            hostgroup_id=writer_hostgroup_id,
+            port=port
+        )
+    except NoOptionError:
+        pass
+
+    limits = {}
+    try:
+        limits['sent_per_second'] = cfg.getfloat(section,
+                                                 'flow_control_sent_max')
+    except NoOptionError:
+        pass
+    try:
+        limits['recv_queue_avg'] = cfg.getfloat(section,
+                                                'recv_queue_avg_max')
+    except NoOptionError:
+        pass
+    if limits:
+        kwargs['flow_control'] = FlowControlLimits(**limits)
 
-    if load_balancing_mode == 'singlewriter':
-        kwargs = {}
+    limits = {}
+    try:
+        limits['recv_queue'] = cfg.getint(section, 'reader_max_recv_queue')
+    except NoOptionError:
+        pass
+    try:
+        limits['rtt_ms'] = cfg.getfloat(section, 'reader_max_rtt_ms')
+    except NoOptionError:
+        pass
+    try:
+        limits['max_latency_ms'] = cfg.getint(section,
+                                              'reader_max_latency_ms')
+    except NoOptionError:
+        pass
+    if limits:
+        kwargs['reader_lag'] = ReaderLagLimits(**limits)
+
+    try:
+        kwargs['max_writers'] = cfg.getint(section, 'max_writers')
+    except NoOptionError:
+        pass
+    if kwargs.get('max_writers', 1) < 1:
+        raise ValueError('max_writers of section %s must be at least 1'
+                         % section)
+    try:
+        kwargs['writer_weights'] = parse_writer_weights(
+            cfg.get(section, 'writer_weights'))
+    except NoOptionError:
+        pass
+    return kwargs
+
+
+def parse_writer_weights(value):
+    """
+    Parse a list of writer weights like
+    ``192.168.90.2:3306=3,192.168.90.3:3306=1``.
+
+    :param value: Comma separated host:port=weight items.
+    :type value: str
+    :return: Weights by (host, port).
+    :rtype: dict
+    :raise ValueError: if an item can't be parsed.
+    """
+    weights = {}
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
         try:
-            host, port = cfg.get('galera', 'writer_blacklist').split(':')
-            bcknd = ProxySQLMySQLBackend(host,
-                                         hostgroup_id=writer_hostgroup_id,
-                                         port=port)
-            kwargs['ignore_writer'] = bcknd
-        except NoOptionError:
-            pass
-        singlewriter(galera_cluster, proxysql,
-                     writer_hostgroup_id, reader_hostgroup_id, **kwargs)
-    else:
-        raise NotImplementedError('Balancing mode %s not implemented yet.'
-                                  % load_balancing_mode)
+            address, weight = item.split('=')
+            host, port = address.strip().split(':')
+            weights[(host, int(port))] = int(weight)
+        except ValueError:
+            raise ValueError('Invalid writer weight %r. '
+                             'Expected host:port=weight.' % item)
+    return weights
@@ -0,0 +1,118 @@
+"""
+A MySQL connection that is opened once and reused by all queries
+of its owner, a ProxySQL instance or a Galera node.
+"""
+import time
+from contextlib import contextmanager
+from threading import RLock
+
+from pymysql.err import OperationalError, InterfaceError, MySQLError
+
+from proxysql_tools import LOG, execute, connection_lost
+from proxysql_tools.stats import STATS
+
+# Statements that only read, so running one twice is harmless.
+READ_ONLY_STATEMENTS = ('SELECT', 'SHOW')
+
+
+def read_only(query):
+    """
+    Check whether the query only reads.
+
+    :param query: Query to check.
+    :type query: str
+    :rtype: bool
+    """
+    words = query.split(None, 1)
+    return bool(words) and words[0].upper() in READ_ONLY_STATEMENTS
+
+
+def execute_reconnecting(connect, query, *args):
+    """
+    Execute query on a connection from ``connect``.
+
+    If the connection turns out to be lost, the server may or may not
+    have executed the query. So only a read-only query is retried,
+    once, on a new connection. Other queries raise the error.
+
+    :param connect: Context manager that gives a connection,
+        e.g. :meth:`ReusedConnection.connect`.
+    :param query: Query to execute.
+    :type query: str
+    :return: Query result.
+    :rtype: tuple
+    """
+    try:
+        with connect() as conn:
+            return execute(conn, query, *args)
+    except (OperationalError, InterfaceError) as err:
+        if not connection_lost(err) or not read_only(query):
+            raise
+        LOG.debug('Lost connection (%s). Reconnecting.', err)
+        with connect() as conn:
+            return execute(conn, query, *args)
+
+
+class ReusedConnection(object):
+    """
+    MySQL connection that is opened on first use and reused afterwards.
+
+    If it has been idle for more than ``ping_interval`` seconds it's
+    pinged before it's handed out and reopened if the server closed it,
+    so a query is never sent over a connection known to be dead.
+    A connection that fails is dropped and the next use opens a new one.
+
+    :param connect: Function that opens a new connection.
+    :param source: Name of the server in query statistics.
+    :type source: str
+    :param ping_interval: Seconds a connection may be idle
+        before it's pinged.
+    :type ping_interval: float
+    """
+    def __init__(self, connect, source, ping_interval):
+        self.source = source
+        self.ping_interval = ping_interval
+        # Held while the connection is in use. The owner may hold it
+        # across several queries to keep other threads out.
+        self.lock = RLock()
+        self._open = connect
+        self._conn = None
+        self._used = 0
+
+    @contextmanager
+    def connect(self):
+        """
+        Give the connection to the caller. Other threads wait
+        until the caller returns it.
+
+        :return: Open MySQL connection.
+        :rtype: Connection
+        """
+        with self.lock:
+            if self._conn is None or not self._conn.open:
+                with STATS.connect(self.source):
+                    self._conn = self._open()
+            elif time.time() - self._used > self.ping_interval:
+                try:
+                    self._conn.ping(reconnect=True)
+                except (OperationalError, InterfaceError):
+                    self.close()
+                    raise
+            try:
+                yield self._conn
+            except (OperationalError, InterfaceError):
+                self.close()
+                raise
+            finally:
+                self._used = time.time()
+
+    def close(self):
+        """Close the connection if it's open.
+        The next use opens a new one."""
+        with self.lock:
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except MySQLError:
+                    pass
+                self._conn = None
@@ -11,3 +11,7 @@ class GaleraClusterNodeNotFound(GaleraClusterError):
 
 class GaleraClusterSyncedNodeNotFound(GaleraClusterNodeNotFound):
     """Cluster doesn't have a SYNCED node"""
+
+
+class GaleraPassTimeout(GaleraClusterError):
+    """Register pass didn't finish in its time budget"""
@@ -1,8 +1,57 @@
 """Module describes GaleraCluster class"""
+import socket
+import time
+from threading import Thread
 
-from proxysql_tools.galera.galera_node import GaleraNode
+from pymysql.constants.CR import CR_CONN_HOST_ERROR
+from pymysql.err import OperationalError
+
+from proxysql_tools import LOG
+from proxysql_tools.galera.galera_node import GaleraNode, GALERA_NODE_TIMEOUT
 from proxysql_tools.galera.galeranodeset import GaleraNodeSet
 
+# Seconds cluster membership discovered from wsrep_incoming_addresses
+# is trusted while the cluster configuration doesn't change. A discovered
+# node that left the cluster is kept as unreachable for as long.
+DISCOVERY_TTL = 60
+
+
+class _Membership(object):  # pylint: disable=too-few-public-methods
+    """
+    State of member discovery of a cluster.
+
+    :param seeds: (host, port) of nodes from ``cluster_host``.
+    :type seeds: set
+    :param ttl: Seconds discovered membership is cached.
+    :type ttl: float
+    """
+    def __init__(self, seeds, ttl):
+        self.seeds = seeds
+        self.ttl = ttl
+        # (wsrep_cluster_state_uuid, wsrep_cluster_conf_id) and time
+        # of the last discovery
+        self.topology = None
+        self.discovered_at = None
+        # (host, port) of discovered nodes that left the cluster
+        # and time when they left
+        self.departed = {}
+        # IP addresses of host names, cached until the topology changes
+        self.addresses = {}
+
+    def resolve(self, host, port):
+        """
+        (IP address, port) of a node, or (host, port) if the name
+        doesn't resolve. A name is looked up at most once
+        per topology, see :meth:`GaleraCluster.discover`.
+        """
+        if host not in self.addresses:
+            try:
+                self.addresses[host] = socket.gethostbyname(host)
+            except socket.error as err:
+                LOG.debug('Failed to resolve %s: %s', host, err)
+                self.addresses[host] = host
+        return self.addresses[host], port
+
 
 class GaleraCluster(object):  # pylint: disable=too-few-public-methods
     """
@@ -14,12 +63,28 @@ class GaleraCluster(object):  # pylint: disable=too-few-public-methods
     :type user: str
     :param password: MySQL password.
     :type password: str
+    :param probe_timeout: Seconds a node is given to answer a probe.
+    :type probe_timeout: float
+    :param discover: Find other members of the cluster after every probe.
+        ``cluster_hosts`` are then seed nodes. See :meth:`discover`.
+    :type discover: bool
+    :param discovery_ttl: Seconds discovered membership is cached.
+    :type discovery_ttl: float
     """
-    def __init__(self, cluster_hosts, user='root', password=None):
+    # noinspection LongLine
+    def __init__(self, cluster_hosts, user='root', password=None,  # pylint: disable=too-many-arguments
+                 probe_timeout=GALERA_NODE_TIMEOUT, discover=False,
+                 discovery_ttl=DISCOVERY_TTL):
+        self.user = user
+        self.password = password
+        self.probe_timeout = probe_timeout
         self._nodes = GaleraNodeSet()
+        seeds = set()
         for host in self._split_cluster_host(cluster_hosts):
-            self._nodes.add(GaleraNode(host=host[0], port=host[1],
-                                       user=user, password=password))
+            self._nodes.add(self._new_node(*host))
+            seeds.add(host)
+        self._discover = discover
+        self._membership = _Membership(seeds, discovery_ttl)
 
     @property
     def nodes(self):
@@ -31,6 +96,216 @@ class GaleraCluster(object):  # pylint: disable=too-few-public-methods
         """
         return self._nodes
 
+    def probe(self, deadline=None):
+        """
+        Take status snapshots of all nodes concurrently.
+
+        Every node gets ``probe_timeout`` seconds to answer. A node that
+        fails or doesn't answer in time is unreachable for this pass:
+        accessing its :attr:`GaleraNode.status` raises ``OperationalError``.
+        So a probe takes as long as the slowest node, but not longer
+        than ``probe_timeout``.
+
+        If the cluster was created with ``discover=True``, membership is
+        updated from the snapshots and new members are probed as well.
+        Nodes that left the cluster aren't probed, they're unreachable
+        until they're forgotten, see :meth:`discover`.
+
+        :param deadline: Unix time when the probe must end. Nodes that
+            didn't answer by then are unreachable even if they still
+            have time within ``probe_timeout``.
+        :type deadline: float
+        """
+        if not self._discover:
+            self._probe_nodes(list(self._nodes), deadline=deadline)
+            return
+        self._probe_nodes([node for node in self._nodes
+                           if (node.host, node.port)
+                           not in self._membership.departed],
+                          deadline=deadline)
+        added = self.discover()
+        if added:
+            self._probe_nodes(added, deadline=deadline)
+        self._hold_departed()
+
+    def discover(self):
+        """
+        Update cluster membership from status snapshots of the last probe.
+
+        Members are read from ``wsrep_incoming_addresses`` of the first
+        node in the Primary component, so discovery doesn't cost
+        any queries. The result is reused for ``discovery_ttl`` seconds
+        unless ``wsrep_cluster_state_uuid`` or ``wsrep_cluster_conf_id``
+        changes, i.e. a node joins or leaves.
+
+        Addresses are compared after resolving host names, so a member
+        reported by IP isn't added again if a known node has a name that
+        resolves to it. A warning is logged then. Names are resolved
+        once per topology, so DNS isn't queried on every refresh.
+        A name that doesn't resolve is compared as is.
+
+        A discovered node that is not a member anymore stays in
+        :attr:`nodes` for ``discovery_ttl`` seconds. It isn't probed
+        and it's unreachable, so its backends are OFFLINE_HARD rather
+        than deleted in case it comes back soon. Seed nodes from
+        ``cluster_hosts`` are never removed.
+
+        :return: Nodes that were added or came back. They need a probe.
+        :rtype: list(GaleraNode)
+        """
+        membership = self._membership
+        source = self._discovery_source()
+        if source is None:
+            LOG.debug('No node to discover cluster members from')
+            return []
+
+        status = source.status
+        topology = (status.get('wsrep_cluster_state_uuid'),
+                    status.get('wsrep_cluster_conf_id'))
+        if topology == membership.topology \
+                and time.time() - membership.discovered_at < membership.ttl:
+            return []
+
+        if topology != membership.topology:
+            membership.addresses.clear()
+        members = self._parse_incoming_addresses(
+            status['wsrep_incoming_addresses'])
+        size = status.get('wsrep_cluster_size')
+        if size is not None and str(len(members)) != size:
+            LOG.warning('Node %s reports cluster size %s, but %d incoming '
+                        'addresses. Nodes that have no incoming address '
+                        'can not be discovered.', source, size, len(members))
+
+        # Known nodes by (host, port) and by resolved address
+        known = {}
+        for node in self._nodes:
+            known[(node.host, node.port)] = node
+            known.setdefault(membership.resolve(node.host, node.port), node)
+        present = set()
+        added = []
+        for host, port in members:
+            node = known.get((host, port)) \
+                or known.get(membership.resolve(host, port))
+            if node is None:
+                node = self._new_node(host, port)
+                LOG.info('Discovered cluster node %s', node)
+                self._nodes.add(node)
+                known[(host, port)] = node
+                added.append(node)
+            elif (node.host, node.port) != (host, port):
+                LOG.warning('Member %s:%d is known as %s. Set '
+                            'wsrep_node_incoming_address to the address '
+                            'in cluster_host.', host, port, node)
+            present.add((node.host, node.port))
+
+        for node in self._nodes:
+            key = (node.host, node.port)
+            if key in present or key in membership.seeds:
+                if membership.departed.pop(key, None) is not None:
+                    LOG.info('Node %s is back in the cluster', node)
+                    added.append(node)
+            elif key not in membership.departed:
+                LOG.info('Node %s left the cluster', node)
+                membership.departed[key] = time.time()
+
+        membership.topology = topology
+        membership.discovered_at = time.time()
+        return added
+
+    def _discovery_source(self):
+        """First reachable node of the Primary component that reports
+        incoming addresses, or None."""
+        for node in self._nodes:
+            try:
+                status = node.status
+            except OperationalError:
+                continue
+            if status.get('wsrep_cluster_status') == 'Primary' \
+                    and status.get('wsrep_incoming_addresses'):
+                return node
+        return None
+
+    def _hold_departed(self):
+        """Make nodes that left the cluster unreachable for this pass
+        and forget those that left ``discovery_ttl`` seconds ago."""
+        departed = self._membership.departed
+        for node in list(self._nodes):
+            key = (node.host, node.port)
+            if key not in departed:
+                continue
+            if time.time() - departed[key] >= self._membership.ttl:
+                LOG.info('Forgetting node %s', node)
+                del departed[key]
+                self._nodes.remove(node)
+                node.close()
+            else:
+                node.reset_status(error=OperationalError(
+                    CR_CONN_HOST_ERROR,
+                    'Node %s left the cluster' % node))
+
+    def _new_node(self, host, port):
+        return GaleraNode(host=host, port=port,
+                          user=self.user, password=self.password,
+                          timeout=self.probe_timeout)
+
+    @staticmethod
+    def _parse_incoming_addresses(value):
+        """
+        Parse ``wsrep_incoming_addresses``, e.g.
+        ``192.168.90.2:3306,192.168.90.3:3306``. Entries without
+        a port, like ``AUTO`` of nodes that didn't set
+        ``wsrep_node_incoming_address``, are skipped.
+
+        :return: List of (host, port).
+        :rtype: list(tuple)
+        """
+        members = []
+        for item in value.split(','):
+            host, _, port = item.strip().rpartition(':')
+            if host and port.isdigit():
+                members.append((host, int(port)))
+        return members
+
+    def _probe_nodes(self, nodes, deadline=None):
+        """Probe given nodes concurrently, see :meth:`probe`."""
+        results = [None] * len(nodes)
+
+        def probe_node(i):
+            """Snapshot i-th node and save the result or the error."""
+            try:
+                results[i] = nodes[i].snapshot()
+            except Exception as err:  # pylint: disable=broad-except
+                results[i] = err
+
+        started = time.time()
+        threads = []
+        for i, node in enumerate(nodes):
+            thread = Thread(target=probe_node, args=(i, ),
+                            name='probe-%s' % node)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        timeout = started + self.probe_timeout
+        deadline = timeout if deadline is None else min(timeout, deadline)
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()))
+
+        waited = max(0, deadline - started)
+        for node, thread, result in zip(nodes, threads, results):
+            if thread.is_alive():
+                LOG.warning('Node %s did not respond in %.3g seconds',
+                            node, waited)
+                error = OperationalError(CR_CONN_HOST_ERROR,
+                                         'Node %s did not respond in %.3g '
+                                         'seconds' % (node, waited))
+                node.reset_status(error=error)
+            elif isinstance(result, Exception):
+                LOG.warning('Failed to probe node %s: %s', node, result)
+                node.reset_status(error=result)
+            else:
+                node.reset_status(status=result)
+
     @staticmethod
     def _split_cluster_host(cluster_host):
         """Split a string with list of hosts and make
@@ -59,3 +334,27 @@ class GaleraCluster(object):  # pylint: disable=too-few-public-methods
             result.append((host, int(port)))
 
         return result
+
+
+def probe_clusters(clusters, deadline=None):
+    """
+    Probe Galera clusters concurrently, see :meth:`GaleraCluster.probe`.
+    It takes as long as the slowest cluster.
+
+    :param clusters: Clusters to probe.
+    :type clusters: list(GaleraCluster)
+    :param deadline: Unix time when probes must end.
+    :type deadline: float
+    """
+    if len(clusters) == 1:
+        clusters[0].probe(deadline=deadline)
+        return
+    threads = []
+    for i, cluster in enumerate(clusters):
+        thread = Thread(target=cluster.probe, kwargs={'deadline': deadline},
+                        name='probe-cluster-%d' % i)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
@@ -1,10 +1,18 @@
 """Module describes GaleraNode class"""
-from contextlib import contextmanager
+import time
 
 import pymysql
 from pymysql.cursors import DictCursor
 
-from proxysql_tools import execute
+from proxysql_tools.connection import ReusedConnection, execute_reconnecting
+from proxysql_tools.stats import STATS
+
+# Default number of seconds to wait for a Galera node to
+# accept a connection or to answer a query.
+GALERA_NODE_TIMEOUT = 10
+# A reused connection that has been idle for longer than
+# this many seconds is pinged before it is handed out.
+GALERA_NODE_PING_INTERVAL = 10
 
 
 class GaleraNodeState(object):  # pylint: disable=too-few-public-methods
@@ -16,6 +24,71 @@ class GaleraNodeState(object):  # pylint: disable=too-few-public-methods
     DONOR = 5
 
 
+class GaleraNodeStatus(object):
+    """
+    GaleraNodeStatus is an immutable snapshot of status variables
+    of a Galera node taken at one moment.
+
+    :param variables: Status variables as returned by ``SHOW GLOBAL STATUS``.
+    :type variables: dict
+    :param taken_at: Unix time when the snapshot was taken.
+    :type taken_at: float
+    :param rtt: Seconds the status query took.
+    :type rtt: float
+    """
+    __slots__ = ('_variables', 'taken_at', 'rtt')
+
+    def __init__(self, variables, taken_at=None, rtt=None):
+        self._variables = dict(variables)
+        self.taken_at = taken_at
+        self.rtt = rtt
+
+    def __getitem__(self, variable):
+        return self._variables[variable]
+
+    def __contains__(self, variable):
+        return variable in self._variables
+
+    def get(self, variable, default=None):
+        """Return value of a status variable or default if there is none."""
+        return self._variables.get(variable, default)
+
+    @property
+    def wsrep_cluster_state_uuid(self):
+        """State UUID of the cluster at the moment of the snapshot."""
+        return self._variables['wsrep_cluster_state_uuid']
+
+    @property
+    def wsrep_cluster_status(self):
+        """Cluster component status at the moment of the snapshot."""
+        return self._variables['wsrep_cluster_status']
+
+    @property
+    def wsrep_local_state(self):
+        """Galera Cluster FSM state number at the moment of the snapshot."""
+        return int(self._variables['wsrep_local_state'])
+
+
+class _ProbeSuccess(object):  # pylint: disable=too-few-public-methods
+    """
+    Status snapshot of a successful probe and the snapshot it replaced,
+    see :attr:`GaleraNode.previous_status`.
+    """
+    __slots__ = ('status', 'previous')
+
+    def __init__(self, status, previous=None):
+        self.status = status
+        self.previous = previous
+
+
+class _ProbeFailure(object):  # pylint: disable=too-few-public-methods
+    """Error of a failed probe kept in place of a status snapshot."""
+    __slots__ = ('error', )
+
+    def __init__(self, error):
+        self.error = error
+
+
 class GaleraNode(object):
     """
     GaleraNode class describes a single node in Galera Cluster.
@@ -24,13 +97,97 @@ class GaleraNode(object):
     :param port: port to connect to.
     :param user: MySQL username to connect to the node.
     :param password: MySQL password.
+    :param timeout: Seconds to wait for the node to accept a connection
+        or to answer a query.
     """
 
-    def __init__(self, host, port=3306, user='root', password=None):
+    # noinspection LongLine
+    def __init__(self, host, port=3306, user='root', password=None,  # pylint: disable=too-many-arguments
+                 timeout=GALERA_NODE_TIMEOUT):
         self.host = host
         self.port = port
         self.user = user
         self.password = password
+        self.timeout = timeout
+        # _ProbeSuccess, _ProbeFailure or None if not probed yet
+        self._probe = None
+        self._connection = ReusedConnection(self._open_connection, str(self),
+                                            GALERA_NODE_PING_INTERVAL)
+
+    @property
+    def status(self):
+        """Status snapshot of the node. It's taken on first access
+        and then reused, so all checks in one pass see the same state.
+        Use :meth:`reset_status` to take a new one.
+
+        :rtype: GaleraNodeStatus
+        :raise OperationalError: if the node could not be probed.
+        """
+        if self._probe is None:
+            self._probe = _ProbeSuccess(self.snapshot())
+        if isinstance(self._probe, _ProbeFailure):
+            raise self._probe.error
+        return self._probe.status
+
+    @property
+    def probed(self):
+        """Whether the node has a status snapshot or a probe error,
+        i.e. accessing :attr:`status` won't probe the node.
+
+        :rtype: bool
+        """
+        return self._probe is not None
+
+    @property
+    def previous_status(self):
+        """Snapshot that was replaced by the current one, if the node
+        answered both probes. Counters of the two snapshots give rates.
+
+        :rtype: GaleraNodeStatus
+        """
+        if isinstance(self._probe, _ProbeSuccess):
+            return self._probe.previous
+        return None
+
+    def reset_status(self, status=None, error=None):
+        """Replace the status snapshot of the node.
+
+        :param status: New snapshot. If neither status nor error is given,
+            the next access to :attr:`status` probes the node again.
+        :type status: GaleraNodeStatus
+        :param error: Error of a failed probe. It will be raised
+            on access to :attr:`status`.
+        :type error: Exception
+        """
+        if error is not None:
+            self._probe = _ProbeFailure(error)
+            return
+        if status is None:
+            self._probe = None
+        elif not isinstance(self._probe, _ProbeSuccess):
+            self._probe = _ProbeSuccess(status)
+        elif status is not self._probe.status:
+            # Keep one snapshot back, not the whole history
+            self._probe = _ProbeSuccess(status, self._probe.status)
+
+    def snapshot(self):
+        """Fetch all ``wsrep_%`` status variables and ``Threads_running``
+        with one query.
+
+        :return: New status snapshot of the node.
+        :rtype: GaleraNodeStatus
+        """
+        started = time.time()
+        result = self.execute('SHOW GLOBAL STATUS '
+                              'WHERE `Variable_name` LIKE %s '
+                              'OR `Variable_name` = %s',
+                              ('wsrep_%', 'Threads_running'))
+        taken_at = time.time()
+        return GaleraNodeStatus(
+            ((row['Variable_name'], row['Value']) for row in result),
+            taken_at=taken_at,
+            rtt=taken_at - started
+        )
 
     @property
     def wsrep_cluster_state_uuid(self):
@@ -58,7 +215,8 @@ class GaleraNode(object):
         return result[0]['@@wsrep_cluster_name']
 
     def execute(self, query, *args):
-        """Execute query in Galera Node.
+        """Execute query in Galera Node. If the connection is lost,
+        a read-only query is retried on a new one.
 
         :param query: Query to execute.
         :type query: str
@@ -66,25 +224,36 @@ class GaleraNode(object):
             to return result.
         :rtype: dict
         """
-        with self._connect() as conn:
-            return execute(conn, query, *args)
+        with STATS.query(str(self), query):
+            return execute_reconnecting(self._connect, query, *args)
+
+    def close(self):
+        """Close the connection to the node if it's open.
+        The next query will open a new one."""
+        self._connection.close()
 
-    @contextmanager
     def _connect(self):
-        """Connect to Galera node
+        """Connect to Galera node.
 
-        :return: MySQL connection to the Galera node
-        :rtype: Connection
+        The connection is opened on first use and reused afterwards,
+        see :class:`ReusedConnection`.
+
+        :return: Context manager that gives the connection.
         """
-        connection = pymysql.connect(  # pylint: disable=duplicate-code
+        return self._connection.connect()
+
+    def _open_connection(self):
+        """Open a new connection to the node."""
+        return pymysql.connect(  # pylint: disable=duplicate-code
             host=self.host,
             port=self.port,
             user=self.user,
             passwd=self.password,
+            connect_timeout=self.timeout,
+            read_timeout=self.timeout,
+            write_timeout=self.timeout,
             cursorclass=DictCursor
         )
-        yield connection
-        connection.close()
 
     def _status(self, status_variable):
         """Return value of a variable from SHOW GLOBAL STATUS"""
@@ -92,7 +261,13 @@ class GaleraNode(object):
         return result[0]['Value']
 
     def __eq__(self, other):
-        return self.host == other.host and self.port == self.port
+        try:
+            return self.host == other.host and self.port == other.port
+        except AttributeError:
+            return False
+
+    def __hash__(self):
+        return hash((self.host, self.port))
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -1,4 +1,6 @@
 """Class GaleraNodeSet implementation."""
+from pymysql import OperationalError
+
 from proxysql_tools.galera.exceptions import GaleraClusterNodeNotFound
 from proxysql_tools.galera.galera_node import GaleraNode
 from proxysql_tools.proxysql.backendset import BackendSet
@@ -9,25 +11,35 @@ class GaleraNodeSet(BackendSet):
 
     def __contains__(self, item):
         if isinstance(item, GaleraNode):
-            return item in self._backend_list
+            return self._key(item) in self._backends
         elif isinstance(item, GaleraNodeSet):
             return super(GaleraNodeSet, self).__contains__(item)
         return False
 
+    @staticmethod
+    def _key(backend):
+        return backend.host, backend.port
+
     def find(self, host=None, port=3306, state=None):
         """
         Find node by host and port or state
 
         :param host: Hostname of backend
         :param port: Port of backend
-        :param state: State of node
+        :param state: State of node. Nodes that can't be probed
+            are never in the state.
         :type state: GaleraNodeState
         :return: Return list of founded nodes
         :rtype: GaleraNodeSet
         :raises: GaleraClusterNodeNotFound
         """
         nodes = GaleraNodeSet()
-        for node in self._backend_list:
+        if host and port and not state:
+            candidates = [self._backends[(host, port)]] \
+                if (host, port) in self._backends else []
+        else:
+            candidates = self._members()
+        for node in candidates:
             if all((
                     # A -> B
                     # Statement is False if
@@ -37,7 +49,7 @@ class GaleraNodeSet(BackendSet):
                     # See https://en.wikipedia.org/wiki/Material_conditional
                     not host or node.host == host,
                     not port or node.port == port,
-                    not state or node.wsrep_local_state == state)):
+                    not state or _in_state(node, state))):
                 nodes.add(node)
         if nodes:
             return nodes
@@ -51,6 +63,14 @@ class GaleraNodeSet(BackendSet):
         :raise GaleraClusterNodeNotFound: if node is not in the set
         """
         try:
-            self._backend_list.remove(backend)
-        except ValueError as err:
-            raise GaleraClusterNodeNotFound(err)
+            self._pop(backend)
+        except KeyError:
+            raise GaleraClusterNodeNotFound('Node %s not found' % backend)
+
+
+def _in_state(node, state):
+    """Check if the node is reachable and in the given state."""
+    try:
+        return node.status.wsrep_local_state == state
+    except OperationalError:
+        return False
@@ -1,8 +1,6 @@
 """MySQL Server commands."""
 from __future__ import print_function
 
-from prettytable import PrettyTable
-
 from proxysql_tools import LOG
 from proxysql_tools.proxysql.exceptions import ProxySQLBackendNotFound
 from proxysql_tools.proxysql.proxysql import ProxySQL
@@ -12,12 +10,21 @@ from proxysql_tools.util import get_proxysql_options, get_hostgroups_id
 
 def server_status(cfg):
     """Print list of MySQL servers registered in ProxySQL and their status."""
+    # Imported here to keep startup of other commands fast.
+    from prettytable import PrettyTable
+
     kwargs = get_proxysql_options(cfg)
     LOG.debug('ProxySQL config %r', kwargs)
     proxysql = ProxySQL(**kwargs)
 
     writer_hostgroup_id, reader_hostgroup_id = get_hostgroups_id(cfg)
 
+    try:
+        backends = proxysql.find_backends()
+    except ProxySQLBackendNotFound as err:
+        LOG.warning(err)
+        return
+
     for hostgroup_id, name in [(writer_hostgroup_id, 'Writers'),
                                (reader_hostgroup_id, 'Readers')]:
         columns = [
@@ -42,26 +49,25 @@ def server_status(cfg):
         servers.align['comment'] = 'l'   # pylint: disable=unsupported-assignment-operation
 
         LOG.info('%s:', name)
-        try:
-            for backend in proxysql.find_backends(hostgroup_id):
-                row = [
-                    backend.hostgroup_id,
-                    backend.hostname,
-                    backend.port,
-                    backend.status,
-                    backend.weight,
-                    backend.compression,
-                    backend.max_connections,
-                    backend.max_replication_lag,
-                    backend.use_ssl,
-                    backend.max_latency_ms,
-                    backend.comment
-                ]
-                servers.add_row(row)
-
-            print(servers)
-        except ProxySQLBackendNotFound as err:
-            LOG.warning(err)
+        for backend in backends:
+            if backend.hostgroup_id != hostgroup_id:
+                continue
+            row = [
+                backend.hostgroup_id,
+                backend.hostname,
+                backend.port,
+                backend.status,
+                backend.weight,
+                backend.compression,
+                backend.max_connections,
+                backend.max_replication_lag,
+                backend.use_ssl,
+                backend.max_latency_ms,
+                backend.comment
+            ]
+            servers.add_row(row)
+
+        print(servers)
 
 
 def server_set_wsrep_desync(cfg, server_ip, port, wsrep_desync='ON'):
@@ -108,14 +114,15 @@ def server_set_admin_status(cfg, server_ip, port,
     proxysql = ProxySQL(**kwargs)
     backends = proxysql.find_backends()
 
-    for group_id in get_hostgroups_id(cfg):
-
-        try:
-            backend = backends.find(server_ip,
-                                    port=port,
-                                    hostgroup_id=group_id)
-            backend.admin_status = status
-            LOG.debug('Updating %s', backend)
-            proxysql.update_backend(backend)
-        except ProxySQLBackendNotFound:
-            LOG.debug('Skipping hostgroup_id %d', group_id)
+    with proxysql.changeset():
+        for group_id in get_hostgroups_id(cfg):
+
+            try:
+                backend = backends.find(server_ip,
+                                        port=port,
+                                        hostgroup_id=group_id)
+                backend.admin_status = status
+                LOG.debug('Updating %s', backend)
+                proxysql.update_backend(backend)
+            except ProxySQLBackendNotFound:
+                LOG.debug('Skipping hostgroup_id %d', group_id)
@@ -1,34 +1,28 @@
 """MySQL user commands"""
 from __future__ import print_function
 
-from prettytable import PrettyTable
+import csv
+import json
 
 from proxysql_tools.proxysql.exceptions import ProxySQLUserNotFound
-from proxysql_tools.proxysql.proxysqlbackend import BackendStatus
-from proxysql_tools.util import get_proxysql_options, get_hostgroups_id
+from proxysql_tools.util import get_proxysql_options
 from proxysql_tools import LOG
-from proxysql_tools.proxysql.proxysql import ProxySQL, ProxySQLMySQLUser
+from proxysql_tools.proxysql.proxysql import ProxySQL, ProxySQLMySQLUser, \
+    MYSQL_USERS_COLUMNS, PROXYSQL_USERS_BATCH_SIZE
 from proxysql_tools.util import parse_user_arguments
+from proxysql_tools.util.password import hash_password
 
+USER_FILE_FORMATS = ('csv', 'json')
 
-def get_encrypred_password(cfg, pwd):
-    """Encrypt password with MySQL function PASSWORD()."""
-    args = get_proxysql_options(cfg)
-    proxysql = ProxySQL(**args)
-    writer_hostgroup_id, _ = get_hostgroups_id(cfg)
-
-    backends = proxysql.find_backends(writer_hostgroup_id,
-                                      BackendStatus.online)
-    cluster_username = cfg.get('galera', 'cluster_username')
-    cluster_pwd = cfg.get('galera', 'cluster_password')
-    backends[0].connect(cluster_username, cluster_pwd)
-    result = backends[0].execute('SELECT password(%s);', (
-        pwd))
-    return result[0].values()[0]
+# Columns of mysql_users that may be NULL. In CSV NULL is an empty cell.
+NULLABLE_USER_COLUMNS = ('password', 'default_schema')
 
 
 def get_users(cfg):
     """Print list of MySQL users from mysql_users"""
+    # Imported here to keep startup of other commands fast.
+    from prettytable import PrettyTable
+
     args = get_proxysql_options(cfg)
     users = ProxySQL(**args).get_users()
     if not users:
@@ -62,8 +56,7 @@ def create_user(cfg, kwargs):
     args = get_proxysql_options(cfg)
     proxysql = ProxySQL(**args)
     if kwargs['password']:
-        kwargs['password'] = get_encrypred_password(cfg,
-                                                    kwargs['password'])
+        kwargs['password'] = hash_password(kwargs['password'])
     user = ProxySQLMySQLUser(**kwargs)
     try:
         existed_user = proxysql.get_user(kwargs['username'])
@@ -78,12 +71,11 @@ def create_user(cfg, kwargs):
 
 def change_password(cfg, username, password):
     """Change user password"""
-    password = get_encrypred_password(cfg,
-                                      password)
     args = get_proxysql_options(cfg)
-    user = ProxySQL(**args).get_user(username)
-    user.password = password
-    ProxySQL(**args).add_user(user)
+    proxysql = ProxySQL(**args)
+    user = proxysql.get_user(username)
+    user.password = hash_password(password)
+    proxysql.add_user(user)
 
 
 def delete_user(cfg, username):
@@ -102,3 +94,112 @@ def modify_user(cfg, username, user_args):
     for key, value in params.iteritems():
         user.__setattr__(key, value)
     proxysql.add_user(user)
+
+
+def import_users(cfg, stream, file_format='csv',
+                 batch_size=PROXYSQL_USERS_BATCH_SIZE):
+    """
+    Add users from a file to ProxySQL. Plain text passwords are hashed
+    locally, hashes are written as is. Existing users are replaced.
+
+    :param cfg: ProxySQL Tools configuration
+    :type cfg: ConfigParser.ConfigParser
+    :param stream: File to read users from.
+    :param file_format: ``csv`` with a header line or ``json``
+        with one object per line. Columns are named as in ``mysql_users``.
+        Only ``username`` is required.
+    :param batch_size: Number of users written by one statement.
+    :return: Number of imported users.
+    :rtype: int
+    """
+    args = get_proxysql_options(cfg)
+    return ProxySQL(**args).add_users(read_users(stream, file_format),
+                                      batch_size=batch_size)
+
+
+def export_users(cfg, stream, file_format='csv'):
+    """
+    Write users from ProxySQL to a file in a format
+    that :func:`import_users` accepts.
+
+    :param cfg: ProxySQL Tools configuration
+    :type cfg: ConfigParser.ConfigParser
+    :param stream: File to write users to.
+    :param file_format: ``csv`` or ``json``.
+    :return: Number of exported users.
+    :rtype: int
+    """
+    args = get_proxysql_options(cfg)
+    return write_users(ProxySQL(**args).iter_users(), stream, file_format)
+
+
+def read_users(stream, file_format='csv'):
+    """
+    Read users from a file. An empty cell or null of ``password`` or
+    ``default_schema`` is read as NULL, other columns take their
+    defaults then.
+
+    :param stream: File to read users from.
+    :param file_format: ``csv`` or ``json``.
+    :return: Generator of users.
+    :rtype: generator(ProxySQLMySQLUser)
+    :raise ValueError: if a line can't be parsed.
+    """
+    if file_format == 'csv':
+        rows = csv.DictReader(stream)
+    elif file_format == 'json':
+        rows = (json.loads(line) for line in stream if line.strip())
+    else:
+        raise ValueError('Unknown file format %s' % file_format)
+
+    for row in rows:
+        try:
+            kwargs = {}
+            for key, value in row.iteritems():
+                if key not in MYSQL_USERS_COLUMNS:
+                    continue
+                if value == '' or value is None:
+                    # An empty cell of a column that isn't nullable
+                    # takes the default
+                    if key in NULLABLE_USER_COLUMNS:
+                        kwargs[key] = None
+                    continue
+                kwargs[key] = value
+            if kwargs.get('password'):
+                kwargs['password'] = hash_password(kwargs['password'])
+            yield ProxySQLMySQLUser(**kwargs)
+        except (TypeError, ValueError, AttributeError) as err:
+            raise ValueError('Can not parse user %r: %s' % (row, err))
+
+
+def write_users(users, stream, file_format='csv'):
+    """
+    Write users to a file. NULL is written as an empty cell in CSV
+    and as null in JSON.
+
+    :param users: Users to write.
+    :type users: iterable(ProxySQLMySQLUser)
+    :param stream: File to write users to.
+    :param file_format: ``csv`` or ``json``.
+    :return: Number of written users.
+    :rtype: int
+    """
+    if file_format not in USER_FILE_FORMATS:
+        raise ValueError('Unknown file format %s' % file_format)
+
+    count = 0
+    writer = None
+    if file_format == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(MYSQL_USERS_COLUMNS)
+    for user in users:
+        row = user.as_row()
+        if writer:
+            writer.writerow(['' if value is None else value
+                             for value in row])
+        else:
+            stream.write(json.dumps(dict(zip(MYSQL_USERS_COLUMNS, row)),
+                                    sort_keys=True))
+            stream.write('\n')
+        count += 1
+    return count
@@ -4,21 +4,50 @@ import json
 from pymysql import OperationalError
 
 from . import LOG
-from .galera.exceptions import GaleraClusterSyncedNodeNotFound, \
-    GaleraClusterNodeNotFound
-from .galera.galera_node import GaleraNodeState, GaleraNode
+from .galera.galera_node import GaleraNodeState
 from .proxysql.exceptions import ProxySQLBackendNotFound
 from .proxysql.proxysql import ProxySQLMySQLBackend
 from .proxysql.proxysqlbackend import BackendRole, BackendStatus
-
-
-def singlewriter(galera_cluster, proxy,
+from .proxysql.proxysqlbackendset import ProxySQLMySQLBackendSet
+
+# Reader weights of load balancing mode "weighted". A node without load
+# gets READER_WEIGHT_MAX, a loaded one proportionally less.
+READER_WEIGHT_MAX = 1000
+READER_WEIGHT_MIN = 1
+
+# Status variables that make load of a node and how much a unit of each
+# adds to it. wsrep_flow_control_paused is a fraction of time, so a node
+# that pauses replication all the time looks like 100 running queries.
+LOAD_SIGNALS = (
+    ('Threads_running', 1.0),
+    ('wsrep_local_recv_queue', 1.0),
+    ('wsrep_flow_control_paused', 100.0),
+)
+
+# A reader taken offline because of flow control or lag comes back
+# when the signals drop below this fraction of their limits.
+THROTTLE_RECOVERY = 0.5
+
+# A weight moves this fraction of the way to its target in one pass.
+WEIGHT_SMOOTHING = 0.5
+# A weight isn't changed while it's within this fraction of its target,
+# so small fluctuations of load don't reload ProxySQL runtime.
+WEIGHT_HYSTERESIS = 0.2
+
+
+def singlewriter(galera_cluster, proxy,  # pylint: disable=too-many-arguments
                  writer_hostgroup_id,
                  reader_hostgroup_id,
-                 ignore_writer=None):
+                 ignore_writer=None,
+                 flow_control=None,
+                 reader_lag=None):
     """
     Implements single writer balancing mode.
 
+    Backends of both hostgroups are read from ProxySQL once,
+    desired backends are computed by :func:`plan_singlewriter`
+    and only the difference is written back in one changeset.
+
     :param galera_cluster: GaleraCluster instance.
     :type galera_cluster: GaleraCluster
     :param proxy: ProxySQL instance
@@ -29,324 +58,822 @@ def singlewriter(galera_cluster, proxy,
     :type reader_hostgroup_id: int
     :param ignore_writer: Do not make this backend writer
     :type ignore_writer: ProxySQLMySQLBackend
+    :param flow_control: Take readers offline when their nodes
+        exceed these limits.
+    :type flow_control: FlowControlLimits
+    :param reader_lag: Take readers offline when they lag
+        more than these limits.
+    :type reader_lag: ReaderLagLimits
+    :return: Backends of the writer and reader hostgroups after the change.
+    :rtype: ProxySQLMySQLBackendSet
     """
-    register_writer(galera_cluster, proxy, writer_hostgroup_id,
-                    reader_hostgroup_id,
-                    ignore_writer=ignore_writer)
-    register_readers(galera_cluster, proxy, writer_hostgroup_id,
-                     reader_hostgroup_id)
-
-    LOG.debug('Register all missing backends')
-    nodes = galera_cluster.nodes
-
-    for galera_node in nodes.find(state=GaleraNodeState.SYNCED):
-        comment = {
-            'role': BackendRole.reader
-        }
-        reader = ProxySQLMySQLBackend(galera_node.host,
-                                      hostgroup_id=reader_hostgroup_id,
-                                      port=galera_node.port,
-                                      comment=json.dumps(comment))
-        writer = ProxySQLMySQLBackend(galera_node.host,
-                                      hostgroup_id=writer_hostgroup_id,
-                                      port=galera_node.port,
-                                      comment=json.dumps(comment))
-        if not (proxy.backend_registered(reader) or
-                proxy.backend_registered(writer)):
-            proxy.register_backend(reader)
-            LOG.info('Added backend %s to hostgroup %d', reader,
-                     reader_hostgroup_id)
-
-    LOG.debug('Make sure writer is not reader')
-    writer = proxy.find_backends(writer_hostgroup_id)[0]
-    LOG.debug('Writer: %r', writer)
-    readers = proxy.find_backends(reader_hostgroup_id)
-    LOG.debug('Readers: %r', readers)
-    writer_as_reader = writer
-    writer_as_reader.hostgroup_id = reader_hostgroup_id
-
-    is_readers_offline = False
-    if writer_as_reader in readers:
-        readers_without_writer = readers
-        LOG.debug('Readers without writer: %r', readers_without_writer)
-        readers_without_writer.remove(writer_as_reader)
-
-        is_readers_offline = all(x.status == BackendStatus.offline_soft
-                                 for x in readers_without_writer)
-
-    if len(readers) > 2 \
-            and proxy.backend_registered(writer_as_reader) \
-            and not is_readers_offline:
-        proxy.deregister_backend(writer_as_reader)
-
-
-def register_writer(galera_cluster, proxysql, writer_hostgroup_id,
-                    reader_hostgroup_id,
-                    ignore_writer=None):
-    """
-    Checks ProxySQL and Galera cluster and makes sure there is one
-    healthy registered writer.
+    current = get_backends(proxy, writer_hostgroup_id, reader_hostgroup_id)
+    desired = plan_singlewriter(
+        current, galera_cluster.nodes,
+        writer_hostgroup_id, reader_hostgroup_id,
+        ignore_writer=ignore_writer,
+        throttled=throttled_nodes(current, galera_cluster.nodes,
+                                  reader_hostgroup_id,
+                                  flow_control, reader_lag)
+    )
+    desired = plan_reader_latency(desired, reader_hostgroup_id, reader_lag)
+    apply_backends(proxy, current, desired)
+    return desired
+
+
+def weighted(galera_cluster, proxy,  # pylint: disable=too-many-arguments
+             writer_hostgroup_id,
+             reader_hostgroup_id,
+             ignore_writer=None,
+             flow_control=None,
+             reader_lag=None):
+    """
+    Implements single writer balancing mode with reader weights
+    that follow load of the nodes.
+
+    Backends are chosen the same way as in :func:`singlewriter`,
+    then weights of ONLINE readers are adjusted by
+    :func:`plan_reader_weights`.
 
     :param galera_cluster: GaleraCluster instance.
     :type galera_cluster: GaleraCluster
-    :param proxysql: ProxySQL instance
-    :type proxysql: proxysql.ProxySQL
+    :param proxy: ProxySQL instance
+    :type proxy: proxysql.ProxySQL
     :param writer_hostgroup_id: Writer hostgroup_id
     :type writer_hostgroup_id: int
     :param reader_hostgroup_id: Reader hostgroup_id
     :type reader_hostgroup_id: int
     :param ignore_writer: Do not make this backend writer
     :type ignore_writer: ProxySQLMySQLBackend
+    :param flow_control: Take readers offline when their nodes
+        exceed these limits.
+    :type flow_control: FlowControlLimits
+    :param reader_lag: Take readers offline when they lag
+        more than these limits.
+    :type reader_lag: ReaderLagLimits
+    :return: Backends of the writer and reader hostgroups after the change.
+    :rtype: ProxySQLMySQLBackendSet
     """
-    # Get writer backend. If doesn't exist - add.
-    # If exists - check state of respective Galera node.
-    # if the Galera node is not healthy - delete the backend and add a healthy
-    # one.
-    LOG.debug('Registering writers')
-    try:
-        for backend in proxysql.find_backends(writer_hostgroup_id):
-            check_backend(backend, galera_cluster, proxysql,
-                          writer_hostgroup_id, role=BackendRole.writer, limit=1,
-                          ignore_backend=ignore_writer,
-                          recovered_hostgroup_id=reader_hostgroup_id,
-                          recovered_role=BackendRole.reader)
+    current = get_backends(proxy, writer_hostgroup_id, reader_hostgroup_id)
+    desired = plan_singlewriter(
+        current, galera_cluster.nodes,
+        writer_hostgroup_id, reader_hostgroup_id,
+        ignore_writer=ignore_writer,
+        throttled=throttled_nodes(current, galera_cluster.nodes,
+                                  reader_hostgroup_id,
+                                  flow_control, reader_lag)
+    )
+    desired = plan_reader_weights(desired, galera_cluster.nodes,
+                                  reader_hostgroup_id)
+    desired = plan_reader_latency(desired, reader_hostgroup_id, reader_lag)
+    apply_backends(proxy, current, desired)
+    return desired
 
-    except ProxySQLBackendNotFound:
-        # add it
-        register_synced_backends(galera_cluster, proxysql,
-                                 writer_hostgroup_id,
-                                 role=BackendRole.writer,
-                                 limit=1,
-                                 ignore_backend=ignore_writer)
 
-    try:
-        proxysql.find_backends(writer_hostgroup_id, BackendStatus.online)
-    except ProxySQLBackendNotFound:
-        LOG.warn('No writer backends were registered. '
-                 'Will try to add previously ignored backends')
-        try:
-            backend_offline = proxysql.find_backends(writer_hostgroup_id,
-                                                     BackendStatus.offline_hard)
-            register_synced_backends(galera_cluster, proxysql,
-                                     writer_hostgroup_id,
-                                     role=BackendRole.writer,
-                                     limit=1,
-                                     ignore_backend=backend_offline[0])
-        except ProxySQLBackendNotFound:
-            register_synced_backends(galera_cluster, proxysql,
-                                     writer_hostgroup_id,
-                                     role=BackendRole.writer,
-                                     limit=1)
-
-
-def register_readers(galera_cluster, proxysql,
-                     writer_hostgroup_id, reader_hostgroup_id,
-                     ignore_writer=None):
+# noinspection LongLine
+def multiwriter(galera_cluster, proxy,  # pylint: disable=too-many-arguments
+                writer_hostgroup_id,
+                reader_hostgroup_id,
+                ignore_writer=None,
+                flow_control=None,
+                reader_lag=None,
+                max_writers=None,
+                writer_weights=None):
     """
-    Checks ProxySQL and Galera cluster and makes sure readers are registered.
+    Implements multi writer balancing mode: every SYNCED node,
+    up to ``max_writers``, is an ONLINE writer.
+    See :func:`plan_multiwriter`.
 
     :param galera_cluster: GaleraCluster instance.
     :type galera_cluster: GaleraCluster
-    :param proxysql: ProxySQL instance
-    :type proxysql: proxysql.ProxySQL
+    :param proxy: ProxySQL instance
+    :type proxy: proxysql.ProxySQL
     :param writer_hostgroup_id: Writer hostgroup_id
     :type writer_hostgroup_id: int
     :param reader_hostgroup_id: Reader hostgroup_id
     :type reader_hostgroup_id: int
     :param ignore_writer: Do not make this backend writer
     :type ignore_writer: ProxySQLMySQLBackend
+    :param flow_control: Take readers offline when their nodes
+        exceed these limits.
+    :type flow_control: FlowControlLimits
+    :param reader_lag: Take readers offline when they lag
+        more than these limits.
+    :type reader_lag: ReaderLagLimits
+    :param max_writers: Maximum number of ONLINE writers.
+    :type max_writers: int
+    :param writer_weights: Weights of writers by (host, port).
+    :type writer_weights: dict
+    :return: Backends of the writer and reader hostgroups after the change.
+    :rtype: ProxySQLMySQLBackendSet
     """
-    LOG.debug('Registering readers')
-    try:
-        writer = proxysql.find_backends(writer_hostgroup_id)[0]
-    except ProxySQLBackendNotFound as err:
-        LOG.warn(err)
-        register_synced_backends(galera_cluster, proxysql,
-                                 writer_hostgroup_id,
-                                 role=BackendRole.writer,
-                                 limit=1,
-                                 ignore_backend=ignore_writer)
-        writer = proxysql.find_backends(writer_hostgroup_id)[0]
+    current = get_backends(proxy, writer_hostgroup_id, reader_hostgroup_id)
+    desired = plan_multiwriter(
+        current, galera_cluster.nodes,
+        writer_hostgroup_id, reader_hostgroup_id,
+        ignore_writer=ignore_writer,
+        throttled=throttled_nodes(current, galera_cluster.nodes,
+                                  reader_hostgroup_id,
+                                  flow_control, reader_lag),
+        max_writers=max_writers,
+        writer_weights=writer_weights
+    )
+    desired = plan_reader_latency(desired, reader_hostgroup_id, reader_lag)
+    apply_backends(proxy, current, desired)
+    return desired
+
+
+def get_backends(proxy, *hostgroup_ids):
+    """
+    Read backends of given hostgroups with one query.
 
+    :param proxy: ProxySQL instance
+    :type proxy: proxysql.ProxySQL
+    :param hostgroup_ids: Hostgroups to read.
+    :return: Backends of the hostgroups. The set may be empty.
+    :rtype: ProxySQLMySQLBackendSet
+    """
+    backends = ProxySQLMySQLBackendSet()
     try:
-        num_readers = 0
-        readers = proxysql.find_backends(reader_hostgroup_id)
-        for backend in readers:
-            LOG.debug('Comparing %s and %s', backend, writer)
-            if backend == writer:
-                # Don't register writer as reader for now
-                continue
-            LOG.debug('Do not match')
-
-            check_backend(backend, galera_cluster, proxysql,
-                          reader_hostgroup_id, role=BackendRole.reader)
-            num_readers += 1
-        if num_readers == 0:
-            LOG.warn('Did not register any readers')
-            check_backend(writer, galera_cluster, proxysql,
-                          reader_hostgroup_id, role=BackendRole.reader)
-
+        for backend in proxy.find_backends():
+            if backend.hostgroup_id in hostgroup_ids:
+                backends.add(backend)
     except ProxySQLBackendNotFound:
-        # If there are no readers , register writer as reader as well
-        LOG.debug('Reader backends not found')
-        writer_as_reader = writer
-        writer_as_reader.hostgroup_id = reader_hostgroup_id
-        register_synced_backends(galera_cluster, proxysql,
-                                 reader_hostgroup_id,
-                                 role=BackendRole.reader,
-                                 ignore_backend=writer_as_reader)
+        pass
+    return backends
 
 
-# noinspection LongLine
-def check_backend(backend, galera_cluster, proxysql, hostgroup_id, role,  # pylint: disable=too-many-arguments
-                  limit=None, ignore_backend=None,
-                  recovered_hostgroup_id=None, recovered_role=None):
+def node_state(node):
     """
-    Check health of given backed and if necessary replace it.
+    Get state of a Galera node from its status snapshot.
 
-    :param backend: MySQL backend.
-    :type backend: ProxySQLMySQLBackend
-    :param galera_cluster: GaleraCluster instance.
-    :type galera_cluster: GaleraCluster
-    :param proxysql: ProxySQL instance.
-    :type proxysql: proxysql.ProxySQL
-    :param hostgroup_id: Hostgroup_id which the backend belongs to.
-    :type hostgroup_id: int
-    :param role: Comment to add to mysql_servers in ProxySQL
-    :param limit: Register not more than limit number of backends
-    :type limit: int
-    :param ignore_backend: Do not register this backend
-    :type ignore_backend: ProxySQLMySQLBackend
-    :param recovered_hostgroup_id: If backend recovers from OFFLINE_SOFT assign
-        it to this hostgroup_id. Default hostgroup_id.
-    :type recovered_hostgroup_id: int
-    :param recovered_role: If backend recovers from OFFLINE_SOFT set
-        this comment
-    :type recovered_role: str
-    :return: True if backend successfully registered.
-    :rtype: bool
-    """
-    # check it
-    LOG.debug('Backend %s is already registered', backend)
-    LOG.debug('Checking its health')
+    :param node: Galera node.
+    :type node: GaleraNode
+    :return: wsrep_local_state or None if the node can't be probed.
+    :rtype: int
+    """
     try:
-        nodes = galera_cluster.nodes
-        node = nodes.find(host=backend.hostname, port=backend.port)[0]
+        return node.status.wsrep_local_state
+    except OperationalError as err:
+        LOG.error('Node %s is unreachable: %s', node, err)
+        return None
 
-        state = node.wsrep_local_state
-        LOG.debug('%s state: %d', node, state)
 
-        if state == GaleraNodeState.SYNCED:
-            LOG.debug('Node %s (%s) is healthy', node, backend.status)
+def backend_status(state):
+    """
+    Backend status that corresponds to the state of its Galera node.
 
-            if backend.admin_status == BackendStatus.offline_hard:
-                backend.status = backend.admin_status
-                proxysql.register_backend(backend)
-                return True
+    :param state: wsrep_local_state or None if the node is unreachable.
+    :type state: int
+    :return: ONLINE for a SYNCED node, OFFLINE_SOFT for a reachable
+        but unhealthy node and OFFLINE_HARD for an unreachable one.
+    :rtype: str
+    """
+    if state == GaleraNodeState.SYNCED:
+        return BackendStatus.online
+    elif state is None:
+        return BackendStatus.offline_hard
+    return BackendStatus.offline_soft
+
+
+# noinspection LongLine
+def plan_singlewriter(backends, nodes,  # pylint: disable=too-many-arguments
+                      writer_hostgroup_id, reader_hostgroup_id,
+                      ignore_writer=None, throttled=None):
+    """
+    Compute backends ProxySQL should have in single writer mode.
+
+    The function doesn't change its arguments and doesn't talk
+    to ProxySQL. Node states are taken from status snapshots.
+
+    * Backends of hosts that are not cluster members are removed.
+    * Backends with admin_status OFFLINE_HARD (set by an operator)
+      are left as is and their nodes never become writer.
+    * The writer hostgroup has one ONLINE writer. The current writer stays
+      while its node is SYNCED. Otherwise the first SYNCED node other than
+      ``ignore_writer`` is promoted. ``ignore_writer`` is promoted only
+      if there are no other SYNCED nodes.
+    * Former writers stay in the writer hostgroup OFFLINE_SOFT or
+      OFFLINE_HARD until their nodes are SYNCED again.
+      Then they're removed from the writer hostgroup and serve reads.
+    * Every registered reader is ONLINE, OFFLINE_SOFT or OFFLINE_HARD
+      depending on its node. SYNCED nodes that aren't registered
+      are added as readers. Readers of ``throttled`` nodes
+      are OFFLINE_SOFT even if the nodes are SYNCED.
+    * The writer serves reads only if there are no other ONLINE readers.
+
+    :param backends: Current backends of the writer and reader hostgroups.
+    :type backends: ProxySQLMySQLBackendSet
+    :param nodes: Galera cluster nodes.
+    :type nodes: GaleraNodeSet
+    :param writer_hostgroup_id: Writer hostgroup_id
+    :type writer_hostgroup_id: int
+    :param reader_hostgroup_id: Reader hostgroup_id
+    :type reader_hostgroup_id: int
+    :param ignore_writer: Do not make this backend writer
+    :type ignore_writer: ProxySQLMySQLBackend
+    :param throttled: (host, port) of nodes that shouldn't serve reads,
+        see :func:`throttled_nodes`.
+    :type throttled: set
+    :return: Desired backends of the writer and reader hostgroups.
+    :rtype: ProxySQLMySQLBackendSet
+    """
+    throttled = throttled or set()
+    states, writers, readers, forced_offline = _classify(
+        backends, nodes, writer_hostgroup_id, reader_hostgroup_id)
+    candidates = _writer_candidates(nodes, states, forced_offline)
+    writer = _select_writer(writers, candidates, ignore_writer)
+
+    desired = ProxySQLMySQLBackendSet()
+    _plan_writers(desired, writers, [writer] if writer else [],
+                  states, forced_offline, writer_hostgroup_id)
+    online_readers = _plan_readers(desired, nodes, readers, states,
+                                   candidates, forced_offline, throttled,
+                                   reader_hostgroup_id, writer=writer)
+
+    if writer and not online_readers:
+        LOG.warn('There are no ONLINE readers. '
+                 'Writer will serve reads as well.')
+        backend = readers.get(writer)
+        if backend is None:
+            backend = _new_backend(writer, reader_hostgroup_id,
+                                   BackendRole.reader)
+        desired.add(backend.copy(status=BackendStatus.online,
+                                 role=BackendRole.reader))
+
+    return desired
 
-            if backend.status != BackendStatus.online:
 
-                LOG.debug('Will deregister %s (%s)', backend, backend.status)
-                proxysql.deregister_backend(backend)
+# noinspection LongLine
+def plan_multiwriter(backends, nodes,  # pylint: disable=too-many-locals,too-many-arguments
+                     writer_hostgroup_id, reader_hostgroup_id,
+                     ignore_writer=None, throttled=None,
+                     max_writers=None, writer_weights=None):
+    """
+    Compute backends ProxySQL should have in multi writer mode.
+
+    Nodes are checked the same way as in :func:`plan_singlewriter`,
+    but every SYNCED node is an ONLINE writer:
+
+    * Current writers stay while their nodes are SYNCED. Other SYNCED
+      nodes are added in the order of the cluster nodes until there are
+      ``max_writers`` writers. ``ignore_writer`` is a writer only
+      if there are no other SYNCED nodes.
+    * Writers that aren't SYNCED stay in the writer hostgroup
+      OFFLINE_SOFT or OFFLINE_HARD. Healthy nodes over ``max_writers``
+      are removed from the writer hostgroup.
+    * Every node serves reads, the reader hostgroup follows the same
+      rules as in single writer mode.
+
+    :param backends: Current backends of the writer and reader hostgroups.
+    :type backends: ProxySQLMySQLBackendSet
+    :param nodes: Galera cluster nodes.
+    :type nodes: GaleraNodeSet
+    :param writer_hostgroup_id: Writer hostgroup_id
+    :type writer_hostgroup_id: int
+    :param reader_hostgroup_id: Reader hostgroup_id
+    :type reader_hostgroup_id: int
+    :param ignore_writer: Do not make this backend writer
+    :type ignore_writer: ProxySQLMySQLBackend
+    :param throttled: (host, port) of nodes that shouldn't serve reads,
+        see :func:`throttled_nodes`.
+    :type throttled: set
+    :param max_writers: Maximum number of ONLINE writers.
+        All SYNCED nodes are writers if not given.
+    :type max_writers: int
+    :param writer_weights: Weights of writers by (host, port).
+        Writers that aren't in the dict get weight 1.
+    :type writer_weights: dict
+    :return: Desired backends of the writer and reader hostgroups.
+    :rtype: ProxySQLMySQLBackendSet
+    """
+    throttled = throttled or set()
+    writer_weights = writer_weights or {}
+    states, writers, readers, forced_offline = _classify(
+        backends, nodes, writer_hostgroup_id, reader_hostgroup_id)
+    candidates = _writer_candidates(nodes, states, forced_offline)
+
+    ignored = None
+    if ignore_writer:
+        ignored = (ignore_writer.hostname, ignore_writer.port)
+    selected = [(backend.hostname, backend.port) for backend in writers
+                if backend.status == BackendStatus.online
+                and (backend.hostname, backend.port) in candidates
+                and (backend.hostname, backend.port) != ignored]
+    selected += [key for key in candidates
+                 if key not in selected and key != ignored]
+    if not selected and ignored in candidates:
+        LOG.warn('No candidates for writer. '
+                 'Will use ignored backend %s', ignore_writer)
+        selected = [ignored]
+    if not selected:
+        LOG.error('There are no SYNCED nodes to become writer')
+    if max_writers is not None:
+        selected = selected[:max_writers]
+
+    desired = ProxySQLMySQLBackendSet()
+    _plan_writers(desired, writers, selected, states, forced_offline,
+                  writer_hostgroup_id)
+    for backend in list(desired):
+        key = (backend.hostname, backend.port)
+        if key in selected:
+            backend.weight = writer_weights.get(key, 1)
+
+    _plan_readers(desired, nodes, readers, states, candidates,
+                  forced_offline, throttled, reader_hostgroup_id)
+    return desired
+
+
+def _classify(backends, nodes, writer_hostgroup_id, reader_hostgroup_id):
+    """
+    Split current backends by hostgroup and find node states.
 
-                backend.status = BackendStatus.online
+    :return: States by (host, port), writer backends, reader backends
+        by (host, port) and (host, port) of nodes an operator put
+        OFFLINE_HARD. Backends of hosts that are not cluster members
+        are skipped.
+    :rtype: tuple(dict, list, dict, set)
+    """
+    states = {}
+    for node in nodes:
+        states[(node.host, node.port)] = node_state(node)
+
+    writers = []
+    readers = {}
+    forced_offline = set()
+    for backend in backends:
+        key = (backend.hostname, backend.port)
+        if key not in states:
+            LOG.warn('Backend %s is not a cluster member. '
+                     'Will deregister it.', backend)
+            continue
+        if backend.admin_status == BackendStatus.offline_hard:
+            forced_offline.add(key)
+        if backend.hostgroup_id == writer_hostgroup_id:
+            writers.append(backend)
+        elif backend.hostgroup_id == reader_hostgroup_id:
+            readers[key] = backend
+    return states, writers, readers, forced_offline
+
+
+def _writer_candidates(nodes, states, forced_offline):
+    """(host, port) of SYNCED nodes that may be writers, in node order."""
+    return [(node.host, node.port) for node in nodes
+            if states[(node.host, node.port)] == GaleraNodeState.SYNCED
+            and (node.host, node.port) not in forced_offline]
+
+
+def _select_writer(writers, candidates, ignore_writer):
+    """
+    (host, port) of the single writer or None if no node can be writer.
+    The current writer stays while it's a candidate.
+    """
+    for backend in writers:
+        key = (backend.hostname, backend.port)
+        if backend.status == BackendStatus.online and key in candidates:
+            return key
+    ignored = None
+    if ignore_writer:
+        ignored = (ignore_writer.hostname, ignore_writer.port)
+    preferred = [key for key in candidates if key != ignored]
+    if preferred:
+        return preferred[0]
+    elif candidates:
+        LOG.warn('No candidates for writer. '
+                 'Will use ignored backend %s', ignore_writer)
+        return candidates[0]
+    LOG.error('There are no SYNCED nodes to become writer')
+    return None
 
-                if not recovered_hostgroup_id:
-                    recovered_hostgroup_id = hostgroup_id
-                backend.hostgroup_id = recovered_hostgroup_id
 
-                if recovered_role:
-                    backend.comment = recovered_role
+# noinspection LongLine
+def _plan_writers(desired, writers, selected, states, forced_offline,  # pylint: disable=too-many-arguments
+                  writer_hostgroup_id):
+    """
+    Add backends of the writer hostgroup to desired.
 
-                LOG.debug('Registering %s (%s)', backend, backend.status)
-                proxysql.register_backend(backend)
+    Selected nodes are ONLINE writers. Other writers that an operator put
+    OFFLINE_HARD are kept as is, unhealthy ones are OFFLINE_SOFT or
+    OFFLINE_HARD and healthy ones are removed from the hostgroup.
+    """
+    registered = set()
+    for backend in writers:
+        key = (backend.hostname, backend.port)
+        if key in selected:
+            desired.add(backend.copy(status=BackendStatus.online,
+                                     role=BackendRole.writer))
+            registered.add(key)
+        elif key in forced_offline:
+            desired.add(backend.copy())
+        elif states[key] != GaleraNodeState.SYNCED:
+            desired.add(backend.copy(status=backend_status(states[key])))
         else:
-            LOG.warn('Node %s is reachable but unhealthy, '
-                     'setting it OFFLINE_SOFT', node)
-            backend.status = backend.admin_status = BackendStatus.offline_soft
-            proxysql.update_backend(backend)
-            register_synced_backends(galera_cluster, proxysql,
-                                     hostgroup_id,
-                                     role=role,
-                                     limit=limit,
-                                     ignore_backend=ignore_backend)
-
-    except GaleraClusterNodeNotFound:
-        LOG.warn('Backend %s is not a cluster member. Will deregister it.',
-                 backend)
-        proxysql.deregister_backend(backend)
-        register_synced_backends(galera_cluster, proxysql,
-                                 hostgroup_id, role=role,
-                                 limit=limit, ignore_backend=ignore_backend)
-    except OperationalError as err:
-        LOG.error(err)
-        LOG.error('Looks like backend %s is unhealthy. '
-                  'Set OFFLINE_HARD status.',
-                  backend)
-        backend.status = backend.admin_status = BackendStatus.offline_hard
-        proxysql.update_backend(backend)
-        register_synced_backends(galera_cluster, proxysql,
-                                 hostgroup_id, role=role,
-                                 limit=limit, ignore_backend=ignore_backend)
-    return True
+            LOG.info('Former writer %s is healthy. It will serve reads.',
+                     backend)
+    for key in selected:
+        if key not in registered:
+            desired.add(_new_backend(key, writer_hostgroup_id,
+                                     BackendRole.writer))
 
 
 # noinspection LongLine
-def register_synced_backends(galera_cluster, proxysql,  # pylint: disable=too-many-arguments
-                             hostgroup_id, role=None, limit=None,
-                             ignore_backend=None):
+def _plan_readers(desired, nodes, readers, states, candidates,  # pylint: disable=too-many-arguments
+                  forced_offline, throttled, reader_hostgroup_id,
+                  writer=None):
     """
-    Find SYNCED node and register it as a backend.
+    Add backends of the reader hostgroup to desired, one per node
+    except ``writer``.
 
-    :param galera_cluster: GaleraCluster instance.
-    :type galera_cluster: GaleraCluster
-    :param proxysql: ProxySQL instance
-    :type proxysql: proxysql.ProxySQL
-    :param hostgroup_id: hostgroup_id
-    :type hostgroup_id: int
-    :param role: Optional comment to add to mysql_server
-    :type role: str
-    :param limit: Register not more than limit number of backends
-    :type limit: int
-    :param ignore_backend: Do not register this backend
-    :type ignore_backend: ProxySQLMySQLBackend
+    :return: Number of ONLINE readers added.
+    :rtype: int
     """
+    online_readers = 0
+    for node in nodes:
+        key = (node.host, node.port)
+        if key == writer:
+            continue
+        backend = _plan_reader(key, readers, states, candidates,
+                               forced_offline, throttled,
+                               reader_hostgroup_id)
+        if backend is None:
+            continue
+        if backend.status == BackendStatus.online:
+            online_readers += 1
+        desired.add(backend)
+    return online_readers
+
+
+# noinspection LongLine
+def _plan_reader(key, readers, states, candidates, forced_offline,  # pylint: disable=too-many-arguments
+                 throttled, reader_hostgroup_id):
+    """
+    Desired reader backend of a node or None if the node
+    shouldn't be in the reader hostgroup.
+    """
+    backend = readers.get(key)
+    if backend is None:
+        if key not in candidates:
+            return None
+        backend = _new_backend(key, reader_hostgroup_id, BackendRole.reader)
+    elif key not in forced_offline:
+        backend = backend.copy(status=backend_status(states[key]),
+                               role=BackendRole.reader)
+    else:
+        backend = backend.copy()
+    if key in throttled and backend.status == BackendStatus.online:
+        backend.status = BackendStatus.offline_soft
+    return backend
+
+
+class FlowControlLimits(object):  # pylint: disable=too-few-public-methods
+    """
+    Limits of flow control signals of a node. A reader whose node
+    exceeds a limit is taken offline, see :func:`throttled_nodes`.
+
+    :param sent_per_second: Flow control pause events the node
+        may send per second, i.e. rate of ``wsrep_flow_control_sent``.
+        The rate is known from the second probe of the node on.
+    :type sent_per_second: float
+    :param recv_queue_avg: Limit of ``wsrep_local_recv_queue_avg``.
+    :type recv_queue_avg: float
+    """
+    def __init__(self, sent_per_second=None, recv_queue_avg=None):
+        self.sent_per_second = sent_per_second
+        self.recv_queue_avg = recv_queue_avg
+
+    def exceeded(self, node, factor=1.0):
+        """
+        Check signals of a node against the limits multiplied by factor.
+
+        :param node: Probed Galera node.
+        :type node: GaleraNode
+        :param factor: Multiplier of the limits.
+        :type factor: float
+        :return: True if a signal is above its limit. False if signals
+            are within limits or unknown.
+        :rtype: bool
+        :raise OperationalError: if the node could not be probed.
+        """
+        signals = []
+        if self.sent_per_second is not None:
+            rate = flow_control_sent_rate(node)
+            if rate is not None:
+                signals.append((rate, self.sent_per_second))
+        if self.recv_queue_avg is not None:
+            try:
+                signals.append((
+                    float(node.status['wsrep_local_recv_queue_avg']),
+                    self.recv_queue_avg
+                ))
+            except (KeyError, ValueError):
+                pass
+        return any(value > limit * factor for value, limit in signals)
+
+    def __str__(self):
+        return 'flow control limits'
+
+
+class ReaderLagLimits(object):  # pylint: disable=too-few-public-methods
+    """
+    Limits of apply lag and latency of a reader, see :func:`throttled_nodes`.
+
+    Galera has no replication lag in seconds. A node lags as many
+    write-sets as it has in ``wsrep_local_recv_queue``, i.e. received
+    but not applied yet.
+
+    :param recv_queue: Maximum ``wsrep_local_recv_queue``.
+    :type recv_queue: int
+    :param rtt_ms: Maximum time the status probe of the node may take,
+        in milliseconds.
+    :type rtt_ms: float
+    :param max_latency_ms: Value of ``max_latency_ms`` for readers.
+        ProxySQL monitor then shuns readers that ping slower between
+        register passes.
+    :type max_latency_ms: int
+    """
+    def __init__(self, recv_queue=None, rtt_ms=None, max_latency_ms=None):
+        self.recv_queue = recv_queue
+        self.rtt_ms = rtt_ms
+        self.max_latency_ms = max_latency_ms
+
+    def exceeded(self, node, factor=1.0):
+        """
+        Check lag and probe round trip of a node against the limits
+        multiplied by factor.
+
+        :param node: Probed Galera node.
+        :type node: GaleraNode
+        :param factor: Multiplier of the limits.
+        :type factor: float
+        :return: True if a signal is above its limit. False if signals
+            are within limits or unknown.
+        :rtype: bool
+        :raise OperationalError: if the node could not be probed.
+        """
+        status = node.status
+        signals = []
+        if self.recv_queue is not None:
+            try:
+                signals.append((float(status['wsrep_local_recv_queue']),
+                                self.recv_queue))
+            except (KeyError, ValueError):
+                pass
+        if self.rtt_ms is not None and status.rtt is not None:
+            signals.append((status.rtt * 1000, self.rtt_ms))
+        return any(value > limit * factor for value, limit in signals)
+
+    def __str__(self):
+        return 'reader lag limits'
+
+
+def flow_control_sent_rate(node):
+    """
+    Flow control pause events per second the node sent between
+    its previous and current status snapshots.
+
+    :param node: Probed Galera node.
+    :type node: GaleraNode
+    :return: Rate or None if it can't be computed, e.g. the node
+        has been probed once or its counters have been reset.
+    :rtype: float
+    :raise OperationalError: if the node could not be probed.
+    """
+    current, previous = node.status, node.previous_status
+    if previous is None or current.taken_at is None \
+            or previous.taken_at is None \
+            or current.taken_at <= previous.taken_at:
+        return None
     try:
-        nodes = galera_cluster.nodes
-        galera_nodes = nodes.find(state=GaleraNodeState.SYNCED)
-
-        if ignore_backend:
-            node = GaleraNode(ignore_backend.hostname,
-                              port=ignore_backend.port)
-            LOG.debug('Ignoring backend %s', ignore_backend)
-            if node in galera_nodes:
-                LOG.debug('Remove %s from candidates', ignore_backend)
-                galera_nodes.remove(node)
-
-        if limit:
-            candidate_nodes = galera_nodes[:limit]
+        sent = int(current['wsrep_flow_control_sent']) \
+            - int(previous['wsrep_flow_control_sent'])
+    except (KeyError, ValueError):
+        return None
+    if sent < 0:
+        return None
+    return sent / (current.taken_at - previous.taken_at)
+
+
+def throttled_nodes(backends, nodes, reader_hostgroup_id, *limits):
+    """
+    Nodes that shouldn't serve reads because they slow down
+    the cluster with flow control or lag behind it.
+
+    A node is throttled when it exceeds one of ``limits``. Its reader stays
+    OFFLINE_SOFT until the node's signals drop below
+    :data:`THROTTLE_RECOVERY` of the limits, so a node that hovers
+    around a limit doesn't flap. The OFFLINE_SOFT reader of a SYNCED node
+    is what tells a pass that a previous one throttled the node,
+    so no state is kept outside ProxySQL.
+
+    :param backends: Current backends of the writer and reader hostgroups.
+    :type backends: ProxySQLMySQLBackendSet
+    :param nodes: Probed Galera cluster nodes.
+    :type nodes: GaleraNodeSet
+    :param reader_hostgroup_id: Reader hostgroup_id
+    :type reader_hostgroup_id: int
+    :param limits: :class:`FlowControlLimits` or :class:`ReaderLagLimits`.
+        None items are skipped.
+    :return: (host, port) of throttled nodes.
+    :rtype: set
+    """
+    throttled = set()
+    limits = [limit for limit in limits if limit is not None]
+    if not limits:
+        return throttled
+
+    for node in nodes:
+        key = (node.host, node.port)
+        if node_state(node) != GaleraNodeState.SYNCED:
+            continue
+        try:
+            reader = backends.find(node.host, hostgroup_id=reader_hostgroup_id,
+                                   port=node.port)
+            demoted = reader.status == BackendStatus.offline_soft
+        except ProxySQLBackendNotFound:
+            demoted = False
+
+        if demoted:
+            if any(limit.exceeded(node, factor=THROTTLE_RECOVERY)
+                   for limit in limits):
+                throttled.add(key)
         else:
-            candidate_nodes = galera_nodes
-
-        comment = {
-            'role': role
-        }
-        for galera_node in candidate_nodes:
-            backend = ProxySQLMySQLBackend(galera_node.host,
-                                           hostgroup_id=hostgroup_id,
-                                           port=galera_node.port,
-                                           comment=json.dumps(comment))
-            proxysql.register_backend(backend)
-            LOG.info('Added backend %s to hostgroup %d', backend, hostgroup_id)
-        if not candidate_nodes:
-            LOG.info('Not candidate for writer. '
-                     'Set ignored backend as writer %s', ignore_backend)
-            backend = ProxySQLMySQLBackend(ignore_backend.hostname,
-                                           hostgroup_id=hostgroup_id,
-                                           port=ignore_backend.port,
-                                           comment=json.dumps(comment))
-            proxysql.register_backend(backend)
-            LOG.info('Added backend %s to hostgroup %d', backend, hostgroup_id)
-
-    except GaleraClusterSyncedNodeNotFound as err:
-        LOG.error(err)
+            for limit in limits:
+                if limit.exceeded(node):
+                    LOG.warning('Node %s exceeds %s. '
+                                'It will not serve reads.', node, limit)
+                    throttled.add(key)
+                    break
+    return throttled
+
+
+def node_load(status):
+    """
+    Load of a Galera node, a weighted sum of :data:`LOAD_SIGNALS`.
+
+    :param status: Status snapshot of the node.
+    :type status: GaleraNodeStatus
+    :rtype: float
+    """
+    load = 0.0
+    for variable, factor in LOAD_SIGNALS:
+        try:
+            load += factor * float(status.get(variable, 0))
+        except ValueError:
+            pass
+    return load
+
+
+def target_weight(load):
+    """
+    Weight a reader should have under given load.
+
+    :param load: Load of the node, see :func:`node_load`.
+    :type load: float
+    :rtype: int
+    """
+    return max(READER_WEIGHT_MIN,
+               int(round(READER_WEIGHT_MAX / (1.0 + load))))
+
+
+def smoothed_weight(weight, target):
+    """
+    Next weight of a reader on the way from its current weight to target.
+
+    The weight doesn't change while it's within :data:`WEIGHT_HYSTERESIS`
+    of the target. Otherwise it moves :data:`WEIGHT_SMOOTHING` of the way.
+    So a reader that starts with weight 1, e.g. a node that has just
+    joined, takes load gradually.
+
+    :param weight: Current weight.
+    :type weight: int
+    :param target: Weight that matches load of the node.
+    :type target: int
+    :rtype: int
+    """
+    if abs(target - weight) <= WEIGHT_HYSTERESIS * target:
+        return weight
+    return int(round(weight + WEIGHT_SMOOTHING * (target - weight)))
+
+
+def plan_reader_weights(backends, nodes, reader_hostgroup_id):
+    """
+    Adjust weights of ONLINE readers to load of their nodes.
+    Weights of other backends and of nodes that can't be probed
+    are left as is. The function doesn't change its arguments.
+
+    :param backends: Desired backends of the writer and reader hostgroups.
+    :type backends: ProxySQLMySQLBackendSet
+    :param nodes: Galera cluster nodes.
+    :type nodes: GaleraNodeSet
+    :param reader_hostgroup_id: Reader hostgroup_id
+    :type reader_hostgroup_id: int
+    :return: Backends with new weights.
+    :rtype: ProxySQLMySQLBackendSet
+    """
+    loads = {}
+    for node in nodes:
+        try:
+            loads[(node.host, node.port)] = node_load(node.status)
+        except OperationalError:
+            pass
+
+    desired = ProxySQLMySQLBackendSet()
+    for backend in backends:
+        key = (backend.hostname, backend.port)
+        if backend.hostgroup_id == reader_hostgroup_id \
+                and backend.status == BackendStatus.online \
+                and key in loads:
+            weight = smoothed_weight(backend.weight,
+                                     target_weight(loads[key]))
+            if weight != backend.weight:
+                LOG.debug('Weight of %s: %d -> %d (load %.2f)',
+                          backend, backend.weight, weight, loads[key])
+                backend = backend.copy(weight=weight)
+        desired.add(backend)
+    return desired
+
+
+def plan_reader_latency(backends, reader_hostgroup_id, limits):
+    """
+    Set ``max_latency_ms`` of readers from ``limits``.
+    The function doesn't change its arguments.
+
+    :param backends: Desired backends of the writer and reader hostgroups.
+    :type backends: ProxySQLMySQLBackendSet
+    :param reader_hostgroup_id: Reader hostgroup_id
+    :type reader_hostgroup_id: int
+    :param limits: Reader limits. If None or its ``max_latency_ms``
+        is None, backends are returned as is.
+    :type limits: ReaderLagLimits
+    :return: Backends with new max_latency_ms.
+    :rtype: ProxySQLMySQLBackendSet
+    """
+    if limits is None or limits.max_latency_ms is None:
+        return backends
+    desired = ProxySQLMySQLBackendSet()
+    for backend in backends:
+        if backend.hostgroup_id == reader_hostgroup_id \
+                and backend.max_latency_ms != limits.max_latency_ms:
+            backend = backend.copy(max_latency_ms=limits.max_latency_ms)
+        desired.add(backend)
+    return desired
+
+
+def diff_backends(current, desired):
+    """
+    Find what should be written to ProxySQL to turn current backends
+    into desired ones.
+
+    :param current: Backends in ProxySQL.
+    :type current: ProxySQLMySQLBackendSet
+    :param desired: Backends that should be in ProxySQL.
+    :type desired: ProxySQLMySQLBackendSet
+    :return: Backends to register (new or changed) and backends to deregister.
+    :rtype: tuple(list, list)
+    """
+    register = []
+    for backend in desired:
+        try:
+            if current.find(backend.hostname,
+                            hostgroup_id=backend.hostgroup_id,
+                            port=backend.port).same_config(backend):
+                continue
+        except ProxySQLBackendNotFound:
+            pass
+        register.append(backend)
+
+    deregister = [backend for backend in current if backend not in desired]
+    return register, deregister
+
+
+def apply_backends(proxy, current, desired):
+    """
+    Write the difference between current and desired backends to ProxySQL.
+    mysql_servers are loaded to runtime once and only if something changed.
+
+    :param proxy: ProxySQL instance
+    :type proxy: proxysql.ProxySQL
+    :param current: Backends in ProxySQL.
+    :type current: ProxySQLMySQLBackendSet
+    :param desired: Backends that should be in ProxySQL.
+    :type desired: ProxySQLMySQLBackendSet
+    """
+    register, deregister = diff_backends(current, desired)
+    if not register and not deregister:
+        LOG.debug('ProxySQL backends are up to date')
+        return
+
+    for backend in register:
+        LOG.info('Registering backend %s', backend)
+    for backend in deregister:
+        LOG.info('Deregistering backend %s', backend)
+
+    with proxy.changeset():
+        proxy.register_backends(register)
+        proxy.deregister_backends(deregister)
+
+
+def _new_backend(key, hostgroup_id, role):
+    host, port = key
+    return ProxySQLMySQLBackend(host, hostgroup_id=hostgroup_id, port=port,
+                                comment=json.dumps({'role': role}))
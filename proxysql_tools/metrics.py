@@ -0,0 +1,302 @@
+"""
+Prometheus metrics of ``galera register --daemon``.
+
+The daemon records the result of every register pass: status snapshots
+its probe took and backends it left in ProxySQL. The metrics are
+rendered from them on request, so scraping doesn't query Galera nodes
+or ProxySQL.
+"""
+import time
+from collections import OrderedDict
+from threading import Lock, Thread
+
+from pymysql import OperationalError
+
+from proxysql_tools import LOG
+from proxysql_tools.proxysql.proxysqlbackend import BackendStatus
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Status variable, metric name and help of Galera node metrics
+NODE_METRICS = (
+    ('wsrep_local_state', 'galera_wsrep_local_state',
+     'Galera FSM state of the node, 4 is SYNCED.'),
+    ('wsrep_flow_control_paused', 'galera_flow_control_paused',
+     'Fraction of time replication was paused by flow control.'),
+    ('wsrep_flow_control_sent', 'galera_flow_control_sent',
+     'Flow control pause events sent by the node.'),
+    ('wsrep_local_recv_queue', 'galera_local_recv_queue',
+     'Write-sets received by the node and waiting to be applied.'),
+)
+
+# Counter, metric name and help of register pass counters
+PASS_COUNTERS = (
+    ('passes', 'register_passes_total', 'Register passes done.'),
+    ('errors', 'register_errors_total', 'Register passes that failed.'),
+    ('overruns', 'register_overruns_total',
+     'Register passes that ran out of time.'),
+    ('failovers', 'failovers_total',
+     'Times the writer moved to another node.'),
+)
+
+BACKEND_STATUSES = (BackendStatus.online, BackendStatus.shunned,
+                    BackendStatus.offline_soft, BackendStatus.offline_hard)
+
+PREFIX = 'proxysql_tools_'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n') \
+        .replace('"', r'\"')
+
+
+def _labels(labels):
+    return ','.join('%s="%s"' % (name, _escape(value))
+                    for name, value in labels)
+
+
+class _Family(object):  # pylint: disable=too-few-public-methods
+    """Samples of one metric."""
+    def __init__(self, name, metric_type, help_text):
+        self.name = PREFIX + name
+        self.metric_type = metric_type
+        self.help_text = help_text
+        self.samples = []
+
+    def add(self, value, *labels):
+        """Add sample with labels given as (name, value) pairs."""
+        self.samples.append((labels, value))
+
+    def render(self):
+        """Metric in Prometheus text exposition format."""
+        lines = ['# HELP %s %s' % (self.name, self.help_text),
+                 '# TYPE %s %s' % (self.name, self.metric_type)]
+        for labels, value in self.samples:
+            if labels:
+                lines.append('%s{%s} %r' % (self.name, _labels(labels),
+                                            float(value)))
+            else:
+                lines.append('%s %r' % (self.name, float(value)))
+        return '\n'.join(lines)
+
+
+class RegisterMetrics(object):
+    """
+    Result of the last register pass and counters of all passes.
+
+    :param writer_hostgroup_id: Writer hostgroup_id
+    :type writer_hostgroup_id: int
+    :param cluster: Name of the cluster. If given, all samples
+        get a ``cluster`` label.
+    :type cluster: str
+    """
+    def __init__(self, writer_hostgroup_id, cluster=None):
+        self.writer_hostgroup_id = writer_hostgroup_id
+        self.cluster = cluster
+        self._lock = Lock()
+        # Node statuses, duration and end time of the last pass
+        self._last_pass = ([], None, None)
+        self._backends = []
+        self._writer = None
+        self._counters = dict.fromkeys(
+            [counter for counter, _, _ in PASS_COUNTERS], 0)
+
+    # noinspection LongLine
+    def record_pass(self, galera_cluster, backends, duration, failed=False,  # pylint: disable=too-many-arguments
+                    overrun=False):
+        """
+        Save results of a register pass.
+
+        :param galera_cluster: Probed Galera cluster.
+        :type galera_cluster: GaleraCluster
+        :param backends: Backends after the pass. If None, backends
+            of the previous pass are kept.
+        :type backends: ProxySQLMySQLBackendSet
+        :param duration: Seconds the pass took.
+        :type duration: float
+        :param failed: Whether the pass failed.
+        :type failed: bool
+        :param overrun: Whether the pass gave up because it ran
+            out of time.
+        :type overrun: bool
+        """
+        nodes = []
+        for node in galera_cluster.nodes:
+            if not node.probed:
+                continue
+            try:
+                nodes.append((str(node), node.status))
+            except OperationalError:
+                nodes.append((str(node), None))
+
+        with self._lock:
+            self._last_pass = (nodes, duration, time.time())
+            if backends is not None:
+                self._backends = list(backends)
+                writer = self._current_writer()
+                if self._writer is not None and writer is not None \
+                        and writer != self._writer:
+                    self._counters['failovers'] += 1
+                if writer is not None:
+                    self._writer = writer
+            self._counters['passes'] += 1
+            if failed:
+                self._counters['errors'] += 1
+            if overrun:
+                self._counters['overruns'] += 1
+
+    def render(self):
+        """
+        Metrics in Prometheus text exposition format.
+
+        :rtype: str
+        """
+        return render([self])
+
+    def families(self):
+        """
+        Metric families with samples of the last pass.
+
+        :rtype: list(_Family)
+        """
+        with self._lock:
+            families = self._node_families() + self._backend_families() \
+                + self._pass_families()
+        if self.cluster is not None:
+            label = ('cluster', self.cluster)
+            for family in families:
+                family.samples = [((label, ) + labels, value)
+                                  for labels, value in family.samples]
+        return families
+
+    def _current_writer(self):
+        for backend in self._backends:
+            if backend.hostgroup_id == self.writer_hostgroup_id \
+                    and backend.status == BackendStatus.online:
+                return '%s:%d' % (backend.hostname, backend.port)
+        return None
+
+    def _node_families(self):
+        nodes = self._last_pass[0]
+        node_up = _Family('galera_node_up', 'gauge',
+                          'Whether the last probe of the node succeeded.')
+        families = [node_up]
+        for variable, name, help_text in NODE_METRICS:
+            family = _Family(name, 'gauge', help_text)
+            for node, status in nodes:
+                if status is None:
+                    continue
+                try:
+                    family.add(float(status[variable]), ('node', node))
+                except (KeyError, ValueError):
+                    pass
+            families.append(family)
+        rtt = _Family('galera_probe_rtt_seconds', 'gauge',
+                      'Time the status query of the last probe took.')
+        for node, status in nodes:
+            node_up.add(status is not None, ('node', node))
+            if status is not None and status.rtt is not None:
+                rtt.add(status.rtt, ('node', node))
+        families.append(rtt)
+        return families
+
+    def _backend_families(self):
+        backend_status = _Family('backend_status', 'gauge',
+                                 'Status of the backend in ProxySQL.')
+        writer = _Family('writer', 'gauge',
+                         'ONLINE backend of the writer hostgroup.')
+        for backend in self._backends:
+            labels = (('hostgroup', backend.hostgroup_id),
+                      ('backend', '%s:%d' % (backend.hostname,
+                                             backend.port)))
+            for status in BACKEND_STATUSES:
+                backend_status.add(backend.status == status,
+                                   *(labels + (('status', status), )))
+            if backend.hostgroup_id == self.writer_hostgroup_id \
+                    and backend.status == BackendStatus.online:
+                writer.add(1, *labels)
+        return [backend_status, writer]
+
+    def _pass_families(self):
+        families = []
+        _, duration, ended_at = self._last_pass
+        if duration is not None:
+            duration_family = _Family('register_duration_seconds', 'gauge',
+                                      'Time the last register pass took.')
+            duration_family.add(duration)
+            last_pass = _Family('register_last_pass_timestamp_seconds',
+                                'gauge',
+                                'Time when the last register pass ended.')
+            last_pass.add(ended_at)
+            families.extend([duration_family, last_pass])
+        for counter, name, help_text in PASS_COUNTERS:
+            family = _Family(name, 'counter', help_text)
+            family.add(self._counters[counter])
+            families.append(family)
+        return families
+
+
+def render(metrics):
+    """
+    Metrics of several clusters in Prometheus text exposition format.
+    Samples of the same metric are rendered in one family.
+
+    :param metrics: Metrics of each cluster.
+    :type metrics: list(RegisterMetrics)
+    :rtype: str
+    """
+    families = OrderedDict()
+    for cluster_metrics in metrics:
+        for family in cluster_metrics.families():
+            if family.name in families:
+                families[family.name].samples.extend(family.samples)
+            else:
+                families[family.name] = family
+    return '\n'.join(family.render()
+                     for family in families.itervalues()) + '\n'
+
+
+def start_metrics_server(metrics, port, host=''):
+    """
+    Serve metrics on ``http://host:port/metrics`` in a background thread.
+
+    :param metrics: Metrics to serve, one per cluster.
+    :type metrics: RegisterMetrics or list(RegisterMetrics)
+    :param port: TCP port to listen on.
+    :type port: int
+    :param host: Address to listen on. All interfaces by default.
+    :type host: str
+    :return: Running server. Call its ``shutdown()`` to stop it.
+    :rtype: HTTPServer
+    """
+    # Only the daemon serves metrics. One-shot commands run by
+    # ProxySQL scheduler don't pay for importing the HTTP server.
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+    if isinstance(metrics, RegisterMetrics):
+        metrics = [metrics]
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """Handler of scrape requests."""
+        def do_GET(self):  # pylint: disable=invalid-name
+            """Return metrics on /metrics and 404 on anything else."""
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render(metrics)
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):  # pylint: disable=arguments-differ
+            LOG.debug('Metrics request from %s: %s',
+                      self.client_address[0], fmt % args)
+
+    server = HTTPServer((host, port), MetricsHandler)
+    thread = Thread(target=server.serve_forever, name='metrics')
+    thread.daemon = True
+    thread.start()
+    LOG.info('Serving metrics on port %d', server.server_address[1])
+    return server
@@ -1,17 +1,31 @@
 """Class BackendSet implementation."""
 
 from abc import abstractmethod
+from collections import OrderedDict
 
 
 class BackendSet(object):
-    """Base class for sets of nodes and backends"""
+    """
+    Base class for sets of nodes and backends.
+
+    Members are indexed by a key (see :meth:`_key`), so lookup,
+    membership test and removal take constant time. The set keeps
+    the order in which members were added. A member must not change
+    its key attributes while it's in the set.
+
+    Every ``iter()`` of the set returns an independent iterator, so the set
+    can be iterated in nested loops and shared between callers.
+    Slicing returns a new set of the same class.
+    """
 
     def __init__(self):
+        self._backends = OrderedDict()
+        # Members in order. It's built on demand after the set changes
+        # and never modified, so iterators that are in flight aren't affected.
         self._backend_list = []
-        self._set_iterator = 0
 
     def __len__(self):
-        return len(self._backend_list)
+        return len(self._backends)
 
     def __contains__(self, item):
         for backend in item:
@@ -20,33 +34,37 @@ class BackendSet(object):
         return True
 
     def __eq__(self, other):
-        return other == self._backend_list
+        if not isinstance(other, BackendSet):
+            return False
+        # noinspection LongLine
+        return self._backends.viewkeys() == other._backends.viewkeys()  # pylint: disable=protected-access
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __iter__(self):
-        return self
-
-    def next(self):
-        """Return next Backend"""
-        try:
-            backend = self._backend_list[self._set_iterator]
-            self._set_iterator += 1
-            return backend
-        except IndexError:
-            self._set_iterator = 0
-            raise StopIteration()
+        return iter(self._members())
 
     def __getitem__(self, key):
-        if isinstance(key, int):
-            return self._backend_list[key]
-
-    def __getslice__(self, i, j):
-        backend_set = BackendSet()
-        # noinspection LongLine
-        backend_set._backend_list = self._backend_list[i:j]  # pylint: disable=protected-access
-        return backend_set
+        if isinstance(key, slice):
+            backend_set = self.__class__()
+            backend_set.add_set(self._members()[key])
+            return backend_set
+        return self._members()[key]
+
+    def _members(self):
+        """List of members in order."""
+        if self._backend_list is None:
+            self._backend_list = self._backends.values()
+        return self._backend_list
+
+    @staticmethod
+    def _key(backend):
+        """
+        Key that identifies a member. Sets of particular backends
+        override it with a tuple of the backend's primary key.
+        """
+        return backend
 
     def add_set(self, backend_set):
         """
@@ -56,15 +74,29 @@ class BackendSet(object):
         :type backend_set:
         """
         for backend in backend_set:
-            self._backend_list.append(backend)
+            self.add(backend)
 
     def add(self, backend):
         """
-        Add backend
+        Add backend. Adding a backend that is already in the set
+        does nothing.
 
         :param backend: Backend
         """
-        self._backend_list.append(backend)
+        key = self._key(backend)
+        if key not in self._backends:
+            self._backends[key] = backend
+            self._backend_list = None
+
+    def _pop(self, backend):
+        """
+        Remove backend from the set and return it.
+
+        :raise KeyError: if backend is not in the set
+        """
+        member = self._backends.pop(self._key(backend))
+        self._backend_list = None
+        return member
 
     @abstractmethod
     def remove(self, backend):
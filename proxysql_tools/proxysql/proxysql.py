@@ -1,17 +1,96 @@
 """ProxySQL classes"""
-import json
 from contextlib import contextmanager
 
 import pymysql
 from pymysql.cursors import DictCursor
+from pymysql.err import MySQLError
 
-from proxysql_tools import LOG, execute
+from proxysql_tools import LOG
+from proxysql_tools.connection import ReusedConnection, execute_reconnecting
 from proxysql_tools.proxysql.exceptions import ProxySQLBackendNotFound, \
     ProxySQLUserNotFound
-from proxysql_tools.proxysql.proxysqlbackend import ProxySQLMySQLBackend
+from proxysql_tools.proxysql.proxysqlbackend import ProxySQLMySQLBackend, \
+    MYSQL_SERVERS_COLUMNS
 from proxysql_tools.proxysql.proxysqlbackendset import ProxySQLMySQLBackendSet
+from proxysql_tools.stats import STATS
 
 PROXYSQL_CONNECT_TIMEOUT = 20
+# A reused admin connection that has been idle for longer than
+# this many seconds is pinged before it is handed out.
+PROXYSQL_PING_INTERVAL = 10
+# Number of users written by one REPLACE statement in ProxySQL.add_users().
+PROXYSQL_USERS_BATCH_SIZE = 500
+
+MYSQL_USERS_COLUMNS = ('username', 'password', 'active', 'use_ssl',
+                       'default_hostgroup', 'default_schema',
+                       'schema_locked', 'transaction_persistent',
+                       'fast_forward', 'backend', 'frontend',
+                       'max_connections')
+
+
+def _column_list(columns):
+    return ', '.join('`%s`' % column for column in columns)
+
+
+def _row_placeholders(columns):
+    return '(%s)' % ', '.join(['%s'] * len(columns))
+
+
+# Templates of admin queries. Values are always passed as arguments
+# of ProxySQL.execute() and escaped by the client library.
+# ProxySQL admin interface doesn't support server side prepared statements.
+SELECT_SERVERS = 'SELECT %s FROM `mysql_servers`' \
+                 % _column_list(MYSQL_SERVERS_COLUMNS)
+SELECT_SERVER_KEY = 'SELECT `hostgroup_id`, `hostname`, `port` ' \
+                    'FROM `mysql_servers`'
+REPLACE_SERVERS = 'REPLACE INTO `mysql_servers`(%s) VALUES ' \
+                  % _column_list(MYSQL_SERVERS_COLUMNS)
+SERVERS_ROW = _row_placeholders(MYSQL_SERVERS_COLUMNS)
+DELETE_SERVERS = 'DELETE FROM `mysql_servers` WHERE '
+SERVER_KEY = '(`hostgroup_id` = %s AND `hostname` = %s AND `port` = %s)'
+HOSTGROUP_KEY = '`hostgroup_id` = %s'
+RESTORE_SERVERS = 'INSERT INTO `mysql_servers`(%s) SELECT %s ' \
+                  'FROM `runtime_mysql_servers` WHERE ' \
+                  % (_column_list(MYSQL_SERVERS_COLUMNS),
+                     _column_list(MYSQL_SERVERS_COLUMNS))
+
+SELECT_USERS = 'SELECT %s FROM `mysql_users`' \
+               % _column_list(MYSQL_USERS_COLUMNS)
+# One page of users ordered by the primary key of mysql_users,
+# starting after the given (username, backend).
+USERS_PAGE_ORDER = ' ORDER BY `username`, `backend` LIMIT %d'
+USERS_PAGE_AFTER = ' WHERE `username` > %s ' \
+                   'OR (`username` = %s AND `backend` > %s)'
+REPLACE_USERS = 'REPLACE INTO `mysql_users`(%s) VALUES ' \
+                % _column_list(MYSQL_USERS_COLUMNS)
+USERS_ROW = _row_placeholders(MYSQL_USERS_COLUMNS)
+DELETE_USER = 'DELETE FROM `mysql_users` WHERE `username` = %s'
+
+_STATEMENTS = {}
+
+
+def _statement(prefix, item, count, separator):
+    """
+    Statement made of prefix and count items joined by separator.
+    Statements are cached, so a batch of the same size reuses
+    the statement string.
+    """
+    key = (prefix, item, count, separator)
+    try:
+        return _STATEMENTS[key]
+    except KeyError:
+        statement = prefix + separator.join([item] * count)
+        _STATEMENTS[key] = statement
+        return statement
+
+
+class _Changeset(object):  # pylint: disable=too-few-public-methods
+    """State of open changesets of a ProxySQL instance."""
+    __slots__ = ('depth', 'servers_changed')
+
+    def __init__(self):
+        self.depth = 0
+        self.servers_changed = False
 
 
 # noinspection LongLine
@@ -69,6 +148,8 @@ class ProxySQLMySQLUser(object):  # pylint: disable=too-many-instance-attributes
 
 .. _hostgroup: http://bit.ly/2rGnT5i
     """
+    __slots__ = MYSQL_USERS_COLUMNS
+
     def __init__(self, username='root', password=None, active=True,  # pylint: disable=too-many-arguments
                  use_ssl=False,
                  default_hostgroup=0, default_schema='information_schema',
@@ -88,6 +169,21 @@ class ProxySQLMySQLUser(object):  # pylint: disable=too-many-instance-attributes
         self.frontend = bool(int(frontend))
         self.max_connections = int(max_connections)
 
+    @classmethod
+    def from_row(cls, row):
+        """
+        Create user from a ``mysql_users`` row.
+
+        :param row: Row with all columns of ``mysql_users``.
+        :type row: dict
+        :rtype: ProxySQLMySQLUser
+        """
+        return cls(row['username'], row['password'], row['active'],
+                   row['use_ssl'], row['default_hostgroup'],
+                   row['default_schema'], row['schema_locked'],
+                   row['transaction_persistent'], row['fast_forward'],
+                   row['backend'], row['frontend'], row['max_connections'])
+
     def __eq__(self, other):
         return all(
             (
@@ -109,8 +205,21 @@ class ProxySQLMySQLUser(object):  # pylint: disable=too-many-instance-attributes
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def as_row(self):
+        """
+        Values of the user in order of :data:`MYSQL_USERS_COLUMNS`
+        ready to be written to ``mysql_users``.
+
+        :rtype: tuple
+        """
+        return (self.username, self.password, int(self.active),
+                int(self.use_ssl), self.default_hostgroup,
+                self.default_schema, int(self.schema_locked),
+                int(self.transaction_persistent), int(self.fast_forward),
+                int(self.backend), int(self.frontend), self.max_connections)
 
-class ProxySQL(object):
+
+class ProxySQL(object):  # pylint: disable=too-many-public-methods
     """
     ProxySQL describes a single ProxySQL instance.
 
@@ -119,11 +228,13 @@ class ProxySQL(object):
     :param user: ProxySQL admin user.
     :param password: Password for ProxySQL admin.
     :param socket: Socket to connect to ProxySQL admin interface.
+    :param timeout: Seconds to wait for ProxySQL to answer a query.
+        None waits as long as it takes.
     """
 
     # noinspection LongLine
     def __init__(self, host='localhost', port=3306, user='root',  # pylint: disable=too-many-arguments
-                 password=None, socket=None):
+                 password=None, socket=None, timeout=None):
 
         self.host = host
         self.port = int(port)
@@ -131,6 +242,15 @@ class ProxySQL(object):
         self.password = password
         self.socket = socket
 
+        self._connection = ReusedConnection(
+            lambda: pymysql.connect(**self._connect_args(timeout)),
+            'proxysql', PROXYSQL_PING_INTERVAL
+        )
+
+        # Changed only by the thread that holds the connection lock,
+        # see changeset()
+        self._changeset = _Changeset()
+
     def ping(self):
         """Check health of ProxySQL.
 
@@ -144,7 +264,9 @@ class ProxySQL(object):
             return False
 
     def execute(self, query, *args):
-        """Execute query in ProxySQL.
+        """Execute query in ProxySQL. If the admin connection is lost,
+        a read-only query is retried on a new one, see
+        :func:`execute_reconnecting`.
 
         :param query: Query to execute.
         :type query: str
@@ -152,8 +274,13 @@ class ProxySQL(object):
             to return result
         :rtype: dict
         """
-        with self._connect() as conn:
-            return execute(conn, query, *args)
+        with STATS.query('proxysql', query):
+            return execute_reconnecting(self._connect, query, *args)
+
+    def close(self):
+        """Close the admin connection if it's open.
+        The next query will open a new one."""
+        self._connection.close()
 
     def reload_users(self):
         """
@@ -169,6 +296,23 @@ class ProxySQL(object):
         """
         self.execute('LOAD MYSQL SERVERS TO RUNTIME')
 
+    def discard_servers(self, hostgroup_ids=None):
+        """
+        Replaces MySQL servers in the in-memory database with
+        the runtime data structures, i.e. drops not loaded changes.
+
+        :param hostgroup_ids: Drop changes of these hostgroups only.
+            Rows of other hostgroups keep their changes.
+        :type hostgroup_ids: list(int)
+        """
+        if not hostgroup_ids:
+            self.execute('LOAD MYSQL SERVERS FROM RUNTIME')
+            return
+        condition = _statement('', HOSTGROUP_KEY, len(hostgroup_ids),
+                               ' OR ')
+        self.execute(DELETE_SERVERS + condition, list(hostgroup_ids))
+        self.execute(RESTORE_SERVERS + condition, list(hostgroup_ids))
+
     def reload_variables(self):
         """
         Loads MySQL variables from the in-memory database
@@ -209,6 +353,52 @@ class ProxySQL(object):
         self.save_servers()
         self.save_variables()
 
+    @contextmanager
+    def changeset(self):
+        """
+        Group changes of ``mysql_servers`` and load them to runtime once.
+
+        Inside the block register_backend(), update_backend() and
+        deregister_backend() change only the in-memory table.
+        When the outermost block exits, all changes are loaded
+        to runtime with a single ``LOAD MYSQL SERVERS TO RUNTIME``.
+        If the block raises an exception, the changes are discarded
+        and the runtime configuration stays intact.
+
+        The thread that opens a changeset holds the admin connection
+        until the outermost block exits. Queries of other threads wait,
+        so their changes are neither loaded nor discarded with it.
+
+        .. code-block:: python
+
+            with proxysql.changeset():
+                proxysql.update_backend(old_writer)
+                proxysql.register_backend(new_writer)
+        """
+        with self._connection.lock:
+            self._changeset.depth += 1
+            completed = False
+            try:
+                yield self
+                completed = True
+            finally:
+                self._changeset.depth -= 1
+                if self._changeset.depth == 0 \
+                        and self._changeset.servers_changed:
+                    self._changeset.servers_changed = False
+                    self._close_changeset(completed)
+
+    def _close_changeset(self, completed):
+        """Load changes of the outermost changeset or discard them."""
+        if completed:
+            self.reload_servers()
+            return
+        LOG.warning('Discarding not applied changes of mysql_servers')
+        try:
+            self.discard_servers()
+        except MySQLError as err:
+            LOG.error('Failed to discard changes: %s', err)
+
     def get_users(self):
         """
         Get mysql users
@@ -216,27 +406,33 @@ class ProxySQL(object):
         :return: List of users or empty list
         :rtype: list(ProxySQLMySQLUser)
         """
-        query = "SELECT * FROM mysql_users"
-        result = self.execute(query)
-        users = []
-        for row in result:
-            kwargs = {
-                'username': row['username'],
-                'password': row['password'],
-                'active': row['active'],
-                'use_ssl': row['use_ssl'],
-                'default_hostgroup': row['default_hostgroup'],
-                'default_schema': row['default_schema'],
-                'schema_locked': row['schema_locked'],
-                'transaction_persistent': row['transaction_persistent'],
-                'fast_forward': row['fast_forward'],
-                'backend': row['backend'],
-                'frontend': row['frontend'],
-                'max_connections': row['max_connections']
-            }
-            user = ProxySQLMySQLUser(**kwargs)
-            users.append(user)
-        return users
+        result = self.execute(SELECT_USERS)
+        return [ProxySQLMySQLUser.from_row(row) for row in result]
+
+    def iter_users(self, page_size=PROXYSQL_USERS_BATCH_SIZE):
+        """
+        Iterate over mysql users. Unlike :meth:`get_users` users are read
+        in pages of ``page_size`` as the caller consumes them, so the whole
+        table is never kept in memory. The admin connection is free
+        between pages: the caller may run other queries while iterating
+        or stop early.
+
+        :param page_size: Number of users read by one query.
+        :type page_size: int
+        :return: Generator of users.
+        :rtype: generator(ProxySQLMySQLUser)
+        """
+        order = USERS_PAGE_ORDER % page_size
+        rows = self.execute(SELECT_USERS + order)
+        while rows:
+            for row in rows:
+                yield ProxySQLMySQLUser.from_row(row)
+            if len(rows) < page_size:
+                break
+            last = rows[-1]
+            rows = self.execute(SELECT_USERS + USERS_PAGE_AFTER + order,
+                                (last['username'], last['username'],
+                                 int(last['backend'])))
 
     def get_user(self, username):
         """
@@ -247,29 +443,12 @@ class ProxySQL(object):
         :rtype: ProxySQLMySQLUser
         :raise: ProxySQLUserNotFound
         """
-        result = self.execute("SELECT * FROM mysql_users "
-                              "WHERE username = '{username}'"
-                              .format(username=username))
+        result = self.execute(SELECT_USERS + ' WHERE `username` = %s',
+                              (username, ))
         if not result:
             raise ProxySQLUserNotFound
         else:
-            row = result[0]
-            kwargs = {
-                'username': row['username'],
-                'password': row['password'],
-                'active': row['active'],
-                'use_ssl': row['use_ssl'],
-                'default_hostgroup': row['default_hostgroup'],
-                'default_schema': row['default_schema'],
-                'schema_locked': row['schema_locked'],
-                'transaction_persistent': row['transaction_persistent'],
-                'fast_forward': row['fast_forward'],
-                'backend': row['backend'],
-                'frontend': row['frontend'],
-                'max_connections': row['max_connections']
-            }
-            user = ProxySQLMySQLUser(**kwargs)
-            return user
+            return ProxySQLMySQLUser.from_row(result[0])
 
     def add_user(self, user):
         """
@@ -278,34 +457,47 @@ class ProxySQL(object):
         :param user: user for add
         :type user: ProxySQLMySQLUser
         """
-        kwargs = {
-            'username': user.username,
-            'password': user.password,
-            'active': int(user.active),
-            'use_ssl': int(user.use_ssl),
-            'default_hostgroup': int(user.default_hostgroup),
-            'default_schema': user.default_schema,
-            'schema_locked': int(user.schema_locked),
-            'transaction_persistent': int(user.transaction_persistent),
-            'fast_forward': int(user.fast_forward),
-            'backend': int(user.backend),
-            'frontend': int(user.frontend),
-            'max_connections': user.max_connections
-        }
-        query = "REPLACE INTO mysql_users(" \
-                "`username`, `password`, `active`, " \
-                "`use_ssl`, `default_hostgroup`, `default_schema`, " \
-                "`schema_locked`, `transaction_persistent`, `fast_forward`, " \
-                "`backend`, `frontend`, `max_connections`) " \
-                "VALUES(" \
-                "'{username}', '{password}', {active}, " \
-                "{use_ssl}, {default_hostgroup}, '{default_schema}', " \
-                "{schema_locked}, {transaction_persistent}, {fast_forward}, " \
-                "{backend}, {frontend}, {max_connections})" \
-                "".format(**kwargs)
-        self.execute(query)
-        self.reload_users()
-        self.save_users()
+        self.add_users([user])
+
+    def add_users(self, users, batch_size=PROXYSQL_USERS_BATCH_SIZE):
+        """
+        Add or replace many MySQL users. Users are written with multi-row
+        REPLACE statements of ``batch_size`` rows. mysql_users are loaded
+        to runtime and saved to disk once, after all users are written.
+        If writing fails, changes that are not applied yet are discarded.
+
+        :param users: Iterable of users. It may be a generator.
+        :type users: iterable(ProxySQLMySQLUser)
+        :param batch_size: Number of users in one statement.
+        :type batch_size: int
+        :return: Number of written users.
+        :rtype: int
+        """
+        count = 0
+        batch = []
+        try:
+            for user in users:
+                batch.append(user.as_row())
+                if len(batch) == batch_size:
+                    self._write_rows(REPLACE_USERS, USERS_ROW, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self._write_rows(REPLACE_USERS, USERS_ROW, batch)
+                count += len(batch)
+        except Exception:
+            if count:
+                LOG.warning('Discarding not applied changes of mysql_users')
+                try:
+                    self.execute('LOAD MYSQL USERS FROM RUNTIME')
+                except MySQLError as err:
+                    LOG.error('Failed to discard changes: %s', err)
+            raise
+
+        if count:
+            self.reload_users()
+            self.save_users()
+        return count
 
     def delete_user(self, username):
         """
@@ -314,8 +506,7 @@ class ProxySQL(object):
         :param username: username of user
         :type username: str
         """
-        self.execute("DELETE FROM mysql_users WHERE username='{username}'"
-                     .format(username=username))
+        self.execute(DELETE_USER, (username, ))
         self.reload_users()
         self.save_users()
 
@@ -325,33 +516,20 @@ class ProxySQL(object):
         :param backend: Galera node.
         :type backend: ProxySQLMySQLBackend
         """
-        comment = self._get_comment(backend)
-        kwargs = {
-            'hostgroup_id': int(backend.hostgroup_id),
-            'hostname': pymysql.escape_string(backend.hostname),
-            'port': int(backend.port),
-            'status': backend.status,
-            'weight': int(backend.weight),
-            'compression': int(backend.compression),
-            'max_connections': int(backend.max_connections),
-            'max_replication_lag': int(backend.max_replication_lag),
-            'use_ssl': int(backend.use_ssl),
-            'max_latency_ms': int(backend.max_latency_ms),
-            'comment': comment
-        }
-        query = "REPLACE INTO mysql_servers(" \
-                "`hostgroup_id`, `hostname`, `port`, " \
-                "`status`, `weight`, `compression`, " \
-                "`max_connections`, `max_replication_lag`, `use_ssl`, " \
-                "`max_latency_ms`, `comment`) " \
-                "VALUES(" \
-                "{hostgroup_id}, '{hostname}', {port}, " \
-                "'{status}', {weight}, {compression}, " \
-                "{max_connections}, {max_replication_lag}, {use_ssl}, " \
-                "{max_latency_ms}, '{comment}')" \
-                "".format(**kwargs)
-        self.execute(query)
-        self.reload_servers()
+        self.register_backends([backend])
+
+    def register_backends(self, backends):
+        """
+        Add or replace backends in ``mysql_servers``
+        with one multi-row statement.
+
+        :param backends: Backends to write.
+        :type backends: list(ProxySQLMySQLBackend)
+        """
+        if backends:
+            self._write_rows(REPLACE_SERVERS, SERVERS_ROW,
+                             [backend.as_row() for backend in backends])
+            self._servers_modified()
 
     def update_backend(self, backend):
         """
@@ -367,16 +545,24 @@ class ProxySQL(object):
         :param backend: Galera node.
         :type backend: ProxySQLMySQLBackend
         """
-        query = "DELETE FROM mysql_servers " \
-                "WHERE" \
-                " hostgroup_id={hostgroup_id}" \
-                " AND hostname='{hostname}'" \
-                " AND port={port}" \
-                "".format(hostgroup_id=int(backend.hostgroup_id),
-                          hostname=pymysql.escape_string(backend.hostname),
-                          port=int(backend.port))
-        self.execute(query)
-        self.reload_runtime()
+        self.deregister_backends([backend])
+
+    def deregister_backends(self, backends):
+        """
+        Delete backends from ``mysql_servers`` with one statement.
+
+        :param backends: Backends to delete.
+        :type backends: list(ProxySQLMySQLBackend)
+        """
+        if backends:
+            args = []
+            for backend in backends:
+                args.extend((backend.hostgroup_id, backend.hostname,
+                             backend.port))
+            self.execute(_statement(DELETE_SERVERS, SERVER_KEY,
+                                    len(backends), ' OR '),
+                         args)
+            self._servers_modified()
 
     def find_backends(self, hostgroup_id=None, status=None):
         """
@@ -391,36 +577,25 @@ class ProxySQL(object):
         :rtype: ProxySQLMySQLBackendSet
         :raise: ProxySQLBackendNotFound
         """
-        query = 'SELECT ' \
-                '`hostgroup_id`, `hostname`, `port`, ' \
-                '`status`, `weight`, `compression`, ' \
-                '`max_connections`, `max_replication_lag`, `use_ssl`, ' \
-                '`max_latency_ms`, `comment` ' \
-                'FROM `mysql_servers` ' \
-                'WHERE 1=1'
+        conditions = []
+        args = []
         if hostgroup_id:
-            query += ' AND hostgroup_id = %d' % hostgroup_id
-
+            conditions.append('`hostgroup_id` = %s')
+            args.append(hostgroup_id)
         if status:
-            query += " AND status = '%s'" % status
+            conditions.append('`status` = %s')
+            args.append(status)
+
+        if conditions:
+            result = self.execute(SELECT_SERVERS + ' WHERE ' +
+                                  ' AND '.join(conditions),
+                                  args)
+        else:
+            result = self.execute(SELECT_SERVERS)
 
-        result = self.execute(query)
         backends = ProxySQLMySQLBackendSet()
         for row in result:
-            kwargs = {
-                'hostgroup_id': row['hostgroup_id'],
-                'port': row['port'],
-                'status': row['status'],
-                'weight': row['weight'],
-                'compression': row['compression'],
-                'max_connections': row['max_connections'],
-                'max_replication_lag': row['max_replication_lag'],
-                'use_ssl': row['use_ssl'],
-                'max_latency_ms': row['max_latency_ms'],
-                'comment': row['comment']
-            }
-            backend = ProxySQLMySQLBackend(row['hostname'], **kwargs)
-            backends.add(backend)
+            backends.add(ProxySQLMySQLBackend.from_row(row))
 
         if backends:
             return backends
@@ -435,44 +610,59 @@ class ProxySQL(object):
         :return: True if registered, False otherwise
         :rtype: bool
         """
-
-        query = "SELECT `hostgroup_id`, `hostname`, `port` " \
-                "FROM `mysql_servers` " \
-                "WHERE hostgroup_id = %d  " \
-                "AND `hostname` = '%s'  " \
-                "AND `port` = %s" % \
-                (
-                    int(backend.hostgroup_id),
-                    pymysql.escape_string(backend.hostname),
-                    int(backend.port)
-                )
-        result = self.execute(query)
+        result = self.execute(SELECT_SERVER_KEY + ' WHERE ' + SERVER_KEY,
+                              (backend.hostgroup_id, backend.hostname,
+                               backend.port))
         return result != ()
 
-    @staticmethod
-    def _get_comment(backend):
-        """Generate comment in mysql_servers for ProxySQL"""
-        status = {
-            'role': backend.role,
-            'admin_status': backend.admin_status
-        }
-        return json.dumps(status, sort_keys=True)
+    def _write_rows(self, statement, row, rows):
+        """
+        Execute a multi-row statement.
+
+        :param statement: Statement up to the list of rows,
+            e.g. :data:`REPLACE_USERS`.
+        :param row: Placeholders of one row, e.g. :data:`USERS_ROW`.
+        :param rows: Values of rows.
+        :type rows: list(tuple)
+        """
+        args = []
+        for values in rows:
+            args.extend(values)
+        self.execute(_statement(statement, row, len(rows), ', '), args)
+
+    def _servers_modified(self):
+        """Load mysql_servers to runtime now or, if a changeset is open,
+        when it's closed."""
+        with self._connection.lock:
+            if self._changeset.depth:
+                self._changeset.servers_changed = True
+                return
+        self.reload_servers()
 
-    @contextmanager
     def _connect(self):
-        """Connect to ProxySQL admin interface."""
+        """Connect to ProxySQL admin interface.
+
+        The connection is opened on first use and reused by all
+        subsequent queries of this instance, see :class:`ReusedConnection`.
+
+        :return: Context manager that gives the connection.
+        """
+        return self._connection.connect()
+
+    def _connect_args(self, timeout=None):
+        """Arguments for pymysql.connect()"""
         connect_args = {
             'user': self.user,
             'passwd': self.password,
             'connect_timeout': PROXYSQL_CONNECT_TIMEOUT,
             'cursorclass': DictCursor
         }
+        if timeout is not None:
+            connect_args['read_timeout'] = timeout
+            connect_args['write_timeout'] = timeout
         if self.socket is not None:
             connect_args['unix_socket'] = self.socket
         else:
             connect_args['host'] = self.host
             connect_args['port'] = self.port
-
-        conn = pymysql.connect(**connect_args)
-        yield conn
-        conn.close()
+        return connect_args
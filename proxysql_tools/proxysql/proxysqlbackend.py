@@ -5,6 +5,13 @@ import pymysql
 from pymysql.cursors import DictCursor
 
 from proxysql_tools import execute
+from proxysql_tools.stats import STATS
+
+
+MYSQL_SERVERS_COLUMNS = ('hostgroup_id', 'hostname', 'port', 'status',
+                         'weight', 'compression', 'max_connections',
+                         'max_replication_lag', 'use_ssl', 'max_latency_ms',
+                         'comment')
 
 
 class BackendStatus(object):  # pylint: disable=too-few-public-methods
@@ -48,6 +55,11 @@ class ProxySQLMySQLBackend(object):  # pylint: disable=too-many-instance-attribu
         PRIMARY KEY (hostgroup_id, hostname, port) )
 
     """
+    __slots__ = ('hostname', 'hostgroup_id', 'port', 'status', 'weight',
+                 'compression', 'max_connections', 'max_replication_lag',
+                 'use_ssl', 'max_latency_ms', 'comment',
+                 '_role', '_admin_status', '_comment_parsed', '_connection')
+
     def __init__(self, hostname, hostgroup_id=0, port=3306,  # pylint: disable=too-many-arguments
                  status=BackendStatus.online,
                  weight=1, compression=0, max_connections=10000,
@@ -65,30 +77,55 @@ class ProxySQLMySQLBackend(object):  # pylint: disable=too-many-instance-attribu
         self.max_latency_ms = int(max_latency_ms)
         self._connection = None
         self.comment = comment
+        self._role = None
         self._admin_status = None
-        try:
-            if comment == 'Writer':
-                self.role = BackendRole.writer
-            elif comment == 'Reader':
-                self.role = BackendRole.reader
-            else:
-                self.role = json.loads(comment)['role']
-                if not self.role:
-                    self.role = None
-        except (TypeError, KeyError, ValueError):
-            self.role = None
+        # Comments in the old format are plain role names.
+        # The JSON ones are parsed when role or admin_status is needed.
+        if comment in (BackendRole.writer, BackendRole.reader):
+            self._role = comment
+            self._admin_status = status
+            self._comment_parsed = True
+        else:
+            self._comment_parsed = False
 
+    @classmethod
+    def from_row(cls, row):
+        """
+        Create backend from a ``mysql_servers`` row.
+
+        :param row: Row with all columns of ``mysql_servers``.
+        :type row: dict
+        :rtype: ProxySQLMySQLBackend
+        """
+        return cls(row['hostname'], row['hostgroup_id'], row['port'],
+                   row['status'], row['weight'], row['compression'],
+                   row['max_connections'], row['max_replication_lag'],
+                   row['use_ssl'], row['max_latency_ms'], row['comment'])
+
+    def as_row(self):
+        """
+        Values of the backend in order of :data:`MYSQL_SERVERS_COLUMNS`
+        ready to be written to ``mysql_servers``. The comment keeps
+        role and admin_status of the backend.
+
+        :rtype: tuple
+        """
+        comment = json.dumps({'role': self.role,
+                              'admin_status': self.admin_status},
+                             sort_keys=True)
+        return (self.hostgroup_id, self.hostname, self.port, self.status,
+                self.weight, self.compression, self.max_connections,
+                self.max_replication_lag, int(self.use_ssl),
+                self.max_latency_ms, comment)
+
+    def _parse_comment(self):
+        self._comment_parsed = True
         try:
-            if comment == 'Writer':
-                self._admin_status = status
-            elif comment == 'Reader':
-                self._admin_status = status
-            else:
-                self.admin_status = json.loads(comment)['admin_status']
-                if not self.admin_status:
-                    self.admin_status = None
-        except (TypeError, KeyError, ValueError):
-            self._admin_status = None
+            comment = json.loads(self.comment)
+            self._role = comment.get('role') or None
+            self._admin_status = comment.get('admin_status') or None
+        except (TypeError, ValueError, AttributeError):
+            pass
 
     def __eq__(self, other):
         try:
@@ -105,6 +142,9 @@ class ProxySQLMySQLBackend(object):  # pylint: disable=too-many-instance-attribu
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash((self.hostgroup_id, self.hostname, self.port))
+
     def __repr__(self):
         return "%d__%s__%d" % (self.hostgroup_id, self.hostname, self.port)
 
@@ -134,10 +174,26 @@ class ProxySQLMySQLBackend(object):  # pylint: disable=too-many-instance-attribu
                "max_latency_ms={max_latency_ms}, " \
                "comment={comment}".format(**kwargs)
 
+    def _get_role(self):
+        if not self._comment_parsed:
+            self._parse_comment()
+        return self._role
+
+    def _set_role(self, role):
+        if not self._comment_parsed:
+            self._parse_comment()
+        self._role = role
+
+    role = property(_get_role, _set_role, None, 'Role of backend')
+
     def _get_admin_status(self):
+        if not self._comment_parsed:
+            self._parse_comment()
         return self._admin_status
 
     def _set_admin_status(self, admin_status):
+        if not self._comment_parsed:
+            self._parse_comment()
         self._admin_status = admin_status
         if admin_status:
             self.status = admin_status
@@ -150,6 +206,59 @@ class ProxySQLMySQLBackend(object):  # pylint: disable=too-many-instance-attribu
                             _del_admin_status,
                             'Admin status of backend')
 
+    def copy(self, **kwargs):
+        """
+        Make a copy of the backend.
+
+        :param kwargs: Attributes to change in the copy, e.g. status or role.
+        :return: New backend.
+        :rtype: ProxySQLMySQLBackend
+        """
+        backend = ProxySQLMySQLBackend(self.hostname,
+                                       hostgroup_id=self.hostgroup_id,
+                                       port=self.port,
+                                       status=self.status,
+                                       weight=self.weight,
+                                       compression=self.compression,
+                                       max_connections=self.max_connections,
+                                       max_replication_lag=
+                                       self.max_replication_lag,
+                                       use_ssl=self.use_ssl,
+                                       max_latency_ms=self.max_latency_ms,
+                                       comment=self.comment)
+        # pylint: disable=protected-access
+        backend._role = self.role
+        backend._admin_status = self.admin_status
+        backend._comment_parsed = True
+        for attribute, value in kwargs.iteritems():
+            setattr(backend, attribute, value)
+        return backend
+
+    def same_config(self, other):
+        """
+        Compare all fields of two backends that are stored in ProxySQL.
+        Unlike ``==`` which compares only the primary key.
+
+        :param other: Backend to compare with.
+        :type other: ProxySQLMySQLBackend
+        :return: True if writing other to ``mysql_servers``
+            wouldn't change the row of this backend.
+        :rtype: bool
+        """
+        return self == other and all(
+            (
+                self.status == other.status,
+                self.weight == other.weight,
+                self.compression == other.compression,
+                self.max_connections == other.max_connections,
+                self.max_replication_lag == other.max_replication_lag,
+                self.use_ssl == other.use_ssl,
+                self.max_latency_ms == other.max_latency_ms,
+                self.role == other.role,
+                self.admin_status == other.admin_status
+            )
+        )
+
     def connect(self, username, password):
         """
         Make a MySQL connection to the backend.
@@ -164,7 +273,8 @@ class ProxySQLMySQLBackend(object):  # pylint: disable=too-many-instance-attribu
             'passwd': password,
             'cursorclass': DictCursor
         }
-        self._connection = pymysql.connect(**connection_args)
+        with STATS.connect(self._source()):
+            self._connection = pymysql.connect(**connection_args)
 
     def execute(self, query, *args):
         """Execute query in MySQL Backend.
@@ -175,4 +285,9 @@ class ProxySQLMySQLBackend(object):  # pylint: disable=too-many-instance-attribu
             to return result
         :rtype: dict
         """
-        return execute(self._connection, query, *args)
+        with STATS.query(self._source(), query):
+            return execute(self._connection, query, *args)
+
+    def _source(self):
+        """Name of the backend in query statistics."""
+        return '%s:%d' % (self.hostname, self.port)
@@ -9,11 +9,15 @@ class ProxySQLMySQLBackendSet(BackendSet):
 
     def __contains__(self, item):
         if isinstance(item, ProxySQLMySQLBackend):
-            return item in self._backend_list
+            return self._key(item) in self._backends
         elif isinstance(item, ProxySQLMySQLBackendSet):
             return super(ProxySQLMySQLBackendSet, self).__contains__(item)
         return False
 
+    @staticmethod
+    def _key(backend):
+        return backend.hostgroup_id, backend.hostname, backend.port
+
     def find(self, host, hostgroup_id=0, port=3306):
         """
         Find backend by host and port
@@ -25,13 +29,12 @@ class ProxySQLMySQLBackendSet(BackendSet):
         :rtype: ProxySQLMySQLBackend
         :raises: ProxySQLBackendNotFound
         """
-        needle = ProxySQLMySQLBackend(host,
-                                      hostgroup_id=hostgroup_id,
-                                      port=port)
-        for backend in self._backend_list:
-            if backend == needle:
-                return backend
-        raise ProxySQLBackendNotFound('Backend %s not found' % needle)
+        try:
+            return self._backends[(int(hostgroup_id), host, int(port))]
+        except KeyError:
+            raise ProxySQLBackendNotFound('Backend %d__%s__%d not found'
+                                          % (int(hostgroup_id), host,
+                                             int(port)))
 
     def remove(self, backend):
         """Remove backend from the set
@@ -41,6 +44,6 @@ class ProxySQLMySQLBackendSet(BackendSet):
         :raise ProxySQLBackendNotFound: if backend is not in the set
         """
         try:
-            self._backend_list.remove(backend)
-        except ValueError as err:
-            raise ProxySQLBackendNotFound(err)
+            self._pop(backend)
+        except KeyError:
+            raise ProxySQLBackendNotFound('Backend %r not found' % backend)
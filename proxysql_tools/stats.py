@@ -0,0 +1,205 @@
+"""
+Counters and latency histograms of queries and connects.
+
+All MySQL I/O goes through ``execute()`` and ``_connect()`` of
+:class:`~proxysql_tools.proxysql.proxysql.ProxySQL`,
+:class:`~proxysql_tools.galera.galera_node.GaleraNode` and
+:class:`~proxysql_tools.proxysql.proxysqlbackend.ProxySQLMySQLBackend`.
+They report to the module level :data:`STATS`. Recording is off
+by default and costs one attribute check per query until
+:meth:`QueryStats.enable` is called.
+"""
+import json
+import re
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+from proxysql_tools import LOG
+
+# Upper bounds of histogram buckets in milliseconds.
+# The last bucket counts everything slower.
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# A group that repeats, e.g. rows of a multi-row REPLACE
+# or primary keys in an OR chain of a DELETE.
+_REPEATED_GROUP = re.compile(r'(\([^()]*\))((?:, | OR )\1)+')
+
+
+def statement_digest(query):
+    """
+    Query text with repeated row and key groups collapsed,
+    so batches of different sizes are accounted as one statement.
+
+    :param query: Query as passed to ``execute()``.
+    :type query: str
+    :rtype: str
+    """
+    query = ' '.join(query.split())
+    return _REPEATED_GROUP.sub(
+        lambda match: match.group(1) + match.group(2)[:-len(match.group(1))]
+        + '...',
+        query
+    )
+
+
+class LatencyStats(object):
+    """Number of calls, errors and latency histogram of one operation."""
+    __slots__ = ('count', 'errors', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, elapsed, failed=False):
+        """
+        Account one call.
+
+        :param elapsed: Seconds the call took.
+        :type elapsed: float
+        :param failed: Whether the call raised an error.
+        :type failed: bool
+        """
+        self.count += 1
+        if failed:
+            self.errors += 1
+        self.total += elapsed
+        if self.min is None or elapsed < self.min:
+            self.min = elapsed
+        if self.max is None or elapsed > self.max:
+            self.max = elapsed
+        elapsed_ms = elapsed * 1000
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def as_dict(self):
+        """
+        :return: Counters with latencies in milliseconds.
+        :rtype: dict
+        """
+        histogram = dict(('le_%d' % bound, count) for bound, count
+                         in zip(LATENCY_BUCKETS, self.buckets))
+        histogram['inf'] = self.buckets[-1]
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_ms': self.total * 1000,
+            'min_ms': (self.min or 0.0) * 1000,
+            'max_ms': (self.max or 0.0) * 1000,
+            'histogram': histogram
+        }
+
+
+class QueryStats(object):
+    """
+    Statistics of queries and connects grouped by source,
+    i.e. ProxySQL or a MySQL server, and statement.
+    It's safe to record from several threads.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._lock = Lock()
+        self._queries = {}
+        self._connects = {}
+
+    def enable(self):
+        """Start recording."""
+        self.enabled = True
+
+    def reset(self):
+        """Drop everything recorded so far."""
+        with self._lock:
+            self._queries = {}
+            self._connects = {}
+
+    @contextmanager
+    def query(self, source, query):
+        """
+        Time the block as a query.
+
+        :param source: Where the query is executed, e.g. ``proxysql``.
+        :type source: str
+        :param query: Query text.
+        :type query: str
+        """
+        with self._measure(self._queries, source,
+                           statement_digest(query) if self.enabled else None):
+            yield
+
+    @contextmanager
+    def connect(self, source):
+        """
+        Time the block as a new connection.
+
+        :param source: Where the connection is opened to.
+        :type source: str
+        """
+        with self._measure(self._connects, source, None):
+            yield
+
+    def as_dict(self):
+        """
+        :return: Everything recorded, slowest in total first.
+        :rtype: dict
+        """
+        with self._lock:
+            queries = [dict(source=source, statement=statement,
+                            **stats.as_dict())
+                       for (source, statement), stats
+                       in self._queries.iteritems()]
+            connects = [dict(source=source, **stats.as_dict())
+                        for (source, _), stats
+                        in self._connects.iteritems()]
+        queries.sort(key=lambda item: item['total_ms'], reverse=True)
+        connects.sort(key=lambda item: item['total_ms'], reverse=True)
+        return {'queries': queries, 'connects': connects}
+
+    def log_summary(self):
+        """Log a table of recorded queries and connects at DEBUG level."""
+        stats = self.as_dict()
+        LOG.debug('%-20s %6s %6s %10s %10s  %s', 'source', 'count',
+                  'errors', 'total, ms', 'max, ms', 'statement')
+        for item in stats['connects'] + stats['queries']:
+            LOG.debug('%-20s %6d %6d %10.1f %10.1f  %s',
+                      item['source'], item['count'], item['errors'],
+                      item['total_ms'], item['max_ms'],
+                      item.get('statement', 'CONNECT'))
+
+    def save(self, path):
+        """
+        Write recorded statistics to a JSON file.
+
+        :param path: File name.
+        :type path: str
+        """
+        with open(path, 'w') as stats_file:
+            json.dump(self.as_dict(), stats_file, indent=4, sort_keys=True)
+
+    @contextmanager
+    def _measure(self, table, source, statement):
+        if not self.enabled:
+            yield
+            return
+        started = time.time()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            elapsed = time.time() - started
+            with self._lock:
+                key = (source, statement)
+                if key not in table:
+                    table[key] = LatencyStats()
+                table[key].add(elapsed, failed=failed)
+
+
+STATS = QueryStats()
@@ -32,10 +32,10 @@ def get_proxysql_options(cfg):
     return kwargs
 
 
-def get_hostgroups_id(cfg):
-    """Get writer and reader hostgroup id's """
-    writer_hostgroup_id = int(cfg.get('galera', 'writer_hostgroup_id'))
-    reader_hostgroup_id = int(cfg.get('galera', 'reader_hostgroup_id'))
+def get_hostgroups_id(cfg, section='galera'):
+    """Get writer and reader hostgroup id's of a Galera cluster section"""
+    writer_hostgroup_id = int(cfg.get(section, 'writer_hostgroup_id'))
+    reader_hostgroup_id = int(cfg.get(section, 'reader_hostgroup_id'))
     return writer_hostgroup_id, reader_hostgroup_id
 
 
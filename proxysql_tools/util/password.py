@@ -0,0 +1,50 @@
+"""MySQL password hashing."""
+import re
+from hashlib import sha1
+
+MYSQL_NATIVE_PASSWORD_HASH = re.compile(r'^\*[0-9A-F]{40}$')
+
+
+def mysql_native_password(password):
+    """
+    Hash password the way MySQL function PASSWORD() does
+    for the ``mysql_native_password`` authentication plugin.
+
+    :param password: Plain text password.
+    :type password: str
+    :return: Hash like ``*2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19``
+        or empty string for empty password.
+    :rtype: str
+    """
+    if not password:
+        return ''
+    if isinstance(password, unicode):
+        password = password.encode('utf-8')
+    return '*' + sha1(sha1(password).digest()).hexdigest().upper()
+
+
+def is_mysql_native_password_hash(value):
+    """
+    Check whether value looks like a hash
+    returned by :func:`mysql_native_password`.
+
+    :param value: Password or hash.
+    :type value: str
+    :rtype: bool
+    """
+    return bool(value) and bool(MYSQL_NATIVE_PASSWORD_HASH.match(value))
+
+
+def hash_password(value):
+    """
+    Hash plain text password unless value is a hash already.
+    ProxySQL keeps hashes of ``mysql_native_password`` in ``mysql_users``.
+
+    :param value: Plain text password or its hash.
+    :type value: str
+    :return: Hash of the password.
+    :rtype: str
+    """
+    if is_mysql_native_password_hash(value):
+        return value
+    return mysql_native_password(value)
@@ -0,0 +1,190 @@
+"""
+Guard against overlapping runs of a command started by a scheduler.
+
+:class:`RunLock` is an exclusive ``flock()`` on a file. The kernel
+releases it when the process exits, however it exits, so a lock
+can't go stale. :class:`RunCounters` keeps counts of skipped and
+overrun runs in a JSON file, because every run is a new process.
+
+Both files are opened without following symlinks and only if they
+belong to the current user, so a file planted in a shared directory
+like /tmp can't redirect the writes. :func:`private_directory` makes
+a directory for them that other users can't write to.
+"""
+import errno
+import fcntl
+import json
+import os
+import stat
+import time
+
+from proxysql_tools import LOG
+
+
+class RunLockError(Exception):
+    """Lock file can't be opened or locked."""
+
+
+def private_directory(path):
+    """
+    Create a directory only the current user may access,
+    or check that an existing one is such.
+
+    :param path: Directory path.
+    :type path: str
+    :raise RunLockError: if the directory can't be created, is a symlink,
+        belongs to another user or is open to other users.
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise RunLockError('Failed to create directory %s: %s'
+                               % (path, err))
+    path_stat = os.lstat(path)
+    if not stat.S_ISDIR(path_stat.st_mode) \
+            or path_stat.st_uid != os.geteuid() \
+            or path_stat.st_mode & 0o077:
+        raise RunLockError('%s must be a directory of uid %d '
+                           'that other users can not access'
+                           % (path, os.geteuid()))
+
+
+def _open_own_file(path):
+    """
+    Open a file of the current user for reading and writing.
+    It's created if it doesn't exist.
+
+    :raise IOError: if the file is a symlink, belongs to another user
+        or can't be opened.
+    """
+    try:
+        descriptor = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW,
+                             0o600)
+    except OSError as err:
+        raise IOError(err.errno, err.strerror, path)
+    own_file = os.fdopen(descriptor, 'r+')
+    file_stat = os.fstat(descriptor)
+    if file_stat.st_uid != os.geteuid() or file_stat.st_nlink != 1:
+        own_file.close()
+        raise IOError(errno.EPERM, 'File belongs to uid %d, '
+                                   'not to this user' % file_stat.st_uid,
+                      path)
+    return own_file
+
+
+class RunLock(object):
+    """
+    Exclusive lock on a file that holds PID of the owner.
+
+    :param path: Path to the lock file. It's created if it doesn't exist.
+        An existing file must belong to the current user.
+    :type path: str
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        """
+        Take the lock without waiting.
+
+        :return: True if the lock is taken, False if another
+            process holds it.
+        :rtype: bool
+        :raise RunLockError: if the lock file can't be opened or locked.
+        """
+        try:
+            lock_file = _open_own_file(self.path)
+        except IOError as err:
+            raise RunLockError('Failed to open lock file %s: %s'
+                               % (self.path, err))
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as err:
+            lock_file.close()
+            if err.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise RunLockError('Failed to lock %s: %s' % (self.path, err))
+        lock_file.truncate(0)
+        lock_file.write('%d\n' % os.getpid())
+        lock_file.flush()
+        self._file = lock_file
+        return True
+
+    def release(self):
+        """Release the lock if it's taken."""
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def owner(self):
+        """
+        PID of the process that took the lock last.
+
+        :return: PID or None if it's unknown.
+        :rtype: int
+        """
+        try:
+            with open(self.path) as lock_file:
+                return int(lock_file.read().strip())
+        except (IOError, ValueError):
+            return None
+
+
+class RunCounters(object):
+    """
+    Counters of events shared by all runs of a command.
+
+    :param path: Path to the JSON file with counters.
+    :type path: str
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def increment(self, name):
+        """
+        Add one to a counter and save the time of the event
+        as ``last_<name>``.
+
+        :param name: Counter name.
+        :type name: str
+        :return: All counters after the change. If the file can't be
+            updated, it's logged and an empty dict is returned.
+        :rtype: dict
+        """
+        try:
+            with _open_own_file(self.path) as counters_file:
+                fcntl.flock(counters_file, fcntl.LOCK_EX)
+                counters = self._parse(counters_file.read())
+                counters[name] = counters.get(name, 0) + 1
+                counters['last_%s' % name] = time.time()
+                counters_file.seek(0)
+                counters_file.truncate(0)
+                json.dump(counters, counters_file, sort_keys=True)
+            return counters
+        except IOError as err:
+            LOG.warning('Failed to update counters in %s: %s',
+                        self.path, err)
+            return {}
+
+    def read(self):
+        """
+        Current counters.
+
+        :rtype: dict
+        """
+        try:
+            with open(self.path) as counters_file:
+                return self._parse(counters_file.read())
+        except IOError:
+            return {}
+
+    @staticmethod
+    def _parse(content):
+        try:
+            counters = json.loads(content)
+        except ValueError:
+            return {}
+        return counters if isinstance(counters, dict) else {}
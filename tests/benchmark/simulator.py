@@ -0,0 +1,175 @@
+"""
+Local stand-ins for ProxySQL and Galera nodes.
+
+ProxySQL admin interface is SQLite under the hood, so
+:class:`SimulatedProxySQL` keeps ``mysql_servers`` and its runtime copy
+in an in-memory SQLite database and counts admin round trips and
+runtime reloads. :class:`SimulatedNode` answers status probes with
+a state set by the benchmark, after an injectable delay or with
+an injectable error.
+"""
+import sqlite3
+import time
+from threading import RLock
+
+from pymysql.err import OperationalError
+
+from proxysql_tools.galera.galera_cluster import GaleraCluster
+from proxysql_tools.galera.galera_node import GaleraNode, GaleraNodeStatus, \
+    GaleraNodeState
+from proxysql_tools.galera.galeranodeset import GaleraNodeSet
+from proxysql_tools.proxysql.proxysql import ProxySQL
+from proxysql_tools.proxysql.proxysqlbackend import MYSQL_SERVERS_COLUMNS
+
+# Definition of mysql_servers in ProxySQL 1.4
+MYSQL_SERVERS_TABLE = """
+CREATE TABLE {name} (
+    hostgroup_id INT CHECK (hostgroup_id>=0) NOT NULL DEFAULT 0,
+    hostname VARCHAR NOT NULL,
+    port INT NOT NULL DEFAULT 3306,
+    status VARCHAR CHECK (UPPER(status) IN
+        ('ONLINE','SHUNNED','OFFLINE_SOFT', 'OFFLINE_HARD'))
+        NOT NULL DEFAULT 'ONLINE',
+    weight INT CHECK (weight >= 0) NOT NULL DEFAULT 1,
+    compression INT CHECK (compression >=0 AND compression <= 102400)
+        NOT NULL DEFAULT 0,
+    max_connections INT CHECK (max_connections >=0) NOT NULL DEFAULT 1000,
+    max_replication_lag INT CHECK (max_replication_lag >= 0
+        AND max_replication_lag <= 126144000) NOT NULL DEFAULT 0,
+    use_ssl INT CHECK (use_ssl IN(0,1)) NOT NULL DEFAULT 0,
+    max_latency_ms INT UNSIGNED CHECK (max_latency_ms>=0)
+        NOT NULL DEFAULT 0,
+    comment VARCHAR NOT NULL DEFAULT '',
+    PRIMARY KEY (hostgroup_id, hostname, port))
+"""
+
+COPY_SERVERS = 'INSERT INTO {dst} SELECT * FROM {src}'
+
+
+class SimulatedProxySQL(ProxySQL):
+    """
+    ProxySQL admin interface backed by in-memory SQLite.
+
+    :param latency: Seconds every admin query takes on top
+        of the SQLite time, i.e. the network round trip.
+    :type latency: float
+    """
+    def __init__(self, latency=0.0):
+        super(SimulatedProxySQL, self).__init__()
+        self.latency = latency
+        self.round_trips = 0
+        self.reloads = 0
+        self._db = sqlite3.connect(':memory:', check_same_thread=False)
+        self._db_lock = RLock()
+        for name in ('mysql_servers', 'runtime_mysql_servers'):
+            self._db.execute(MYSQL_SERVERS_TABLE.format(name=name))
+
+    def reset_counters(self):
+        """Start counting round trips and reloads from zero."""
+        self.round_trips = 0
+        self.reloads = 0
+
+    def execute(self, query, *args):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._db_lock:
+            if query == 'LOAD MYSQL SERVERS TO RUNTIME':
+                self.reloads += 1
+                self._copy_servers('mysql_servers', 'runtime_mysql_servers')
+                return ()
+            elif query == 'LOAD MYSQL SERVERS FROM RUNTIME':
+                self._copy_servers('runtime_mysql_servers', 'mysql_servers')
+                return ()
+            elif query.startswith('LOAD ') or query.startswith('SAVE '):
+                return ()
+
+            params = args[0] if args else ()
+            cursor = self._db.execute(query.replace('%s', '?'), params)
+            self._db.commit()
+            if cursor.description is None:
+                return ()
+            names = [column[0] for column in cursor.description]
+            # The admin interface returns all values as strings
+            return tuple(
+                dict(zip(names, [None if value is None else str(value)
+                                 for value in row]))
+                for row in cursor.fetchall()
+            )
+
+    def runtime_backends(self, hostgroup_id, status='ONLINE'):
+        """
+        Hostnames of runtime backends in a hostgroup.
+
+        :rtype: list(str)
+        """
+        with self._db_lock:
+            cursor = self._db.execute(
+                'SELECT hostname FROM runtime_mysql_servers '
+                'WHERE hostgroup_id = ? AND status = ? ORDER BY hostname',
+                (hostgroup_id, status))
+            return [str(row[0]) for row in cursor.fetchall()]
+
+    def _copy_servers(self, src, dst):
+        self._db.execute('DELETE FROM %s' % dst)
+        self._db.execute(COPY_SERVERS.format(src=src, dst=dst))
+        self._db.commit()
+
+
+class SimulatedNode(GaleraNode):
+    """
+    Galera node that reports ``state`` instead of talking to MySQL.
+
+    :param host: Node hostname.
+    :param latency: Seconds a probe takes.
+    :type latency: float
+    """
+    def __init__(self, host, latency=0.0):
+        super(SimulatedNode, self).__init__(host)
+        self.latency = latency
+        self.state = GaleraNodeState.SYNCED
+        self.error = None
+
+    def snapshot(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error is not None:
+            raise self.error
+        return GaleraNodeStatus({
+            'wsrep_local_state': str(self.state),
+            'wsrep_cluster_status': 'Primary'
+        })
+
+    def execute(self, query, *args):
+        raise OperationalError(2003, 'Simulated node %s has no MySQL' % self)
+
+
+class SimulatedCluster(GaleraCluster):
+    """
+    Galera cluster of simulated nodes node1..nodeN.
+
+    :param size: Number of nodes.
+    :type size: int
+    :param probe_latency: Seconds a probe of every node takes.
+    :type probe_latency: float
+    :param probe_timeout: Seconds a node is given to answer a probe.
+    :type probe_timeout: float
+    """
+    def __init__(self, size, probe_latency=0.0, probe_timeout=1.0):
+        super(SimulatedCluster, self).__init__(
+            ','.join('node%d:3306' % (i + 1) for i in xrange(size)),
+            probe_timeout=probe_timeout
+        )
+        self._nodes = GaleraNodeSet()
+        for i in xrange(size):
+            self._nodes.add(SimulatedNode('node%d' % (i + 1),
+                                          latency=probe_latency))
+
+    def node(self, host):
+        """
+        Simulated node by hostname.
+
+        :rtype: SimulatedNode
+        """
+        return self._nodes.find(host=host, port=3306)[0]
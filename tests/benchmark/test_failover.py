@@ -0,0 +1,200 @@
+"""
+Failover latency of ``galera register`` in single writer mode.
+
+Register passes run back to back against a simulated cluster of three
+nodes and a simulated ProxySQL (see :mod:`simulator`). Every scenario
+starts with node1 as the writer, injects a fault and measures the time
+until ProxySQL runtime has the expected writer, the number of admin
+round trips and the number of ``LOAD MYSQL SERVERS TO RUNTIME``.
+A pass after that must not change anything.
+"""
+from __future__ import print_function
+
+import time
+
+import pytest
+from pymysql.err import OperationalError
+
+from proxysql_tools.cli_entrypoint.galera import register_pass, \
+    register_clusters
+from proxysql_tools.galera.exceptions import GaleraPassTimeout
+from proxysql_tools.galera.galera_node import GaleraNodeState
+
+from .simulator import SimulatedCluster, SimulatedProxySQL
+
+W = 10
+R = 11
+
+# Simulated network round trip to ProxySQL admin interface
+ADMIN_LATENCY = 0.001
+# Simulated time of a status probe of a healthy node
+PROBE_LATENCY = 0.005
+PROBE_TIMEOUT = 0.5
+# A scenario fails if the writer isn't moved in this many passes
+MAX_PASSES = 5
+
+
+def desync(node):
+    node.state = GaleraNodeState.DONOR
+
+
+def crash(node):
+    node.error = OperationalError(2003, "Can't connect to %s" % node)
+
+
+def hang(node):
+    node.latency = PROBE_TIMEOUT * 2
+
+
+def healthy(node):  # pylint: disable=unused-argument
+    pass
+
+
+# scenario, faulty node, fault, expected writer, reloads
+SCENARIOS = [
+    ('steady state', 'node1', healthy, 'node1', 0),
+    ('writer desynced', 'node1', desync, 'node2', 1),
+    ('writer crashed', 'node1', crash, 'node2', 1),
+    ('writer hangs', 'node1', hang, 'node2', 1),
+    ('reader crashed', 'node2', crash, 'node1', 1),
+]
+
+
+def run_pass(cluster, proxysql, mode='singlewriter'):
+    return register_pass(cluster, proxysql,
+                         load_balancing_mode=mode,
+                         writer_hostgroup_id=W,
+                         reader_hostgroup_id=R)
+
+
+@pytest.fixture(scope='module')
+def report():
+    print()
+    print('%-20s %12s %8s %12s %8s' % ('scenario', 'latency, ms', 'passes',
+                                       'round trips', 'reloads'))
+    yield
+    print()
+
+
+@pytest.mark.parametrize('scenario, host, fault, writer, reloads', SCENARIOS)
+def test_failover(report, scenario, host, fault, writer, reloads):  # pylint: disable=redefined-outer-name,unused-argument,too-many-arguments
+    cluster = SimulatedCluster(3, probe_latency=PROBE_LATENCY,
+                               probe_timeout=PROBE_TIMEOUT)
+    proxysql = SimulatedProxySQL(latency=ADMIN_LATENCY)
+    run_pass(cluster, proxysql)
+    assert proxysql.runtime_backends(W) == ['node1']
+    proxysql.reset_counters()
+
+    fault(cluster.node(host))
+    started = time.time()
+    passes = 0
+    while passes < MAX_PASSES:
+        run_pass(cluster, proxysql)
+        passes += 1
+        if proxysql.runtime_backends(W) == [writer]:
+            break
+    latency = time.time() - started
+
+    print('%-20s %12.1f %8d %12d %8d' % (scenario, latency * 1000, passes,
+                                         proxysql.round_trips,
+                                         proxysql.reloads))
+
+    assert proxysql.runtime_backends(W) == [writer]
+    assert passes == 1
+    assert proxysql.reloads == reloads
+    # One SELECT, and REPLACE, DELETE and LOAD if something changed
+    assert proxysql.round_trips <= 1 + 3 * reloads
+    assert latency < PROBE_TIMEOUT + 1
+
+    proxysql.reset_counters()
+    run_pass(cluster, proxysql)
+    assert proxysql.reloads == 0
+    assert proxysql.round_trips == 1
+
+
+@pytest.mark.parametrize('mode', ['singlewriter', 'weighted', 'multiwriter'])
+def test_noop_pass(mode):
+    """Once ProxySQL matches the cluster, a pass only reads."""
+    cluster = SimulatedCluster(3, probe_timeout=PROBE_TIMEOUT)
+    desync(cluster.node('node2'))
+    crash(cluster.node('node3'))
+    proxysql = SimulatedProxySQL()
+
+    for _ in xrange(MAX_PASSES * 2):
+        proxysql.reset_counters()
+        run_pass(cluster, proxysql, mode)
+        if not proxysql.reloads:
+            break
+
+    assert proxysql.reloads == 0
+    assert proxysql.round_trips == 1
+
+
+def test_clusters_share_reload():
+    """Writers of two clusters move in one pass with one runtime load."""
+    clusters = []
+    for writer_hostgroup_id in (W, W + 10):
+        cluster = SimulatedCluster(3, probe_latency=PROBE_LATENCY,
+                                   probe_timeout=PROBE_TIMEOUT)
+        clusters.append((str(writer_hostgroup_id), cluster, {
+            'load_balancing_mode': 'singlewriter',
+            'writer_hostgroup_id': writer_hostgroup_id,
+            'reader_hostgroup_id': writer_hostgroup_id + 1
+        }))
+    proxysql = SimulatedProxySQL(latency=ADMIN_LATENCY)
+    register_clusters(clusters, proxysql)
+    assert proxysql.reloads == 1
+    proxysql.reset_counters()
+
+    for _, cluster, _ in clusters:
+        hang(cluster.node('node1'))
+    started = time.time()
+    register_clusters(clusters, proxysql)
+    # Clusters are probed concurrently
+    assert time.time() - started < PROBE_TIMEOUT * 2
+    assert proxysql.reloads == 1
+    assert proxysql.runtime_backends(W) == ['node2']
+    assert proxysql.runtime_backends(W + 10) == ['node2']
+
+
+def test_pass_timeout():
+    """A writer that hangs is failed over within the pass budget,
+    even if the budget is shorter than the probe timeout."""
+    cluster = SimulatedCluster(3, probe_latency=PROBE_LATENCY,
+                               probe_timeout=PROBE_TIMEOUT)
+    clusters = [(None, cluster, {
+        'load_balancing_mode': 'singlewriter',
+        'writer_hostgroup_id': W,
+        'reader_hostgroup_id': R
+    })]
+    proxysql = SimulatedProxySQL(latency=ADMIN_LATENCY)
+    register_clusters(clusters, proxysql)
+    proxysql.reset_counters()
+
+    hang(cluster.node('node1'))
+    budget = PROBE_TIMEOUT / 5
+    started = time.time()
+    register_clusters(clusters, proxysql, deadline=started + budget)
+    assert time.time() - started < budget
+    assert proxysql.reloads == 1
+    assert proxysql.runtime_backends(W) == ['node2']
+
+
+def test_pass_timeout_before_apply():
+    """A pass that runs out of time leaves ProxySQL runtime intact."""
+    cluster = SimulatedCluster(3, probe_latency=PROBE_LATENCY,
+                               probe_timeout=PROBE_TIMEOUT)
+    clusters = [(None, cluster, {
+        'load_balancing_mode': 'singlewriter',
+        'writer_hostgroup_id': W,
+        'reader_hostgroup_id': R
+    })]
+    proxysql = SimulatedProxySQL(latency=ADMIN_LATENCY)
+    register_clusters(clusters, proxysql)
+    proxysql.reset_counters()
+
+    hang(cluster.node('node1'))
+    with pytest.raises(GaleraPassTimeout):
+        register_clusters(clusters, proxysql, deadline=time.time())
+    assert proxysql.round_trips == 0
+    assert proxysql.runtime_backends(W) == ['node1']
@@ -0,0 +1,91 @@
+"""
+Startup cost of commands that ProxySQL scheduler runs every few seconds.
+
+Every run is a new process, so whatever proxysql_tools.cli imports is
+paid on each invocation. The benchmark runs ``galera register`` and
+``ping`` to the end, against ports where nothing listens, and checks
+which heavy modules the process loaded. Wall time is printed for
+reference only, it's too noisy to assert on.
+"""
+from __future__ import print_function
+
+import json
+import subprocess
+import sys
+import time
+
+import pytest
+
+# Modules that only AWS and table printing commands need
+HEAVY_MODULES = ('boto3', 'botocore', 'requests', 'netifaces', 'prettytable',
+                 'proxysql_tools.aws.aws')
+
+EAGER_IMPORTS = 'import proxysql_tools.aws.aws, prettytable\n'
+
+# Nothing listens on port 1, so connections fail at once
+CONFIG = """
+[proxysql]
+host=127.0.0.1
+admin_port=1
+
+[galera]
+cluster_host=127.0.0.1:1
+probe_timeout=1
+load_balancing_mode=singlewriter
+writer_hostgroup_id=10
+reader_hostgroup_id=11
+lock_file={lock_file}
+"""
+
+COMMANDS = [
+    ['galera', 'register'],
+    ['ping'],
+]
+
+STATEMENT = """{preamble}import json, sys
+from proxysql_tools.cli import main
+sys.argv = ['proxysql-tool', '--config', {config!r}] + {args!r}
+try:
+    main(standalone_mode=False)
+except SystemExit:
+    pass
+finally:
+    sys.stdout.write(json.dumps(sorted(
+        name for name in {heavy!r} if sys.modules.get(name) is not None)))
+"""
+
+
+def run_command(config, args, preamble=''):
+    """
+    Run proxysql-tool in a new interpreter.
+
+    :return: Heavy modules it loaded and wall time it took.
+    :rtype: tuple(list, float)
+    """
+    statement = STATEMENT.format(preamble=preamble, config=config, args=args,
+                                 heavy=HEAVY_MODULES)
+    started = time.time()
+    output = subprocess.check_output([sys.executable, '-c', statement],
+                                     stderr=subprocess.STDOUT)
+    elapsed = time.time() - started
+    return json.loads(output.splitlines()[-1]), elapsed
+
+
+@pytest.fixture
+def config(tmpdir):
+    path = tmpdir.join('proxysql-tool.cfg')
+    path.write(CONFIG.format(lock_file=tmpdir.join('register.lock')))
+    return str(path)
+
+
+@pytest.mark.parametrize('args', COMMANDS)
+def test_startup_imports(config, args):  # pylint: disable=redefined-outer-name
+    eager_modules, eager = run_command(config, args, preamble=EAGER_IMPORTS)
+    lazy_modules, lazy = run_command(config, args)
+    print()
+    print('%-20s eager %.1f ms, lazy %.1f ms' % (' '.join(args),
+                                                eager * 1000, lazy * 1000))
+
+    # The check sees modules that are loaded
+    assert 'proxysql_tools.aws.aws' in eager_modules
+    assert lazy_modules == []
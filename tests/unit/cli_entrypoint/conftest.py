@@ -0,0 +1,18 @@
+import pytest
+
+from proxysql_tools.proxysql.proxysql import ProxySQL
+from tests.integration.library import proxysql_tools_config
+
+
+@pytest.fixture
+def proxysql():
+    return ProxySQL()
+
+
+@pytest.fixture
+def config():
+    proxysql_instance = ProxySQL()
+    data = proxysql_tools_config(proxysql_instance, '127.0.0.1', '3306',
+                                 'user', 'pass', 10, 11, 'monitor',
+                                 'monitor')
+    return data
@@ -0,0 +1,360 @@
+import os
+import socket
+import time
+
+import mock
+import pytest
+from pymysql import OperationalError
+
+from proxysql_tools.cli_entrypoint.galera import register_pass, \
+    galera_register_daemon, get_balancing_options, parse_writer_weights, \
+    get_galera_clusters, register_clusters, galera_register, \
+    get_run_guard, get_pass_timeout, _daemon_pass
+from proxysql_tools.galera.exceptions import GaleraPassTimeout
+from proxysql_tools.galera.galera_cluster import GaleraCluster
+from proxysql_tools.proxysql.proxysql import ProxySQL
+from proxysql_tools.util.runlock import RunCounters
+
+
+def test_register_pass_raises_not_implemented(proxysql):
+    with pytest.raises(NotImplementedError):
+        register_pass(GaleraCluster('foo:3306'), proxysql,
+                      'roundrobin', 10, 11)
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.cli_entrypoint.galera.singlewriter')
+@mock.patch.object(ProxySQL, 'changeset')
+@mock.patch.object(GaleraCluster, 'probe')
+def test_register_pass(mock_probe, mock_changeset, mock_singlewriter,
+                       proxysql):
+    galera_cluster = GaleraCluster('foo:3306')
+    assert register_pass(galera_cluster, proxysql, 'singlewriter', 10, 11) \
+        == mock_singlewriter.return_value
+
+    mock_probe.assert_called_once_with()
+    mock_changeset.assert_called_once_with()
+    mock_singlewriter.assert_called_once_with(galera_cluster, proxysql,
+                                              10, 11, ignore_writer=None,
+                                              flow_control=None,
+                                              reader_lag=None)
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.cli_entrypoint.galera.weighted')
+@mock.patch('proxysql_tools.cli_entrypoint.galera.singlewriter')
+@mock.patch.object(ProxySQL, 'changeset')
+@mock.patch.object(GaleraCluster, 'probe')
+def test_register_pass_weighted(mock_probe, mock_changeset,
+                                mock_singlewriter, mock_weighted, proxysql):
+    galera_cluster = GaleraCluster('foo:3306')
+    register_pass(galera_cluster, proxysql, 'weighted', 10, 11)
+
+    assert not mock_singlewriter.called
+    mock_weighted.assert_called_once_with(galera_cluster, proxysql,
+                                          10, 11, ignore_writer=None,
+                                          flow_control=None,
+                                          reader_lag=None)
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.cli_entrypoint.galera.multiwriter')
+@mock.patch.object(ProxySQL, 'changeset')
+@mock.patch.object(GaleraCluster, 'probe')
+def test_register_pass_multiwriter(mock_probe, mock_changeset,
+                                   mock_multiwriter, proxysql):
+    galera_cluster = GaleraCluster('foo:3306')
+    register_pass(galera_cluster, proxysql, 'multiwriter', 10, 11,
+                  max_writers=2)
+
+    mock_multiwriter.assert_called_once_with(galera_cluster, proxysql,
+                                             10, 11, ignore_writer=None,
+                                             flow_control=None,
+                                             reader_lag=None,
+                                             max_writers=2,
+                                             writer_weights=None)
+
+
+def test_parse_writer_weights():
+    assert parse_writer_weights('foo:3306=3, bar:3307=1,') == {
+        ('foo', 3306): 3,
+        ('bar', 3307): 1
+    }
+    with pytest.raises(ValueError):
+        parse_writer_weights('foo=3')
+
+
+def test_get_balancing_options(config):
+    config.set('galera', 'writer_blacklist', 'foo:3307')
+    kwargs = get_balancing_options(config)
+    assert kwargs['load_balancing_mode'] == 'singlewriter'
+    assert kwargs['writer_hostgroup_id'] == 10
+    assert kwargs['reader_hostgroup_id'] == 11
+    assert kwargs['ignore_writer'].hostname == 'foo'
+    assert kwargs['ignore_writer'].port == 3307
+    assert 'flow_control' not in kwargs
+
+
+def test_get_balancing_options_unknown_mode(config):
+    config.set('galera', 'load_balancing_mode', 'roundrobin')
+    with pytest.raises(NotImplementedError):
+        get_balancing_options(config)
+
+
+@pytest.mark.parametrize('max_writers', ['0', '-1'])
+def test_get_balancing_options_max_writers(config, max_writers):
+    config.set('galera', 'max_writers', max_writers)
+    with pytest.raises(ValueError):
+        get_balancing_options(config)
+
+
+def test_get_balancing_options_flow_control(config):
+    config.set('galera', 'flow_control_sent_max', '10')
+    kwargs = get_balancing_options(config)
+    assert kwargs['flow_control'].sent_per_second == 10
+    assert kwargs['flow_control'].recv_queue_avg is None
+    assert 'reader_lag' not in kwargs
+
+
+def test_get_balancing_options_reader_lag(config):
+    config.set('galera', 'reader_max_recv_queue', '100')
+    config.set('galera', 'reader_max_latency_ms', '50')
+    kwargs = get_balancing_options(config)
+    assert kwargs['reader_lag'].recv_queue == 100
+    assert kwargs['reader_lag'].rtt_ms is None
+    assert kwargs['reader_lag'].max_latency_ms == 50
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'discard_servers')
+@mock.patch('proxysql_tools.cli_entrypoint.galera.signal')
+@mock.patch('proxysql_tools.cli_entrypoint.galera.Event')
+@mock.patch('proxysql_tools.cli_entrypoint.galera.register_pass')
+@mock.patch.object(GaleraCluster, 'probe')
+def test_galera_register_daemon(mock_probe, mock_register_pass, mock_event,
+                                mock_signal, mock_discard_servers, config,
+                                tmpdir):
+    config.set('galera', 'lock_file', str(tmpdir.join('register.lock')))
+    mock_event.return_value.is_set.side_effect = [False, False, False, True]
+    mock_register_pass.side_effect = [
+        None,
+        OperationalError(2003, 'foo'),
+        None
+    ]
+    galera_register_daemon(config, interval=0.5)
+
+    assert mock_register_pass.call_count == 3
+    assert mock_discard_servers.call_count == 1
+    assert mock_event.return_value.wait.call_count == 3
+    for call in mock_event.return_value.wait.call_args_list:
+        assert 0 <= call[0][0] <= 0.5
+
+
+def _add_cluster(config, name, writer_hostgroup_id, reader_hostgroup_id):
+    section = 'galera:%s' % name
+    config.add_section(section)
+    config.set(section, 'cluster_host', '%s1:3306,%s2:3306' % (name, name))
+    config.set(section, 'load_balancing_mode', 'multiwriter')
+    config.set(section, 'writer_hostgroup_id', str(writer_hostgroup_id))
+    config.set(section, 'reader_hostgroup_id', str(reader_hostgroup_id))
+
+
+def test_get_galera_clusters(config):
+    _add_cluster(config, 'foo', 20, 21)
+    clusters = get_galera_clusters(config)
+    assert [name for name, _, _ in clusters] == [None, 'foo']
+    _, galera_cluster, options = clusters[1]
+    assert sorted(str(node) for node in galera_cluster.nodes) == \
+        ['foo1:3306', 'foo2:3306']
+    assert options['load_balancing_mode'] == 'multiwriter'
+    assert options['writer_hostgroup_id'] == 20
+
+
+def test_get_galera_clusters_without_default(config):
+    config.remove_option('galera', 'cluster_host')
+    _add_cluster(config, 'foo', 20, 21)
+    assert [name for name, _, _ in get_galera_clusters(config)] == ['foo']
+
+
+def test_get_galera_clusters_shared_hostgroup(config):
+    _add_cluster(config, 'foo', 11, 21)
+    with pytest.raises(ValueError):
+        get_galera_clusters(config)
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.cli_entrypoint.galera.register_pass')
+@mock.patch('proxysql_tools.cli_entrypoint.galera.probe_clusters')
+@mock.patch.object(ProxySQL, 'changeset')
+def test_register_clusters(mock_changeset, mock_probe_clusters,
+                           mock_register_pass, proxysql):
+    foo = GaleraCluster('foo:3306')
+    bar = GaleraCluster('bar:3306')
+    mock_register_pass.side_effect = ['foo backends', 'bar backends']
+    assert register_clusters([('foo', foo, {'writer_hostgroup_id': 10}),
+                              ('bar', bar, {'writer_hostgroup_id': 20})],
+                             proxysql) == ['foo backends', 'bar backends']
+
+    mock_probe_clusters.assert_called_once_with([foo, bar], deadline=None)
+    mock_changeset.assert_called_once_with()
+    assert mock_register_pass.call_args_list == [
+        mock.call(foo, proxysql, probe=False, writer_hostgroup_id=10),
+        mock.call(bar, proxysql, probe=False, writer_hostgroup_id=20)
+    ]
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'discard_servers')
+@mock.patch('proxysql_tools.cli_entrypoint.galera.register_pass')
+@mock.patch('proxysql_tools.cli_entrypoint.galera.probe_clusters')
+@mock.patch.object(ProxySQL, 'changeset')
+def test_register_clusters_isolates_errors(mock_changeset, mock_probe_clusters,
+                                           mock_register_pass,
+                                           mock_discard_servers, proxysql):
+    foo = GaleraCluster('foo:3306')
+    bar = GaleraCluster('bar:3306')
+    mock_register_pass.side_effect = [OperationalError(2013, 'lost'),
+                                      'bar backends']
+    options = {'writer_hostgroup_id': 10, 'reader_hostgroup_id': 11}
+    assert register_clusters([('foo', foo, options),
+                              ('bar', bar, {'writer_hostgroup_id': 20,
+                                            'reader_hostgroup_id': 21})],
+                             proxysql) == [None, 'bar backends']
+    # Only changes of the failed cluster are discarded
+    mock_discard_servers.assert_called_once_with(hostgroup_ids=[10, 11])
+    mock_changeset.return_value.__exit__.assert_called_once_with(
+        None, None, None)
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'discard_servers')
+@mock.patch('proxysql_tools.cli_entrypoint.galera.register_pass')
+@mock.patch('proxysql_tools.cli_entrypoint.galera.probe_clusters')
+@mock.patch.object(ProxySQL, 'changeset')
+def test_register_clusters_isolates_unexpected_errors(mock_changeset,
+                                                      mock_probe_clusters,
+                                                      mock_register_pass,
+                                                      mock_discard_servers,
+                                                      proxysql):
+    foo = GaleraCluster('foo:3306')
+    bar = GaleraCluster('bar:3306')
+    mock_register_pass.side_effect = [socket.gaierror(-2, 'Name unknown'),
+                                      'bar backends']
+    assert register_clusters([('foo', foo, {'writer_hostgroup_id': 10}),
+                              ('bar', bar, {'writer_hostgroup_id': 20})],
+                             proxysql) == [None, 'bar backends']
+    mock_discard_servers.assert_called_once_with(hostgroup_ids=[10])
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.cli_entrypoint.galera.signal')
+@mock.patch('proxysql_tools.cli_entrypoint.galera.Event')
+@mock.patch('proxysql_tools.cli_entrypoint.galera.register_clusters')
+def test_galera_register_daemon_survives_unexpected_errors(
+        mock_register_clusters, mock_event, mock_signal, config, tmpdir):
+    config.set('galera', 'lock_file', str(tmpdir.join('register.lock')))
+    mock_event.return_value.is_set.side_effect = [False, False, True]
+    mock_register_clusters.side_effect = [RuntimeError('foo'), [None]]
+    galera_register_daemon(config, interval=0.5)
+
+    assert mock_register_clusters.call_count == 2
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.cli_entrypoint.galera.register_pass')
+@mock.patch('proxysql_tools.cli_entrypoint.galera.probe_clusters')
+@mock.patch.object(ProxySQL, 'changeset')
+def test_register_clusters_deadline(mock_changeset, mock_probe_clusters,
+                                    mock_register_pass, proxysql):
+    foo = GaleraCluster('foo:3306')
+    with pytest.raises(GaleraPassTimeout):
+        register_clusters([('foo', foo, {})], proxysql, deadline=1)
+    mock_probe_clusters.assert_called_once_with([foo], deadline=1)
+    assert not mock_register_pass.called
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.cli_entrypoint.galera.register_clusters')
+def test_galera_register_skips_overlapping_run(mock_register_clusters,
+                                               config, tmpdir):
+    config.set('galera', 'lock_file', str(tmpdir.join('register.lock')))
+    lock, counters = get_run_guard(config)
+    assert lock.acquire()
+    try:
+        galera_register(config)
+        galera_register(config)
+    finally:
+        lock.release()
+    assert not mock_register_clusters.called
+    assert counters.read()['skipped'] == 2
+
+    galera_register(config)
+    assert mock_register_clusters.call_count == 1
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.cli_entrypoint.galera.register_clusters')
+def test_galera_register_overrun(mock_register_clusters, config, tmpdir):
+    config.set('galera', 'lock_file', str(tmpdir.join('register.lock')))
+    config.set('galera', 'pass_timeout', '5')
+    config.set('galera', 'probe_timeout', '1')
+    mock_register_clusters.side_effect = GaleraPassTimeout('too slow')
+    galera_register(config)
+
+    deadline = mock_register_clusters.call_args[1]['deadline']
+    assert 0 < deadline - time.time() <= 5
+    _, counters = get_run_guard(config)
+    assert counters.read()['overruns'] == 1
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.cli_entrypoint.galera.register_clusters')
+def test_daemon_pass_overrun_is_not_error(mock_register_clusters,
+                                          proxysql, tmpdir):
+    mock_register_clusters.side_effect = GaleraPassTimeout('too slow')
+    metrics = mock.Mock()
+    counters = RunCounters(str(tmpdir.join('register.counters')))
+    cluster = GaleraCluster('foo:3306')
+    _daemon_pass([('foo', cluster, {})], proxysql, 5, counters, [metrics])
+
+    metrics.record_pass.assert_called_once_with(cluster, None, mock.ANY,
+                                                failed=False, overrun=True)
+
+    mock_register_clusters.side_effect = RuntimeError('foo')
+    metrics.reset_mock()
+    _daemon_pass([('foo', cluster, {})], proxysql, 5, counters, [metrics])
+
+    metrics.record_pass.assert_called_once_with(cluster, None, mock.ANY,
+                                                failed=True, overrun=False)
+
+
+def test_get_pass_timeout(config):
+    config.set('galera', 'probe_timeout', '1')
+    assert get_pass_timeout(config, get_galera_clusters(config)) is None
+    config.set('galera', 'pass_timeout', '5')
+    assert get_pass_timeout(config, get_galera_clusters(config)) == 5
+
+
+def test_get_pass_timeout_shorter_than_probe(config):
+    config.set('galera', 'probe_timeout', '5')
+    config.set('galera', 'pass_timeout', '5')
+    # A node that hangs would use up every pass
+    with pytest.raises(ValueError):
+        get_pass_timeout(config, get_galera_clusters(config))
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.cli_entrypoint.galera.tempfile.gettempdir')
+def test_get_run_guard_default_lock_file(mock_gettempdir, config, tmpdir):
+    mock_gettempdir.return_value = str(tmpdir)
+    lock, counters = get_run_guard(config)
+    lock_dir = tmpdir.join('proxysql-tool-%d' % os.geteuid())
+    assert lock.path == str(lock_dir.join('galera-register-10-11.lock'))
+    assert counters.path == lock.path + '.counters'
+    # Only the user that runs the tool may access the lock directory
+    assert lock_dir.stat().mode & 0o777 == 0o700
+
+    # Runs of a config with other hostgroups take another lock
+    _add_cluster(config, 'foo', 20, 21)
+    lock, _ = get_run_guard(config)
+    assert lock.path.endswith('galera-register-10-11-20-21.lock')
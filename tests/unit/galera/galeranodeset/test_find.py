@@ -57,10 +57,13 @@ def test_find_raises():
         GaleraNode(host='foo', port=3307),
     )
 ])
-@mock.patch.object(GaleraNode, '_status')
-def test_find_host(mock_status, states, nodes, criteria, result):
+@mock.patch.object(GaleraNode, 'execute')
+def test_find_host(mock_execute, states, nodes, criteria, result):
     bs = GaleraNodeSet()
-    mock_status.side_effect = states
+    mock_execute.side_effect = [
+        [{'Variable_name': 'wsrep_local_state', 'Value': str(state)}]
+        for state in states
+    ]
     for node in nodes:
         bs.add(node)
 
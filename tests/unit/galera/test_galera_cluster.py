@@ -1,7 +1,15 @@
+import socket
+import time
+from threading import Event
+
+import mock
 import pytest
+from pymysql import OperationalError
 
+from proxysql_tools.galera.exceptions import GaleraClusterNodeNotFound
 from proxysql_tools.galera.galera_cluster import GaleraCluster
-from proxysql_tools.galera.galera_node import GaleraNode
+from proxysql_tools.galera.galera_node import GaleraNode, GaleraNodeStatus, \
+    GaleraNodeState
 from proxysql_tools.galera.galeranodeset import GaleraNodeSet
 
 
@@ -24,3 +32,209 @@ def test_nodes():
 ])
 def test_split_cluster_host(cluster_host, result):
     assert GaleraCluster(cluster_host)._split_cluster_host(cluster_host) == result
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(GaleraNode, 'snapshot')
+def test_probe(mock_snapshot):
+    status = GaleraNodeStatus({'wsrep_local_state': '4'})
+    mock_snapshot.return_value = status
+    gc = GaleraCluster('foo:1,bar:2')
+    gc.probe()
+    assert mock_snapshot.call_count == 2
+    for node in gc.nodes:
+        assert node.status is status
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(GaleraNode, 'snapshot')
+def test_probe_failed_node(mock_snapshot):
+    mock_snapshot.side_effect = OperationalError(2003, 'foo')
+    gc = GaleraCluster('foo:1')
+    gc.probe()
+    with pytest.raises(OperationalError):
+        assert gc.nodes[0].status
+    with pytest.raises(GaleraClusterNodeNotFound):
+        gc.nodes.find(state=GaleraNodeState.SYNCED, port=None)
+
+
+def test_probe_slow_node():
+    release = Event()
+
+    def slow_snapshot(node):
+        if node.host == 'slow':
+            release.wait(5)
+        return GaleraNodeStatus({'wsrep_local_state': '4'})
+
+    gc = GaleraCluster('fast:1,slow:2', probe_timeout=0.1)
+    with mock.patch.object(GaleraNode, 'snapshot', autospec=True,
+                           side_effect=slow_snapshot):
+        started = time.time()
+        gc.probe()
+        assert time.time() - started < 1
+    release.set()
+
+    assert gc.nodes.find(host='fast', port=1)[0].status.wsrep_local_state \
+        == GaleraNodeState.SYNCED
+    with pytest.raises(OperationalError):
+        assert gc.nodes.find(host='slow', port=2)[0].status
+    with pytest.raises(GaleraClusterNodeNotFound):
+        gc.nodes.find(host='slow', port=2, state=GaleraNodeState.SYNCED)
+
+
+def _member_status(addresses, conf_id='1', size=None):
+    return GaleraNodeStatus({
+        'wsrep_local_state': '4',
+        'wsrep_cluster_status': 'Primary',
+        'wsrep_cluster_state_uuid': 'uuid',
+        'wsrep_cluster_conf_id': conf_id,
+        'wsrep_cluster_size': size or str(len(addresses.split(','))),
+        'wsrep_incoming_addresses': addresses
+    })
+
+
+def test_parse_incoming_addresses():
+    assert GaleraCluster._parse_incoming_addresses(
+        'foo:1, bar:2,AUTO,:3') == [('foo', 1), ('bar', 2)]
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(GaleraNode, 'snapshot')
+def test_probe_discovers_nodes(mock_snapshot):
+    mock_snapshot.return_value = _member_status('foo:1,bar:2,baz:3')
+    gc = GaleraCluster('foo:1', discover=True)
+    gc.probe()
+    assert sorted(str(node) for node in gc.nodes) == \
+        ['bar:2', 'baz:3', 'foo:1']
+    # The seed and both new nodes are probed once
+    assert mock_snapshot.call_count == 3
+    for node in gc.nodes:
+        assert node.status.wsrep_local_state == GaleraNodeState.SYNCED
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(GaleraNode, 'snapshot')
+def test_discovery_is_cached(mock_snapshot):
+    mock_snapshot.return_value = _member_status('foo:1,bar:2')
+    gc = GaleraCluster('foo:1', discover=True)
+    gc.probe()
+
+    # Same configuration, but another member list: ignored until the TTL
+    mock_snapshot.return_value = _member_status('foo:1,bar:2,baz:3')
+    gc.probe()
+    assert len(list(gc.nodes)) == 2
+    assert mock_snapshot.call_count == 4
+
+    # A new configuration refreshes the list immediately
+    mock_snapshot.return_value = _member_status('foo:1,bar:2,baz:3',
+                                                conf_id='2')
+    gc.probe()
+    assert len(list(gc.nodes)) == 3
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(GaleraNode, 'snapshot')
+def test_discovery_ttl(mock_snapshot):
+    mock_snapshot.return_value = _member_status('foo:1,bar:2')
+    gc = GaleraCluster('foo:1', discover=True, discovery_ttl=0)
+    gc.probe()
+    mock_snapshot.return_value = _member_status('foo:1,baz:3')
+    gc.probe()
+    assert sorted(str(node) for node in gc.nodes) == ['baz:3', 'foo:1']
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(GaleraNode, 'snapshot')
+def test_discovery_keeps_seeds(mock_snapshot):
+    mock_snapshot.return_value = _member_status('bar:2', conf_id='1')
+    gc = GaleraCluster('foo:1,bar:2', discover=True)
+    gc.probe()
+    assert sorted(str(node) for node in gc.nodes) == ['bar:2', 'foo:1']
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(GaleraNode, 'snapshot')
+def test_no_discovery_from_non_primary(mock_snapshot):
+    status = _member_status('foo:1,bar:2')
+    mock_snapshot.return_value = GaleraNodeStatus(
+        dict(status._variables, wsrep_cluster_status='non-Primary'))
+    gc = GaleraCluster('foo:1', discover=True)
+    gc.probe()
+    assert len(list(gc.nodes)) == 1
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.galera.galera_cluster.socket.gethostbyname')
+@mock.patch.object(GaleraNode, 'snapshot')
+def test_discovery_resolves_addresses(mock_snapshot, mock_gethostbyname):
+    addresses = {'foo': '10.0.0.1', 'bar': '10.0.0.2'}
+    mock_gethostbyname.side_effect = lambda host: addresses.get(host, host)
+    mock_snapshot.return_value = _member_status('10.0.0.1:1,10.0.0.2:2')
+    gc = GaleraCluster('foo:1', discover=True)
+    gc.probe()
+    # The seed isn't added again under its IP address
+    assert sorted(str(node) for node in gc.nodes) == ['10.0.0.2:2', 'foo:1']
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.galera.galera_cluster.socket.gethostbyname')
+@mock.patch.object(GaleraNode, 'snapshot')
+def test_discovery_resolves_once_per_topology(mock_snapshot,
+                                              mock_gethostbyname):
+    mock_gethostbyname.side_effect = socket.gaierror(-2, 'Name unknown')
+    mock_snapshot.return_value = _member_status('foo:1,10.0.0.9:3')
+    gc = GaleraCluster('foo:1', discover=True, discovery_ttl=0)
+    gc.probe()
+    # A name that doesn't resolve is compared as is
+    assert sorted(str(node) for node in gc.nodes) == ['10.0.0.9:3', 'foo:1']
+    lookups = mock_gethostbyname.call_count
+
+    # The TTL refreshes membership, but the topology is the same
+    gc.probe()
+    assert mock_gethostbyname.call_count == lookups
+
+    mock_snapshot.return_value = _member_status('foo:1,10.0.0.9:3',
+                                                conf_id='2')
+    gc.probe()
+    assert mock_gethostbyname.call_count > lookups
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.galera.galera_cluster.time')
+@mock.patch.object(GaleraNode, 'snapshot', autospec=True)
+def test_departed_node_is_kept_unreachable(mock_snapshot, mock_time):
+    mock_time.time.return_value = 1000
+    mock_snapshot.return_value = _member_status('foo:1,bar:2')
+    gc = GaleraCluster('foo:1', discover=True, discovery_ttl=60)
+    gc.probe()
+
+    mock_snapshot.return_value = _member_status('foo:1', conf_id='2')
+    gc.probe()
+    mock_snapshot.reset_mock()
+    mock_time.time.return_value = 1059
+    gc.probe()
+    # bar:2 isn't probed, but it's kept as unreachable for the TTL
+    assert [str(args[0]) for args, _ in mock_snapshot.call_args_list] == \
+        ['foo:1']
+    bar, = list(gc.nodes.find('bar', 2))
+    with pytest.raises(OperationalError):
+        _ = bar.status
+
+    mock_time.time.return_value = 1060
+    gc.probe()
+    assert [str(node) for node in gc.nodes] == ['foo:1']
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(GaleraNode, 'snapshot')
+def test_departed_node_comes_back(mock_snapshot):
+    mock_snapshot.return_value = _member_status('foo:1,bar:2')
+    gc = GaleraCluster('foo:1', discover=True)
+    gc.probe()
+    mock_snapshot.return_value = _member_status('foo:1', conf_id='2')
+    gc.probe()
+
+    mock_snapshot.return_value = _member_status('foo:1,bar:2', conf_id='3')
+    gc.probe()
+    for node in gc.nodes:
+        assert node.status.wsrep_local_state == GaleraNodeState.SYNCED
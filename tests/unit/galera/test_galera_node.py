@@ -1,7 +1,9 @@
 import mock
+import pytest
+from pymysql import OperationalError
 from pymysql.cursors import DictCursor
 
-from proxysql_tools.galera.galera_node import GaleraNode
+from proxysql_tools.galera.galera_node import GaleraNode, GaleraNodeStatus
 
 
 def test_galera_node_init(galera_node):
@@ -77,6 +79,9 @@ def test_connect(mock_pymysql, galera_node):
                                                      port=1234,
                                                      user='bar',
                                                      passwd='xyz',
+                                                     connect_timeout=10,
+                                                     read_timeout=10,
+                                                     write_timeout=10,
                                                      cursorclass=DictCursor)
 
 
@@ -84,3 +89,82 @@ def test_connect(mock_pymysql, galera_node):
 def test_status(mock_execute, galera_node):
     galera_node._status('foo')
     mock_execute.assert_called_once_with('SHOW GLOBAL STATUS LIKE %s', 'foo')
+
+
+@mock.patch.object(GaleraNode, 'execute')
+def test_snapshot(mock_execute, galera_node):
+    """
+    :param galera_node: GaleraNode instance
+    :type galera_node: GaleraNode
+    """
+    mock_execute.return_value = [
+        {'Variable_name': 'wsrep_cluster_state_uuid', 'Value': 'foo-uuid'},
+        {'Variable_name': 'wsrep_cluster_status', 'Value': 'Primary'},
+        {'Variable_name': 'wsrep_local_state', 'Value': '4'},
+        {'Variable_name': 'Threads_running', 'Value': '2'}
+    ]
+    status = galera_node.snapshot()
+    mock_execute.assert_called_once_with(
+        'SHOW GLOBAL STATUS '
+        'WHERE `Variable_name` LIKE %s OR `Variable_name` = %s',
+        ('wsrep_%', 'Threads_running'))
+    assert status['Threads_running'] == '2'
+    assert status.rtt >= 0
+    assert status.taken_at is not None
+    assert status.wsrep_cluster_state_uuid == 'foo-uuid'
+    assert status.wsrep_cluster_status == 'Primary'
+    assert status.wsrep_local_state == 4
+    assert status['wsrep_local_state'] == '4'
+    assert status.get('wsrep_local_recv_queue') is None
+
+
+def test_previous_status(galera_node):
+    first = GaleraNodeStatus({}, taken_at=1)
+    second = GaleraNodeStatus({}, taken_at=2)
+    galera_node.reset_status(status=first)
+    assert galera_node.previous_status is None
+    galera_node.reset_status(status=second)
+    assert galera_node.previous_status is first
+    third = GaleraNodeStatus({}, taken_at=3)
+    galera_node.reset_status(status=third)
+    assert galera_node.previous_status is second
+    # The same snapshot again doesn't replace itself
+    galera_node.reset_status(status=third)
+    assert galera_node.previous_status is second
+
+    galera_node.reset_status(error=OperationalError(2003, 'down'))
+    galera_node.reset_status(status=first)
+    assert galera_node.previous_status is None
+
+
+@mock.patch.object(GaleraNode, 'snapshot')
+def test_status_is_cached(mock_snapshot, galera_node):
+    """
+    :param galera_node: GaleraNode instance
+    :type galera_node: GaleraNode
+    """
+    assert galera_node.status is galera_node.status
+    mock_snapshot.assert_called_once_with()
+
+    galera_node.reset_status()
+    assert galera_node.status
+    assert mock_snapshot.call_count == 2
+
+
+@mock.patch.object(GaleraNode, 'snapshot')
+def test_status_raises_probe_error(mock_snapshot, galera_node):
+    """
+    :param galera_node: GaleraNode instance
+    :type galera_node: GaleraNode
+    """
+    galera_node.reset_status(error=OperationalError(2003, 'foo'))
+    with pytest.raises(OperationalError):
+        assert galera_node.status
+    mock_snapshot.assert_not_called()
+
+
+def test_eq():
+    assert GaleraNode('foo', port=3306) == GaleraNode('foo', port=3306)
+    assert GaleraNode('foo', port=3306) != GaleraNode('foo', port=3307)
+    assert GaleraNode('foo') != 'foo'
+    assert hash(GaleraNode('foo')) == hash(GaleraNode('foo'))
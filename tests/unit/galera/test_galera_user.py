@@ -1,7 +1,10 @@
+from StringIO import StringIO
+
 import mock
 import pytest
 
-from proxysql_tools.galera.user import get_users, create_user, change_password, delete_user, modify_user
+from proxysql_tools.galera.user import get_users, create_user, change_password, delete_user, modify_user, \
+    read_users, write_users, import_users
 from proxysql_tools.proxysql.exceptions import ProxySQLUserNotFound
 from proxysql_tools.proxysql.proxysql import ProxySQL, ProxySQLMySQLUser
 
@@ -22,23 +25,42 @@ def test_create_user(mock_add, mock_get, config):
     pass
 
 
+@mock.patch.object(ProxySQL, 'find_backends')
 @mock.patch.object(ProxySQL, 'add_user')
 @mock.patch.object(ProxySQL, 'get_user')
-@mock.patch('proxysql_tools.galera.user.get_encrypred_password')
-def test_change_password(mock_add_user, mock_get_user, mock_enc_pwd, config):
+def test_change_password(mock_get_user, mock_add_user, mock_find_backends,
+                         config):
     mock_get_user.return_value = ProxySQLMySQLUser()
-    change_password(config, 'root', '1235')
+    change_password(config, 'root', 'password')
+    user, = mock_add_user.call_args[0]
+    assert user.password == '*2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19'
+    assert not mock_find_backends.called
 
 
 @mock.patch.object(ProxySQL, 'add_user')
 @mock.patch.object(ProxySQL, 'get_user')
-@mock.patch('proxysql_tools.galera.user.get_encrypred_password')
-def test_change_password_raise(mock_add_user, mock_get_user, mock_enc_pwd, config):
+def test_change_password_raise(mock_get_user, mock_add_user, config):
     mock_get_user.side_effect = ProxySQLUserNotFound
     with pytest.raises(ProxySQLUserNotFound):
         change_password(config, 'root', '1235')
 
 
+@pytest.mark.parametrize('password, result', [
+    ('', ''),
+    ('password', '*2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19'),
+    ('*2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19',
+     '*2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19')
+])
+@mock.patch.object(ProxySQL, 'add_user')
+@mock.patch.object(ProxySQL, 'get_user')
+def test_create_user_hashes_password(mock_get_user, mock_add_user, config,
+                                     password, result):
+    mock_get_user.side_effect = ProxySQLUserNotFound
+    create_user(config, {'username': 'foo', 'password': password})
+    user, = mock_add_user.call_args[0]
+    assert user.password == result
+
+
 @mock.patch.object(ProxySQL, 'delete_user')
 def test_delete_user(mock_delete, config):
     delete_user(config, 'root')
@@ -55,3 +77,62 @@ def test_modify_user(mock_add_user, mock_get_user, mock_parser, config):
     mock_parser.assert_called_once()
     mock_add_user.assert_called_once()
     mock_get_user.assert_called_once()
+
+
+@pytest.mark.parametrize('file_format, content', [
+    (
+        'csv',
+        'username,password,default_hostgroup,active\n'
+        'foo,password,10,0\n'
+        'bar,*2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19,,\n'
+    ),
+    (
+        'json',
+        '{"username": "foo", "password": "password", '
+        '"default_hostgroup": 10, "active": false}\n'
+        '\n'
+        '{"username": "bar", '
+        '"password": "*2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19"}\n'
+    )
+])
+def test_read_users(file_format, content):
+    users = list(read_users(StringIO(content), file_format))
+    pwd_hash = '*2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19'
+    assert users == [
+        ProxySQLMySQLUser(username='foo', password=pwd_hash,
+                          default_hostgroup=10, active=False),
+        ProxySQLMySQLUser(username='bar', password=pwd_hash)
+    ]
+
+
+def test_read_users_raises():
+    with pytest.raises(ValueError):
+        list(read_users(StringIO('username,active\nfoo,yes\n'), 'csv'))
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'json'])
+def test_write_users_round_trip(file_format):
+    users = [
+        ProxySQLMySQLUser(username='foo', password='*2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19',
+                          default_hostgroup=10, transaction_persistent=True),
+        ProxySQLMySQLUser(username='bar', password=None),
+        ProxySQLMySQLUser(username='baz', password=None, default_schema=None)
+    ]
+    stream = StringIO()
+    assert write_users(iter(users), stream, file_format) == 3
+
+    stream.seek(0)
+    assert list(read_users(stream, file_format)) == users
+
+
+@mock.patch.object(ProxySQL, 'add_users')
+def test_import_users(mock_add_users, config):
+    mock_add_users.return_value = 1
+    stream = StringIO('username,password\nfoo,bar\n')
+    assert import_users(config, stream, 'csv', batch_size=10) == 1
+    users, = mock_add_users.call_args[0]
+    assert list(users) == [
+        ProxySQLMySQLUser(username='foo',
+                          password='*E8D46CE25265E545D225A8A6F1BAF642FEBEE5CB')
+    ]
+    assert mock_add_users.call_args[1] == {'batch_size': 10}
@@ -17,3 +17,22 @@ def test_two_sets_equal():
     bs_a.add(be)
     bs_b.add(be)
     assert bs_a == bs_b
+
+
+def test_add_duplicate():
+    bs = ProxySQLMySQLBackendSet()
+    be = ProxySQLMySQLBackend('foo', status='ONLINE')
+    bs.add(be)
+    bs.add(ProxySQLMySQLBackend('foo', status='OFFLINE_SOFT'))
+    assert len(bs) == 1
+    assert bs.find('foo') is be
+
+
+def test_add_keeps_order():
+    bs = ProxySQLMySQLBackendSet()
+    for host in ['foo', 'bar', 'baz']:
+        bs.add(ProxySQLMySQLBackend(host))
+    bs.remove(ProxySQLMySQLBackend('bar'))
+    bs.add(ProxySQLMySQLBackend('bar'))
+    assert [be.hostname for be in bs] == ['foo', 'baz', 'bar']
+    assert bs[1].hostname == 'baz'
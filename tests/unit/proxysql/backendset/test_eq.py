@@ -29,3 +29,20 @@ def test_neq_set_and_backend():
     set1.add(ProxySQLMySQLBackend('foo'))
 
     assert set1 != ProxySQLMySQLBackend('foo')
+
+
+def test_eq_ignores_order():
+    set1 = ProxySQLMySQLBackendSet()
+    set2 = ProxySQLMySQLBackendSet()
+    set1.add_set([ProxySQLMySQLBackend('foo'), ProxySQLMySQLBackend('bar')])
+    set2.add_set([ProxySQLMySQLBackend('bar'), ProxySQLMySQLBackend('foo')])
+
+    assert set1 == set2
+
+
+def test_backend_hash():
+    assert hash(ProxySQLMySQLBackend('foo', hostgroup_id=10, port=3307)) == \
+        hash(ProxySQLMySQLBackend('foo', hostgroup_id=10, port='3307',
+                                  status='OFFLINE_SOFT'))
+    assert len({ProxySQLMySQLBackend('foo', hostgroup_id=10),
+                ProxySQLMySQLBackend('foo', hostgroup_id=11)}) == 2
@@ -0,0 +1,39 @@
+from proxysql_tools.proxysql.proxysqlbackend import ProxySQLMySQLBackend
+from proxysql_tools.proxysql.proxysqlbackendset import ProxySQLMySQLBackendSet
+
+
+def _backend_set(*hosts):
+    bs = ProxySQLMySQLBackendSet()
+    for host in hosts:
+        bs.add(ProxySQLMySQLBackend(host))
+    return bs
+
+
+def test_nested_iteration():
+    bs = _backend_set('foo', 'bar')
+    pairs = [(a.hostname, b.hostname) for a in bs for b in bs]
+    assert pairs == [('foo', 'foo'), ('foo', 'bar'),
+                     ('bar', 'foo'), ('bar', 'bar')]
+
+
+def test_iteration_after_break():
+    bs = _backend_set('foo', 'bar')
+    for _ in bs:
+        break
+    assert [be.hostname for be in bs] == ['foo', 'bar']
+
+
+def test_remove_while_iterating():
+    bs = _backend_set('foo', 'bar', 'baz')
+    for be in bs:
+        bs.remove(be)
+    assert len(bs) == 0
+
+
+def test_slice():
+    bs = _backend_set('foo', 'bar', 'baz')
+    assert isinstance(bs[:2], ProxySQLMySQLBackendSet)
+    assert bs[:2] == _backend_set('foo', 'bar')
+    assert bs[1:] == _backend_set('bar', 'baz')
+    assert bs[::2] == _backend_set('foo', 'baz')
+    assert bs[-1].hostname == 'baz'
@@ -8,14 +8,9 @@ def test_backend_registered(mock_execute, proxysql):
     backend = ProxySQLMySQLBackend('127.0.0.1')
     query = "SELECT `hostgroup_id`, `hostname`, `port` " \
             "FROM `mysql_servers` " \
-            "WHERE hostgroup_id = %d  " \
-            "AND `hostname` = '%s'  " \
-            "AND `port` = %s"  % \
-            (
-                int(backend.hostgroup_id),
-                backend.hostname,
-                int(backend.port)
-            )
+            "WHERE (`hostgroup_id` = %s " \
+            "AND `hostname` = %s " \
+            "AND `port` = %s)"
     proxysql.backend_registered(backend)
-    mock_execute.assert_called_once_with(query)
+    mock_execute.assert_called_once_with(query, (0, '127.0.0.1', 3306))
 
@@ -0,0 +1,109 @@
+from threading import Thread
+
+import mock
+import pytest
+from pymysql import OperationalError
+
+from proxysql_tools.proxysql.proxysql import ProxySQL
+from proxysql_tools.proxysql.proxysqlbackend import ProxySQLMySQLBackend
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'execute')
+def test_changeset_loads_servers_once(mock_execute, proxysql):
+    with proxysql.changeset():
+        proxysql.register_backend(ProxySQLMySQLBackend('foo'))
+        proxysql.update_backend(ProxySQLMySQLBackend('bar'))
+        proxysql.deregister_backend(ProxySQLMySQLBackend('xyz'))
+
+    queries = [c[0][0] for c in mock_execute.call_args_list]
+    assert len(queries) == 4
+    assert queries.count('LOAD MYSQL SERVERS TO RUNTIME') == 1
+    assert queries[-1] == 'LOAD MYSQL SERVERS TO RUNTIME'
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'execute')
+def test_nested_changeset_loads_servers_once(mock_execute, proxysql):
+    with proxysql.changeset():
+        with proxysql.changeset():
+            proxysql.register_backend(ProxySQLMySQLBackend('foo'))
+        proxysql.register_backend(ProxySQLMySQLBackend('bar'))
+
+    queries = [c[0][0] for c in mock_execute.call_args_list]
+    assert queries.count('LOAD MYSQL SERVERS TO RUNTIME') == 1
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'execute')
+def test_empty_changeset_does_nothing(mock_execute, proxysql):
+    with proxysql.changeset():
+        pass
+    mock_execute.assert_not_called()
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'execute')
+def test_changeset_discards_changes_on_error(mock_execute, proxysql):
+    with pytest.raises(OperationalError):
+        with proxysql.changeset():
+            proxysql.register_backend(ProxySQLMySQLBackend('foo'))
+            raise OperationalError(2003, 'foo')
+
+    queries = [c[0][0] for c in mock_execute.call_args_list]
+    assert 'LOAD MYSQL SERVERS TO RUNTIME' not in queries
+    assert queries[-1] == 'LOAD MYSQL SERVERS FROM RUNTIME'
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'execute')
+def test_register_deregister_backends(mock_execute, proxysql):
+    with proxysql.changeset():
+        proxysql.register_backends([ProxySQLMySQLBackend('foo'),
+                                    ProxySQLMySQLBackend('bar')])
+        proxysql.deregister_backends([ProxySQLMySQLBackend('xyz', port=3307),
+                                      ProxySQLMySQLBackend('abc')])
+        proxysql.register_backends([])
+        proxysql.deregister_backends([])
+
+    calls = mock_execute.call_args_list
+    assert len(calls) == 3
+    query, args = calls[0][0]
+    assert query.count('(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)') == 2
+    assert args[1] == 'foo' and args[12] == 'bar'
+    query, args = calls[1][0]
+    assert query == 'DELETE FROM `mysql_servers` WHERE ' \
+                    '(`hostgroup_id` = %s AND `hostname` = %s AND `port` = %s)' \
+                    ' OR ' \
+                    '(`hostgroup_id` = %s AND `hostname` = %s AND `port` = %s)'
+    assert args == [0, 'xyz', 3307, 0, 'abc', 3306]
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'execute')
+def test_discard_servers_of_hostgroups(mock_execute, proxysql):
+    proxysql.discard_servers(hostgroup_ids=[10, 11])
+
+    (delete, delete_args), (restore, restore_args) = \
+        [c[0] for c in mock_execute.call_args_list]
+    assert delete == 'DELETE FROM `mysql_servers` WHERE ' \
+                     '`hostgroup_id` = %s OR `hostgroup_id` = %s'
+    assert restore.startswith('INSERT INTO `mysql_servers`(')
+    assert restore.endswith(' FROM `runtime_mysql_servers` WHERE '
+                            '`hostgroup_id` = %s OR `hostgroup_id` = %s')
+    assert delete_args == restore_args == [10, 11]
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.connection.execute')
+@mock.patch('proxysql_tools.proxysql.proxysql.pymysql')
+def test_changeset_holds_connection(mock_pymysql, mock_execute, proxysql):
+    done = []
+    thread = Thread(target=lambda: done.append(proxysql.execute('SELECT 1')))
+    with proxysql.changeset():
+        thread.start()
+        thread.join(0.1)
+        # Other threads wait until the changeset is closed
+        assert thread.is_alive()
+    thread.join()
+    assert done == [mock_execute.return_value]
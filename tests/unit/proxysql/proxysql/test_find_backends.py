@@ -54,7 +54,7 @@ def test_find_backends_raises(mock_execute, proxysql):
         '`max_connections`, `max_replication_lag`, `use_ssl`, '
         '`max_latency_ms`, `comment` '
         'FROM `mysql_servers` '
-        'WHERE 1=1 AND hostgroup_id = 10 AND status = \'ONLINE\'',
+        'WHERE `hostgroup_id` = %s AND `status` = %s',
         [
             {
                 u'status': 'ONLINE',
@@ -80,7 +80,7 @@ def test_find_backends_raises(mock_execute, proxysql):
         '`max_connections`, `max_replication_lag`, `use_ssl`, '
         '`max_latency_ms`, `comment` '
         'FROM `mysql_servers` '
-        'WHERE 1=1 AND hostgroup_id = 10',
+        'WHERE `hostgroup_id` = %s',
         [
             {
                 u'status': 'ONLINE',
@@ -105,7 +105,7 @@ def test_find_backends_raises(mock_execute, proxysql):
         '`status`, `weight`, `compression`, '
         '`max_connections`, `max_replication_lag`, `use_ssl`, '
         '`max_latency_ms`, `comment` '
-        'FROM `mysql_servers` WHERE 1=1',
+        'FROM `mysql_servers`',
         [
             {
                 u'status': 'ONLINE',
@@ -131,4 +131,8 @@ def test_find_backends(mock_execute, proxysql, query, response,
     mock_execute.return_value = response
     proxysql.find_backends(hostgroup_id=hostgroup_id,
                            status=status)
-    mock_execute.assert_called_once_with(query)
+    args = [arg for arg in (hostgroup_id, status) if arg]
+    if args:
+        mock_execute.assert_called_once_with(query, args)
+    else:
+        mock_execute.assert_called_once_with(query)
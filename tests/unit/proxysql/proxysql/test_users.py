@@ -0,0 +1,110 @@
+import mock
+import pytest
+
+from proxysql_tools.proxysql.proxysql import ProxySQL, ProxySQLMySQLUser
+
+
+def _users(n):
+    return (ProxySQLMySQLUser(username='user%d' % i, password='*pwd')
+            for i in xrange(n))
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'execute')
+def test_add_users_in_batches(mock_execute, proxysql):
+    assert proxysql.add_users(_users(5), batch_size=2) == 5
+
+    calls = mock_execute.call_args_list
+    assert [c[0][0] for c in calls[3:]] == [
+        'LOAD MYSQL USERS TO RUNTIME',
+        'SAVE MYSQL USERS TO DISK'
+    ]
+    query, args = calls[0][0]
+    assert query.startswith('REPLACE INTO `mysql_users`(`username`, ')
+    assert query.count('(%s, %s, %s, %s, %s, %s, '
+                       '%s, %s, %s, %s, %s, %s)') == 2
+    assert args[:2] == ['user0', '*pwd']
+    assert len(args) == 24
+    assert len(calls[2][0][1]) == 12
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'execute')
+def test_add_users_empty(mock_execute, proxysql):
+    assert proxysql.add_users([]) == 0
+    assert not mock_execute.called
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'execute')
+def test_add_users_discards_on_error(mock_execute, proxysql):
+    def users():
+        for user in _users(3):
+            yield user
+        raise ValueError('bad user')
+
+    with pytest.raises(ValueError):
+        proxysql.add_users(users(), batch_size=2)
+
+    queries = [c[0][0] for c in mock_execute.call_args_list]
+    assert queries[-1] == 'LOAD MYSQL USERS FROM RUNTIME'
+    assert 'LOAD MYSQL USERS TO RUNTIME' not in queries
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'execute')
+def test_add_user(mock_execute, proxysql):
+    user = ProxySQLMySQLUser(username='foo', password='*pwd')
+    proxysql.add_user(user)
+    queries = [c[0][0] for c in mock_execute.call_args_list]
+    assert queries[-2:] == [
+        'LOAD MYSQL USERS TO RUNTIME',
+        'SAVE MYSQL USERS TO DISK'
+    ]
+
+
+def _user_rows(n):
+    return [
+        {
+            'username': 'user%d' % i,
+            'password': '',
+            'active': '1',
+            'use_ssl': '0',
+            'default_hostgroup': '0',
+            'default_schema': None,
+            'schema_locked': '0',
+            'transaction_persistent': '0',
+            'fast_forward': '0',
+            'backend': '1',
+            'frontend': '1',
+            'max_connections': '10000'
+        }
+        for i in xrange(n)
+    ]
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'execute')
+def test_iter_users(mock_execute, proxysql):
+    rows = _user_rows(5)
+    mock_execute.side_effect = [rows[:2], rows[2:4], rows[4:]]
+
+    users = proxysql.iter_users(page_size=2)
+    assert not mock_execute.called
+    assert [u.username for u in users] == ['user%d' % i for i in xrange(5)]
+
+    queries = [c[0] for c in mock_execute.call_args_list]
+    assert len(queries) == 3
+    assert queries[0][0].endswith(' ORDER BY `username`, `backend` LIMIT 2')
+    assert queries[1][1] == ('user1', 'user1', 1)
+    assert queries[2][1] == ('user3', 'user3', 1)
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'execute')
+def test_iter_users_stops_early(mock_execute, proxysql):
+    mock_execute.return_value = _user_rows(2)
+    users = proxysql.iter_users(page_size=2)
+    assert next(users).username == 'user0'
+    users.close()
+    mock_execute.assert_called_once()
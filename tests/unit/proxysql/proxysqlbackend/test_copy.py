@@ -0,0 +1,25 @@
+from proxysql_tools.proxysql.proxysqlbackend import ProxySQLMySQLBackend, \
+    BackendStatus, BackendRole
+
+
+def test_copy():
+    backend = ProxySQLMySQLBackend(
+        'foo', hostgroup_id=10, port=3307, weight=5,
+        comment='{"admin_status": "OFFLINE_HARD", "role": "Writer"}')
+    copy = backend.copy(status=BackendStatus.offline_soft)
+
+    assert copy == backend
+    assert copy is not backend
+    assert copy.weight == 5
+    assert copy.role == BackendRole.writer
+    assert copy.admin_status == BackendStatus.offline_hard
+    assert copy.status == BackendStatus.offline_soft
+    assert backend.status == BackendStatus.online
+
+
+def test_same_config():
+    backend = ProxySQLMySQLBackend('foo', hostgroup_id=10, comment='Reader')
+    assert backend.same_config(backend.copy())
+    assert not backend.same_config(backend.copy(weight=2))
+    assert not backend.same_config(backend.copy(role=BackendRole.writer))
+    assert not backend.same_config(backend.copy(hostgroup_id=11))
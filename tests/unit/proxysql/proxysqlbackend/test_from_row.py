@@ -0,0 +1,59 @@
+import json
+
+import mock
+import pytest
+
+from proxysql_tools.proxysql.proxysqlbackend import ProxySQLMySQLBackend, \
+    BackendStatus, BackendRole
+
+
+def test_from_row():
+    row = {
+        u'hostgroup_id': '10',
+        u'hostname': '192.168.90.2',
+        u'port': '3307',
+        u'status': 'OFFLINE_SOFT',
+        u'weight': '2',
+        u'compression': '0',
+        u'max_connections': '100',
+        u'max_replication_lag': '0',
+        u'use_ssl': '1',
+        u'max_latency_ms': '5',
+        u'comment': '{"admin_status": null, "role": "Reader"}'
+    }
+    backend = ProxySQLMySQLBackend.from_row(row)
+
+    assert backend == ProxySQLMySQLBackend('192.168.90.2',
+                                           hostgroup_id=10, port=3307)
+    assert backend.status == BackendStatus.offline_soft
+    assert backend.weight == 2
+    assert backend.max_connections == 100
+    assert backend.use_ssl is True
+    assert backend.max_latency_ms == 5
+    assert backend.role == BackendRole.reader
+    assert backend.admin_status is None
+
+
+def test_no_instance_dict():
+    with pytest.raises(AttributeError):
+        ProxySQLMySQLBackend('foo').foo = 'bar'
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.proxysql.proxysqlbackend.json.loads')
+def test_comment_is_parsed_once_and_lazily(mock_loads):
+    mock_loads.return_value = {'role': 'Writer', 'admin_status': 'ONLINE'}
+    backend = ProxySQLMySQLBackend(
+        'foo', comment=json.dumps(mock_loads.return_value))
+    assert not mock_loads.called
+
+    assert backend.role == BackendRole.writer
+    assert backend.admin_status == BackendStatus.online
+    assert mock_loads.call_count == 1
+
+
+def test_set_role_keeps_admin_status():
+    backend = ProxySQLMySQLBackend(
+        'foo', comment='{"admin_status": "OFFLINE_HARD", "role": "Reader"}')
+    backend.role = BackendRole.writer
+    assert backend.admin_status == BackendStatus.offline_hard
@@ -236,3 +236,12 @@ def test_init_if_role_is_empty(kwargs, role):
 def test_init_if_role_is_empty(kwargs, admin_status):
     backend = ProxySQLMySQLBackend('foo', **kwargs)
     assert backend.admin_status == admin_status
+
+
+@pytest.mark.parametrize('comment, status', [
+    ('{"admin_status": "OFFLINE_HARD", "role": "Writer"}', 'ONLINE'),
+    ('Writer', 'OFFLINE_SOFT')
+])
+def test_backend_status_is_not_overridden(comment, status):
+    backend = ProxySQLMySQLBackend('foo', status=status, comment=comment)
+    assert backend.status == status
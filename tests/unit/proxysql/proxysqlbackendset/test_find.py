@@ -17,3 +17,14 @@ def test_find():
     bs.add(be)
 
     assert bs.find('foo') == be
+
+
+def test_find_hostgroup_and_port():
+    bs = ProxySQLMySQLBackendSet()
+    be = ProxySQLMySQLBackend('foo', hostgroup_id=10, port=3307)
+    bs.add(ProxySQLMySQLBackend('foo', hostgroup_id=11, port=3307))
+    bs.add(be)
+
+    assert bs.find('foo', hostgroup_id=10, port=3307) is be
+    with pytest.raises(ProxySQLBackendNotFound):
+        bs.find('foo', hostgroup_id=10)
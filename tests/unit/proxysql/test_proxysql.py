@@ -1,11 +1,14 @@
+import socket
+import time
+
 import mock
 import pytest
-from pymysql import OperationalError
+from pymysql import OperationalError, MySQLError
 from pymysql.cursors import DictCursor
 
 from proxysql_tools.proxysql.exceptions import ProxySQLUserNotFound
 from proxysql_tools.proxysql.proxysql import ProxySQLMySQLBackend, \
-    ProxySQLMySQLUser, ProxySQL
+    ProxySQLMySQLUser, ProxySQL, SELECT_USERS
 from proxysql_tools.proxysql.proxysqlbackend import BackendStatus
 
 
@@ -95,6 +98,27 @@ def test_proxysql_mysql_user_with_type_conversion():
     assert mu.max_connections == 10
 
 
+def test_proxysql_mysql_user_from_row():
+    row = {
+        u'username': 'foo',
+        u'password': 'qwerty',
+        u'active': '1',
+        u'use_ssl': '0',
+        u'default_hostgroup': '10',
+        u'default_schema': 'bar',
+        u'schema_locked': '0',
+        u'transaction_persistent': '1',
+        u'fast_forward': '0',
+        u'backend': '1',
+        u'frontend': '1',
+        u'max_connections': '10'
+    }
+    assert ProxySQLMySQLUser.from_row(row) == ProxySQLMySQLUser(
+        username='foo', password='qwerty', default_hostgroup=10,
+        default_schema='bar', transaction_persistent=True,
+        max_connections=10)
+
+
 def test_proxysql():
     ps = ProxySQL(host='foo',
                   port='3307',
@@ -106,6 +130,22 @@ def test_proxysql():
     assert ps.password == 'qwerty'
 
 
+def test_execute_stalled_admin():
+    # Accepts connections, but never says a word
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(5)
+    try:
+        proxysql = ProxySQL(host='127.0.0.1', port=server.getsockname()[1],
+                            timeout=0.2)
+        started = time.time()
+        with pytest.raises(MySQLError):
+            proxysql.execute('SELECT 1')
+        assert time.time() - started < 5
+    finally:
+        server.close()
+
+
 # noinspection PyUnresolvedReferences
 @mock.patch.object(ProxySQL, '_connect')
 def test_execute(mock_connect, proxysql):
@@ -155,32 +195,32 @@ def test_reload_runtime(mock_execute, proxysql):
 def test_register_backend(mock_execute, mock_reload_servers, proxysql):
     backend = ProxySQLMySQLBackend('foo')
     proxysql.register_backend(backend)
-    expected_query = "REPLACE INTO mysql_servers(" \
+    expected_query = "REPLACE INTO `mysql_servers`(" \
                      "`hostgroup_id`, `hostname`, `port`, " \
                      "`status`, `weight`, `compression`, " \
                      "`max_connections`, `max_replication_lag`, `use_ssl`, " \
                      "`max_latency_ms`, `comment`) " \
-                     "VALUES(" \
-                     "0, 'foo', 3306, " \
-                     "'ONLINE', 1, 0, " \
-                     "10000, 0, 0, " \
-                     "0, '{\"admin_status\": null, \"role\": null}'" \
-                     ")"
-    mock_execute.assert_called_once_with(expected_query)
+                     "VALUES " \
+                     "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+    expected_args = [0, 'foo', 3306,
+                     'ONLINE', 1, 0,
+                     10000, 0, 0,
+                     0, '{"admin_status": null, "role": null}']
+    mock_execute.assert_called_once_with(expected_query, expected_args)
     mock_reload_servers.assert_called_once_with()
 
 
 # noinspection PyUnresolvedReferences
-@mock.patch.object(ProxySQL, 'reload_runtime')
+@mock.patch.object(ProxySQL, 'reload_servers')
 @mock.patch.object(ProxySQL, 'execute')
-def test_deregister_backend(mock_execute, mock_runtime, proxysql):
+def test_deregister_backend(mock_execute, mock_reload_servers, proxysql):
 
     backend = ProxySQLMySQLBackend('foo', hostgroup_id=10, port=3307)
     proxysql.deregister_backend(backend)
-    query = "DELETE FROM mysql_servers " \
-            "WHERE hostgroup_id=10 AND hostname='foo' AND port=3307"
-    mock_execute.assert_called_once_with(query)
-    mock_runtime.assert_called_once_with()
+    query = "DELETE FROM `mysql_servers` " \
+            "WHERE (`hostgroup_id` = %s AND `hostname` = %s AND `port` = %s)"
+    mock_execute.assert_called_once_with(query, [10, 'foo', 3307])
+    mock_reload_servers.assert_called_once_with()
 
 
 @pytest.mark.parametrize('kwargs_in, kwargs_out', [
@@ -255,7 +295,10 @@ def test_connect(mock_pymysql, kwargs_in, kwargs_out):
 ])
 @mock.patch.object(ProxySQL, 'execute')
 def test_get_users(mock_execute, proxysql, response):
-    query = "SELECT * FROM mysql_users"
+    query = "SELECT `username`, `password`, `active`, `use_ssl`, " \
+            "`default_hostgroup`, `default_schema`, `schema_locked`, " \
+            "`transaction_persistent`, `fast_forward`, `backend`, " \
+            "`frontend`, `max_connections` FROM `mysql_users`"
     mock_execute.return_value = response
     proxysql.get_users()
     mock_execute.assert_called_once_with(query)
@@ -285,8 +328,8 @@ def test_delete_user(mock_reload, mock_save, mock_execute, proxysql):
 @mock.patch.object(ProxySQL, 'execute')
 def test_get_user(mock_execute, proxysql):
     proxysql.get_user('test')
-    query = "SELECT * FROM mysql_users WHERE username = 'test'"
-    mock_execute.assert_called_once_with(query)
+    query = SELECT_USERS + " WHERE `username` = %s"
+    mock_execute.assert_called_once_with(query, ('test', ))
 
 
 # noinspection PyUnresolvedReferences
@@ -296,5 +339,88 @@ def test_get_user_if_user_does_not_exist(mock_execute, proxysql):
     with pytest.raises(ProxySQLUserNotFound):
         proxysql.get_user('test')
 
-    query = "SELECT * FROM mysql_users WHERE username = 'test'"
-    mock_execute.assert_called_once_with(query)
+    query = SELECT_USERS + " WHERE `username` = %s"
+    mock_execute.assert_called_once_with(query, ('test', ))
+
+
+@mock.patch('proxysql_tools.proxysql.proxysql.pymysql')
+def test_connect_reuses_connection(mock_pymysql, proxysql):
+    # noinspection PyProtectedMember,PyUnusedLocal
+    with proxysql._connect() as conn_a:
+        pass
+    # noinspection PyProtectedMember,PyUnusedLocal
+    with proxysql._connect() as conn_b:
+        pass
+    assert conn_a is conn_b
+    mock_pymysql.connect.assert_called_once_with(
+        connect_timeout=20,
+        cursorclass=DictCursor,
+        passwd=None,
+        host='localhost',
+        port=3306,
+        user='root'
+    )
+
+
+@mock.patch('proxysql_tools.connection.time')
+@mock.patch('proxysql_tools.proxysql.proxysql.pymysql')
+def test_connect_pings_idle_connection(mock_pymysql, mock_time, proxysql):
+    mock_time.time.return_value = 100
+    # noinspection PyProtectedMember,PyUnusedLocal
+    with proxysql._connect() as conn:
+        pass
+    mock_time.time.return_value = 200
+    # noinspection PyProtectedMember,PyUnusedLocal
+    with proxysql._connect() as conn:
+        pass
+    conn.ping.assert_called_once_with(reconnect=True)
+    mock_pymysql.connect.assert_called_once()
+
+
+@mock.patch('proxysql_tools.proxysql.proxysql.pymysql')
+def test_connect_drops_failed_connection(mock_pymysql, proxysql):
+    with pytest.raises(OperationalError):
+        # noinspection PyProtectedMember,PyUnusedLocal
+        with proxysql._connect() as conn:
+            raise OperationalError(1105, 'foo')
+    conn.close.assert_called_once_with()
+    # noinspection PyProtectedMember,PyUnusedLocal
+    with proxysql._connect() as conn:
+        pass
+    assert mock_pymysql.connect.call_count == 2
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.connection.execute')
+@mock.patch('proxysql_tools.proxysql.proxysql.pymysql')
+def test_execute_retries_lost_connection(mock_pymysql, mock_execute,
+                                         proxysql):
+    mock_execute.side_effect = [
+        OperationalError(2013, 'Lost connection to MySQL server'),
+        [{'result': '1'}]
+    ]
+    assert proxysql.execute('SELECT 1 AS result') == [{'result': '1'}]
+    assert mock_execute.call_count == 2
+    assert mock_pymysql.connect.call_count == 2
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.connection.execute')
+@mock.patch('proxysql_tools.proxysql.proxysql.pymysql')
+def test_execute_does_not_retry_writes(mock_pymysql, mock_execute, proxysql):
+    mock_execute.side_effect = OperationalError(
+        2013, 'Lost connection to MySQL server')
+    with pytest.raises(OperationalError):
+        proxysql.execute('LOAD MYSQL SERVERS TO RUNTIME')
+    mock_execute.assert_called_once()
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.connection.execute')
+@mock.patch('proxysql_tools.proxysql.proxysql.pymysql')
+def test_execute_does_not_retry_query_errors(mock_pymysql, mock_execute,
+                                             proxysql):
+    mock_execute.side_effect = OperationalError(1045, 'Access denied')
+    with pytest.raises(OperationalError):
+        proxysql.execute('SELECT 1 AS result')
+    mock_execute.assert_called_once()
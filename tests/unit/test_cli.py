@@ -0,0 +1,45 @@
+import json
+import subprocess
+import sys
+
+import mock
+from click.testing import CliRunner
+
+from proxysql_tools.cli import main
+from proxysql_tools.stats import STATS
+
+
+def test_cli_does_not_import_aws():
+    statement = 'import sys; ' \
+                'import proxysql_tools.cli; ' \
+                'sys.exit(int("boto3" in sys.modules or ' \
+                '"prettytable" in sys.modules))'
+    assert subprocess.call([sys.executable, '-c', statement]) == 0
+
+
+@mock.patch('proxysql_tools.cli.ProxySQL')
+def test_stats_file(mock_proxysql, tmpdir):
+    config = tmpdir.join('proxysql-tool.cfg')
+    config.write('[proxysql]\n')
+    stats_file = tmpdir.join('stats.json')
+    mock_proxysql.return_value.ping.return_value = True
+
+    result = CliRunner().invoke(main, ['--config', str(config),
+                                       '--stats-file', str(stats_file),
+                                       'ping'])
+
+    assert result.exit_code == 0
+    assert sorted(json.loads(stats_file.read())) == ['connects', 'queries']
+    STATS.enabled = False
+    STATS.reset()
+
+
+def test_register_lock_error(tmpdir):
+    config = tmpdir.join('proxysql-tool.cfg')
+    config.write('[galera]\nlock_file=%s\n'
+                 % tmpdir.join('missing', 'register.lock'))
+
+    result = CliRunner().invoke(main, ['--config', str(config),
+                                       'galera', 'register'])
+
+    assert result.exit_code == 1
@@ -0,0 +1,14 @@
+import pytest
+
+from proxysql_tools.connection import read_only
+
+
+@pytest.mark.parametrize('query, result', [
+    ('SELECT 1', True),
+    ('  show global status', True),
+    ('REPLACE INTO mysql_servers VALUES (%s)', False),
+    ('LOAD MYSQL SERVERS TO RUNTIME', False),
+    ('', False)
+])
+def test_read_only(query, result):
+    assert read_only(query) == result
@@ -0,0 +1,515 @@
+import itertools
+import json
+
+import mock
+import pytest
+from pymysql import OperationalError
+
+from proxysql_tools.galera.galera_node import GaleraNode, GaleraNodeStatus, \
+    GaleraNodeState
+from proxysql_tools.galera.galeranodeset import GaleraNodeSet
+from proxysql_tools.load_balancing_mode import plan_singlewriter, \
+    diff_backends, apply_backends, singlewriter, node_load, target_weight, \
+    smoothed_weight, plan_reader_weights, READER_WEIGHT_MAX, \
+    FlowControlLimits, flow_control_sent_rate, throttled_nodes, \
+    plan_multiwriter, ReaderLagLimits, plan_reader_latency
+from proxysql_tools.proxysql.proxysql import ProxySQL
+from proxysql_tools.proxysql.proxysqlbackend import ProxySQLMySQLBackend, \
+    BackendStatus, BackendRole
+from proxysql_tools.proxysql.proxysqlbackendset import ProxySQLMySQLBackendSet
+
+W = 10
+R = 11
+
+
+def _nodes(*states):
+    """Nodes node1..nodeN. None means the node is unreachable."""
+    nodes = GaleraNodeSet()
+    for i, state in enumerate(states):
+        node = GaleraNode('node%d' % (i + 1))
+        if state is None:
+            node.reset_status(error=OperationalError(2003, 'down'))
+        else:
+            node.reset_status(
+                status=GaleraNodeStatus({'wsrep_local_state': str(state)}))
+        nodes.add(node)
+    return nodes
+
+
+def _backend(host, hostgroup_id, status=BackendStatus.online,
+             admin_status=None):
+    role = BackendRole.writer if hostgroup_id == W else BackendRole.reader
+    comment = {'role': role, 'admin_status': admin_status}
+    return ProxySQLMySQLBackend(host, hostgroup_id=hostgroup_id,
+                                status=status, comment=json.dumps(comment))
+
+
+def _backends(*backends):
+    result = ProxySQLMySQLBackendSet()
+    for backend in backends:
+        result.add(backend)
+    return result
+
+
+def _rows(backends):
+    return sorted((b.hostgroup_id, b.hostname, b.status) for b in backends)
+
+
+S = GaleraNodeState.SYNCED
+D = GaleraNodeState.DONOR
+
+
+def test_plan_empty_proxysql():
+    desired = plan_singlewriter(_backends(), _nodes(S, S, S), W, R)
+    assert _rows(desired) == [
+        (W, 'node1', 'ONLINE'),
+        (R, 'node2', 'ONLINE'),
+        (R, 'node3', 'ONLINE')
+    ]
+
+
+def test_plan_keeps_healthy_writer():
+    current = _backends(_backend('node2', W),
+                        _backend('node1', R),
+                        _backend('node3', R))
+    desired = plan_singlewriter(current, _nodes(S, S, S), W, R)
+    assert _rows(desired) == _rows(current)
+    assert diff_backends(current, desired) == ([], [])
+
+
+def test_plan_fails_over():
+    current = _backends(_backend('node1', W),
+                        _backend('node2', R),
+                        _backend('node3', R))
+    desired = plan_singlewriter(current, _nodes(D, S, S), W, R)
+    assert _rows(desired) == [
+        (W, 'node1', 'OFFLINE_SOFT'),
+        (W, 'node2', 'ONLINE'),
+        (R, 'node3', 'ONLINE')
+    ]
+    # current is not changed
+    assert current.find('node1', W).status == BackendStatus.online
+
+
+def test_plan_unreachable_node():
+    current = _backends(_backend('node1', W),
+                        _backend('node2', R),
+                        _backend('node3', R))
+    desired = plan_singlewriter(current, _nodes(S, None, S), W, R)
+    assert desired.find('node2', R).status == BackendStatus.offline_hard
+    assert desired.find('node2', R).admin_status is None
+
+
+def test_plan_former_writer_serves_reads():
+    current = _backends(_backend('node1', W, BackendStatus.offline_soft),
+                        _backend('node2', W),
+                        _backend('node3', R))
+    desired = plan_singlewriter(current, _nodes(S, S, S), W, R)
+    assert _rows(desired) == [
+        (W, 'node2', 'ONLINE'),
+        (R, 'node1', 'ONLINE'),
+        (R, 'node3', 'ONLINE')
+    ]
+
+
+def test_plan_writer_is_reader_if_no_readers():
+    current = _backends(_backend('node1', W),
+                        _backend('node2', R),
+                        _backend('node3', R))
+    desired = plan_singlewriter(current, _nodes(S, D, D), W, R)
+    assert _rows(desired) == [
+        (W, 'node1', 'ONLINE'),
+        (R, 'node1', 'ONLINE'),
+        (R, 'node2', 'OFFLINE_SOFT'),
+        (R, 'node3', 'OFFLINE_SOFT')
+    ]
+
+
+def test_plan_ignore_writer():
+    ignore = ProxySQLMySQLBackend('node1', hostgroup_id=W)
+    desired = plan_singlewriter(_backends(), _nodes(S, S), W, R,
+                                ignore_writer=ignore)
+    assert desired.find('node2', W).status == BackendStatus.online
+
+    desired = plan_singlewriter(_backends(), _nodes(S, D), W, R,
+                                ignore_writer=ignore)
+    assert desired.find('node1', W).status == BackendStatus.online
+
+
+def test_plan_keeps_admin_offline():
+    current = _backends(
+        _backend('node1', W, BackendStatus.offline_hard,
+                 admin_status=BackendStatus.offline_hard),
+        _backend('node2', R),
+        _backend('node3', R))
+    desired = plan_singlewriter(current, _nodes(S, S, S), W, R)
+    assert _rows(desired) == [
+        (W, 'node1', 'OFFLINE_HARD'),
+        (W, 'node2', 'ONLINE'),
+        (R, 'node3', 'ONLINE')
+    ]
+
+
+def test_plan_removes_strangers():
+    current = _backends(_backend('node1', W),
+                        _backend('stranger', R))
+    desired = plan_singlewriter(current, _nodes(S), W, R)
+    assert _rows(desired) == [
+        (W, 'node1', 'ONLINE'),
+        (R, 'node1', 'ONLINE')
+    ]
+    assert diff_backends(current, desired)[1] == [current.find('stranger', R)]
+
+
+def test_diff_backends():
+    current = _backends(_backend('node1', W), _backend('node2', R))
+    desired = _backends(_backend('node1', W, BackendStatus.offline_soft),
+                        _backend('node3', R))
+    register, deregister = diff_backends(current, desired)
+    assert [(b.hostname, b.status) for b in register] == [
+        ('node1', 'OFFLINE_SOFT'),
+        ('node3', 'ONLINE')
+    ]
+    assert deregister == [_backend('node2', R)]
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'reload_servers')
+@mock.patch.object(ProxySQL, 'execute')
+def test_apply_backends(mock_execute, mock_reload):
+    proxysql = ProxySQL()
+    current = _backends(_backend('node1', W), _backend('node2', R),
+                        _backend('node3', R))
+    desired = _backends(_backend('node1', W), _backend('node4', R),
+                        _backend('node5', R))
+
+    apply_backends(proxysql, current, desired)
+
+    queries = [c[0][0] for c in mock_execute.call_args_list]
+    assert len(queries) == 2
+    assert queries[0].startswith('REPLACE INTO `mysql_servers`')
+    assert queries[1].startswith('DELETE FROM `mysql_servers`')
+    mock_reload.assert_called_once_with()
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'reload_servers')
+@mock.patch.object(ProxySQL, 'execute')
+def test_apply_backends_no_changes(mock_execute, mock_reload):
+    backends = _backends(_backend('node1', W), _backend('node2', R))
+    apply_backends(ProxySQL(), backends, backends)
+    assert not mock_execute.called
+    assert not mock_reload.called
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.load_balancing_mode.apply_backends')
+@mock.patch.object(ProxySQL, 'find_backends')
+def test_singlewriter_reads_once(mock_find_backends, mock_apply):
+    mock_find_backends.return_value = _backends(_backend('node1', W),
+                                                _backend('node2', R),
+                                                _backend('foo', 1))
+    galera_cluster = mock.Mock()
+    galera_cluster.nodes = _nodes(S, S)
+
+    singlewriter(galera_cluster, ProxySQL(), W, R)
+
+    mock_find_backends.assert_called_once_with()
+    current = mock_apply.call_args[0][1]
+    assert _rows(current) == [(W, 'node1', 'ONLINE'), (R, 'node2', 'ONLINE')]
+
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch.object(ProxySQL, 'execute')
+@mock.patch.object(ProxySQL, 'find_backends')
+def test_singlewriter_failover_loads_once(mock_find_backends, mock_execute):
+    mock_find_backends.return_value = _backends(_backend('node1', W),
+                                                _backend('node2', R),
+                                                _backend('node3', R))
+    galera_cluster = mock.Mock()
+    galera_cluster.nodes = _nodes(D, S, S)
+
+    singlewriter(galera_cluster, ProxySQL(), W, R)
+
+    calls = mock_execute.call_args_list
+    queries = [c[0][0] for c in calls]
+    assert queries.count('LOAD MYSQL SERVERS TO RUNTIME') == 1
+    assert queries[-1] == 'LOAD MYSQL SERVERS TO RUNTIME'
+    # The old writer goes offline and the new one goes online
+    # in the same statement.
+    replace = [c[0][1] for c in calls if c[0][0].startswith('REPLACE')]
+    assert len(replace) == 1
+    assert [replace[0][i:i + 4] for i in (0, 11)] == [
+        [W, 'node1', 3306, 'OFFLINE_SOFT'],
+        [W, 'node2', 3306, 'ONLINE']
+    ]
+
+
+def _loaded_nodes(*loads):
+    """SYNCED nodes node1..nodeN with given Threads_running.
+    None means the node is unreachable."""
+    nodes = GaleraNodeSet()
+    for i, load in enumerate(loads):
+        node = GaleraNode('node%d' % (i + 1))
+        if load is None:
+            node.reset_status(error=OperationalError(2003, 'down'))
+        else:
+            node.reset_status(status=GaleraNodeStatus({
+                'wsrep_local_state': str(S),
+                'Threads_running': str(load)
+            }))
+        nodes.add(node)
+    return nodes
+
+
+def test_node_load():
+    assert node_load(GaleraNodeStatus({})) == 0
+    assert node_load(GaleraNodeStatus({
+        'Threads_running': '3',
+        'wsrep_local_recv_queue': '2',
+        'wsrep_flow_control_paused': '0.1'
+    })) == 15
+
+
+def test_target_weight():
+    assert target_weight(0) == READER_WEIGHT_MAX
+    assert target_weight(1) == READER_WEIGHT_MAX / 2
+    assert target_weight(10 ** 6) == 1
+
+
+def test_smoothed_weight():
+    # within hysteresis
+    assert smoothed_weight(450, 500) == 450
+    assert smoothed_weight(550, 500) == 550
+    # half way to the target
+    assert smoothed_weight(100, 500) == 300
+    assert smoothed_weight(900, 500) == 700
+
+
+def test_plan_reader_weights():
+    current = _backends(_backend('node1', W),
+                        _backend('node2', R),
+                        _backend('node3', R),
+                        _backend('node4', R, BackendStatus.offline_soft),
+                        _backend('node5', R))
+    desired = plan_reader_weights(current,
+                                  _loaded_nodes(0, 0, 99, 0, None), R)
+    weights = dict((b.hostname, b.weight) for b in desired)
+    # writer, offline and unreachable backends keep their weights
+    assert weights['node1'] == 1
+    assert weights['node4'] == 1
+    assert weights['node5'] == 1
+    # readers move towards their targets
+    assert weights['node2'] == 501
+    assert weights['node3'] == 6
+    # current is not changed
+    assert current.find('node2', R).weight == 1
+
+
+def test_plan_reader_weights_settles():
+    nodes = _loaded_nodes(0, 1, 3)
+    backends = plan_singlewriter(_backends(), nodes, W, R)
+    changes = []
+    for _ in xrange(10):
+        desired = plan_reader_weights(backends, nodes, R)
+        register, _ = diff_backends(backends, desired)
+        changes.append(len(register))
+        backends = desired
+    # weights stop changing after a few passes
+    assert changes[-5:] == [0] * 5
+    weights = dict((b.hostname, b.weight) for b in backends)
+    assert weights['node2'] > weights['node3']
+
+
+def _fc_node(host, sent=(0, 0), recv_queue_avg='0.0'):
+    """SYNCED node probed twice, 10 seconds apart."""
+    node = GaleraNode(host)
+    for i, value in enumerate(sent):
+        node.reset_status(status=GaleraNodeStatus({
+            'wsrep_local_state': str(S),
+            'wsrep_flow_control_sent': str(value),
+            'wsrep_local_recv_queue_avg': recv_queue_avg
+        }, taken_at=100.0 + i * 10))
+    return node
+
+
+def test_flow_control_sent_rate():
+    assert flow_control_sent_rate(_fc_node('node1', (5, 25))) == 2
+    # one probe
+    assert flow_control_sent_rate(_fc_node('node1', (5, ))) is None
+    # FLUSH STATUS
+    assert flow_control_sent_rate(_fc_node('node1', (25, 5))) is None
+
+
+def test_throttled_nodes():
+    nodes = GaleraNodeSet()
+    nodes.add(_fc_node('node1', (0, 100)))
+    nodes.add(_fc_node('node2', (0, 30)))
+    nodes.add(_fc_node('node3', (0, 30)))
+    nodes.add(_fc_node('node4', (0, 10)))
+    nodes.add(_fc_node('node5', (0, )))
+    current = _backends(_backend('node1', R),
+                        _backend('node2', R),
+                        _backend('node3', R, BackendStatus.offline_soft),
+                        _backend('node4', R, BackendStatus.offline_soft),
+                        _backend('node5', R, BackendStatus.offline_soft))
+    limits = FlowControlLimits(sent_per_second=5)
+
+    assert throttled_nodes(current, nodes, R, None) == set()
+    # node1 sends 10/s, over the limit.
+    # node2 and node3 send 3/s, within the limit but over the recovery
+    # threshold, so only node3 that is already offline stays offline.
+    # node4 sends 1/s and recovers. Rate of node5 is unknown.
+    assert throttled_nodes(current, nodes, R, limits) == {
+        ('node1', 3306),
+        ('node3', 3306)
+    }
+
+
+def test_throttled_nodes_recv_queue_avg():
+    nodes = GaleraNodeSet()
+    nodes.add(_fc_node('node1', recv_queue_avg='12.5'))
+    nodes.add(_fc_node('node2', recv_queue_avg='0.1'))
+    limits = FlowControlLimits(recv_queue_avg=10)
+    assert throttled_nodes(_backends(), nodes, R, limits) == {
+        ('node1', 3306)
+    }
+
+
+def test_plan_throttled_readers():
+    current = _backends(_backend('node1', W),
+                        _backend('node2', R),
+                        _backend('node3', R))
+    desired = plan_singlewriter(current, _nodes(S, S, S), W, R,
+                                throttled={('node2', 3306)})
+    assert _rows(desired) == [
+        (W, 'node1', 'ONLINE'),
+        (R, 'node2', 'OFFLINE_SOFT'),
+        (R, 'node3', 'ONLINE')
+    ]
+
+    desired = plan_singlewriter(current, _nodes(S, S, S), W, R,
+                                throttled={('node2', 3306), ('node3', 3306)})
+    assert _rows(desired) == [
+        (W, 'node1', 'ONLINE'),
+        (R, 'node1', 'ONLINE'),
+        (R, 'node2', 'OFFLINE_SOFT'),
+        (R, 'node3', 'OFFLINE_SOFT')
+    ]
+
+
+def test_plan_multiwriter():
+    desired = plan_multiwriter(_backends(), _nodes(S, S, D), W, R)
+    assert _rows(desired) == [
+        (W, 'node1', 'ONLINE'),
+        (W, 'node2', 'ONLINE'),
+        (R, 'node1', 'ONLINE'),
+        (R, 'node2', 'ONLINE')
+    ]
+
+
+def test_plan_multiwriter_unhealthy_writer():
+    current = _backends(_backend('node1', W),
+                        _backend('node2', W),
+                        _backend('node1', R),
+                        _backend('node2', R))
+    desired = plan_multiwriter(current, _nodes(S, None), W, R)
+    assert _rows(desired) == [
+        (W, 'node1', 'ONLINE'),
+        (W, 'node2', 'OFFLINE_HARD'),
+        (R, 'node1', 'ONLINE'),
+        (R, 'node2', 'OFFLINE_HARD')
+    ]
+
+
+def test_plan_multiwriter_max_writers_keeps_current():
+    current = _backends(_backend('node3', W))
+    desired = plan_multiwriter(current, _nodes(S, S, S), W, R,
+                               max_writers=2)
+    assert [b.hostname for b in desired if b.hostgroup_id == W] == \
+        ['node3', 'node1']
+
+
+def test_plan_multiwriter_weights_and_ignore_writer():
+    ignore = ProxySQLMySQLBackend('node1', hostgroup_id=W)
+    desired = plan_multiwriter(_backends(), _nodes(S, S, S), W, R,
+                               ignore_writer=ignore,
+                               writer_weights={('node2', 3306): 5})
+    writers = dict((b.hostname, b.weight) for b in desired
+                   if b.hostgroup_id == W)
+    assert writers == {'node2': 5, 'node3': 1}
+
+    desired = plan_multiwriter(_backends(), _nodes(S, D), W, R,
+                               ignore_writer=ignore)
+    assert [b.hostname for b in desired if b.hostgroup_id == W] == ['node1']
+
+
+def _lag_node(host, recv_queue, rtt=0.001):
+    node = GaleraNode(host)
+    node.reset_status(status=GaleraNodeStatus({
+        'wsrep_local_state': str(S),
+        'wsrep_local_recv_queue': str(recv_queue)
+    }, rtt=rtt))
+    return node
+
+
+def test_reader_lag_limits():
+    limits = ReaderLagLimits(recv_queue=100, rtt_ms=50)
+    assert not limits.exceeded(_lag_node('node1', 10))
+    assert limits.exceeded(_lag_node('node1', 101))
+    assert limits.exceeded(_lag_node('node1', 10, rtt=0.2))
+    assert limits.exceeded(_lag_node('node1', 60), factor=0.5)
+    assert not ReaderLagLimits().exceeded(_lag_node('node1', 10 ** 6))
+
+
+def test_throttled_nodes_several_limits():
+    nodes = GaleraNodeSet()
+    nodes.add(_lag_node('node1', 0))
+    nodes.add(_lag_node('node2', 500))
+    nodes.add(_fc_node('node3', recv_queue_avg='20'))
+    current = _backends(_backend('node1', R),
+                        _backend('node2', R),
+                        _backend('node3', R))
+    assert throttled_nodes(current, nodes, R,
+                           FlowControlLimits(recv_queue_avg=10),
+                           None,
+                           ReaderLagLimits(recv_queue=100)) == {
+        ('node2', 3306),
+        ('node3', 3306)
+    }
+
+
+def test_plan_reader_latency():
+    current = _backends(_backend('node1', W), _backend('node2', R))
+    assert plan_reader_latency(current, R, None) is current
+    assert plan_reader_latency(current, R, ReaderLagLimits()) is current
+
+    desired = plan_reader_latency(current, R,
+                                  ReaderLagLimits(max_latency_ms=50))
+    assert desired.find('node1', W).max_latency_ms == 0
+    assert desired.find('node2', R).max_latency_ms == 50
+    assert current.find('node2', R).max_latency_ms == 0
+    assert diff_backends(current, desired)[0] == [desired.find('node2', R)]
+
+
+@pytest.mark.parametrize('plan', [plan_singlewriter, plan_multiwriter])
+def test_plan_is_idempotent(plan):
+    """A pass after a pass with the same node states writes nothing."""
+    starts = [
+        _backends(),
+        _backends(_backend('node1', W), _backend('node2', R),
+                  _backend('node3', R)),
+        _backends(_backend('node2', W, BackendStatus.offline_hard,
+                           admin_status=BackendStatus.offline_hard),
+                  _backend('node1', R, BackendStatus.offline_hard,
+                           admin_status=BackendStatus.offline_hard),
+                  _backend('stranger', R))
+    ]
+    for states in itertools.product((S, D, None), repeat=3):
+        nodes = _nodes(*states)
+        for current in starts:
+            desired = plan(current, nodes, W, R)
+            again = plan(desired, nodes, W, R)
+            assert diff_backends(desired, again) == ([], []), \
+                (states, _rows(current))
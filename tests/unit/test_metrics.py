@@ -0,0 +1,118 @@
+import json
+import urllib2
+
+import pytest
+from pymysql import OperationalError
+
+from proxysql_tools.galera.galera_node import GaleraNode, GaleraNodeStatus
+from proxysql_tools.metrics import RegisterMetrics, start_metrics_server, \
+    render
+from proxysql_tools.proxysql.proxysqlbackend import ProxySQLMySQLBackend, \
+    BackendStatus
+from proxysql_tools.proxysql.proxysqlbackendset import ProxySQLMySQLBackendSet
+
+
+class Cluster(object):  # pylint: disable=too-few-public-methods
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+
+def _cluster():
+    node1 = GaleraNode('node1')
+    node1.reset_status(status=GaleraNodeStatus({
+        'wsrep_local_state': '4',
+        'wsrep_flow_control_paused': '0.25',
+        'wsrep_local_recv_queue': '3'
+    }, rtt=0.002))
+    node2 = GaleraNode('node2')
+    node2.reset_status(error=OperationalError(2003, 'down'))
+    node3 = GaleraNode('node3')
+    return Cluster([node1, node2, node3])
+
+
+def _backends(writer):
+    backends = ProxySQLMySQLBackendSet()
+    backends.add(ProxySQLMySQLBackend(writer, hostgroup_id=10,
+                                      comment=json.dumps({'role': 'Writer'})))
+    backends.add(ProxySQLMySQLBackend('node2', hostgroup_id=11,
+                                      status=BackendStatus.offline_hard))
+    return backends
+
+
+def test_render():
+    metrics = RegisterMetrics(10)
+    metrics.record_pass(_cluster(), _backends('node1'), 0.5)
+    lines = metrics.render().splitlines()
+
+    assert 'proxysql_tools_galera_node_up{node="node1:3306"} 1.0' in lines
+    assert 'proxysql_tools_galera_node_up{node="node2:3306"} 0.0' in lines
+    # node3 wasn't probed
+    assert not [line for line in lines if 'node3' in line]
+    assert 'proxysql_tools_galera_wsrep_local_state{node="node1:3306"} 4.0' \
+        in lines
+    assert 'proxysql_tools_galera_flow_control_paused{node="node1:3306"} ' \
+           '0.25' in lines
+    assert 'proxysql_tools_galera_local_recv_queue{node="node1:3306"} 3.0' \
+        in lines
+    assert 'proxysql_tools_galera_probe_rtt_seconds{node="node1:3306"} ' \
+           '0.002' in lines
+    assert 'proxysql_tools_writer{hostgroup="10",backend="node1:3306"} 1.0' \
+        in lines
+    assert 'proxysql_tools_backend_status{hostgroup="11",' \
+           'backend="node2:3306",status="OFFLINE_HARD"} 1.0' in lines
+    assert 'proxysql_tools_backend_status{hostgroup="11",' \
+           'backend="node2:3306",status="ONLINE"} 0.0' in lines
+    assert 'proxysql_tools_register_duration_seconds 0.5' in lines
+    assert 'proxysql_tools_register_passes_total 1.0' in lines
+    assert 'proxysql_tools_failovers_total 0.0' in lines
+
+
+def test_failovers_and_errors():
+    metrics = RegisterMetrics(10)
+    cluster = _cluster()
+    metrics.record_pass(cluster, _backends('node1'), 0.1)
+    metrics.record_pass(cluster, None, 0.1, failed=True)
+    metrics.record_pass(cluster, None, 0.1, overrun=True)
+    metrics.record_pass(cluster, _backends('node1'), 0.1)
+    metrics.record_pass(cluster, _backends('node3'), 0.1)
+    lines = metrics.render().splitlines()
+
+    assert 'proxysql_tools_failovers_total 1.0' in lines
+    assert 'proxysql_tools_register_errors_total 1.0' in lines
+    assert 'proxysql_tools_register_overruns_total 1.0' in lines
+    assert 'proxysql_tools_register_passes_total 5.0' in lines
+    assert 'proxysql_tools_writer{hostgroup="10",backend="node3:3306"} 1.0' \
+        in lines
+
+
+def test_metrics_server():
+    metrics = RegisterMetrics(10)
+    metrics.record_pass(_cluster(), _backends('node1'), 0.1)
+    server = start_metrics_server(metrics, 0, host='127.0.0.1')
+    try:
+        url = 'http://127.0.0.1:%d' % server.server_address[1]
+        response = urllib2.urlopen(url + '/metrics')
+        assert response.info()['Content-Type'].startswith('text/plain')
+        assert response.read() == metrics.render()
+
+        with pytest.raises(urllib2.HTTPError) as err:
+            urllib2.urlopen(url + '/foo')
+        assert err.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_render_clusters():
+    foo = RegisterMetrics(10, cluster='foo')
+    foo.record_pass(_cluster(), _backends('node1'), 0.1)
+    bar = RegisterMetrics(20, cluster='bar')
+    bar.record_pass(_cluster(), None, 0.1)
+    lines = render([foo, bar]).splitlines()
+
+    assert lines.count('# TYPE proxysql_tools_galera_node_up gauge') == 1
+    assert 'proxysql_tools_galera_node_up{cluster="foo",node="node1:3306"} ' \
+           '1.0' in lines
+    assert 'proxysql_tools_galera_node_up{cluster="bar",node="node1:3306"} ' \
+           '1.0' in lines
+    assert 'proxysql_tools_register_passes_total{cluster="bar"} 1.0' in lines
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from proxysql_tools.util.runlock import RunLock, RunCounters, \
+    RunLockError, private_directory
+
+
+def test_run_lock(tmpdir):
+    path = str(tmpdir.join('run.lock'))
+    lock = RunLock(path)
+    other = RunLock(path)
+    assert lock.acquire()
+    assert lock.owner() == os.getpid()
+    # flock() locks are per open file, so a second lock
+    # in the same process conflicts like another process would.
+    assert not other.acquire()
+    lock.release()
+    assert other.acquire()
+    other.release()
+
+
+def test_run_lock_open_error(tmpdir):
+    lock = RunLock(str(tmpdir.join('missing', 'run.lock')))
+    with pytest.raises(RunLockError):
+        lock.acquire()
+
+
+def test_run_lock_does_not_follow_symlink(tmpdir):
+    target = tmpdir.join('target')
+    target.write('foo')
+    tmpdir.join('run.lock').mksymlinkto(target)
+    with pytest.raises(RunLockError):
+        RunLock(str(tmpdir.join('run.lock'))).acquire()
+    assert target.read() == 'foo'
+
+
+def test_private_directory(tmpdir):
+    path = tmpdir.join('private')
+    private_directory(str(path))
+    assert path.stat().mode & 0o777 == 0o700
+    # An existing directory is checked, not changed
+    private_directory(str(path))
+    path.chmod(0o755)
+    with pytest.raises(RunLockError):
+        private_directory(str(path))
+
+
+def test_run_counters(tmpdir):
+    counters = RunCounters(str(tmpdir.join('run.counters')))
+    assert counters.read() == {}
+    assert counters.increment('skipped')['skipped'] == 1
+    counters.increment('skipped')
+    counters.increment('overruns')
+    result = counters.read()
+    assert result['skipped'] == 2
+    assert result['overruns'] == 1
+    assert 'last_skipped' in result
+
+
+def test_run_counters_broken_file(tmpdir):
+    path = tmpdir.join('run.counters')
+    path.write('foo')
+    counters = RunCounters(str(path))
+    assert counters.read() == {}
+    assert counters.increment('skipped')['skipped'] == 1
@@ -0,0 +1,87 @@
+import json
+
+import mock
+import pytest
+from pymysql import OperationalError
+
+from proxysql_tools.proxysql.proxysql import ProxySQL, REPLACE_SERVERS, \
+    SERVERS_ROW, _statement
+from proxysql_tools.stats import statement_digest, LatencyStats, \
+    QueryStats, STATS
+
+
+@pytest.fixture
+def stats():
+    STATS.reset()
+    STATS.enable()
+    yield STATS
+    STATS.enabled = False
+    STATS.reset()
+
+
+def test_statement_digest():
+    assert statement_digest(_statement(REPLACE_SERVERS, SERVERS_ROW, 3, ', ')) \
+        == statement_digest(_statement(REPLACE_SERVERS, SERVERS_ROW, 1, ', ')) \
+        + ', ...'
+    assert statement_digest('DELETE FROM t WHERE (a = %s) OR (a = %s)') \
+        == 'DELETE FROM t WHERE (a = %s) OR ...'
+    assert statement_digest('SELECT  1\n  FROM t') == 'SELECT 1 FROM t'
+
+
+def test_latency_stats():
+    latency = LatencyStats()
+    latency.add(0.0005)
+    latency.add(0.003, failed=True)
+    latency.add(10)
+    result = latency.as_dict()
+    assert result['count'] == 3
+    assert result['errors'] == 1
+    assert result['min_ms'] == 0.5
+    assert result['max_ms'] == 10000
+    assert result['histogram']['le_1'] == 1
+    assert result['histogram']['le_5'] == 1
+    assert result['histogram']['inf'] == 1
+
+
+def test_disabled_stats_record_nothing():
+    query_stats = QueryStats()
+    with query_stats.query('proxysql', 'SELECT 1'):
+        pass
+    assert query_stats.as_dict() == {'queries': [], 'connects': []}
+
+
+def test_query_stats_errors():
+    query_stats = QueryStats()
+    query_stats.enable()
+    with query_stats.query('proxysql', 'SELECT 1'):
+        pass
+    with pytest.raises(OperationalError):
+        with query_stats.query('proxysql', 'SELECT 1'):
+            raise OperationalError(2003, 'down')
+    queries = query_stats.as_dict()['queries']
+    assert len(queries) == 1
+    assert queries[0]['statement'] == 'SELECT 1'
+    assert queries[0]['count'] == 2
+    assert queries[0]['errors'] == 1
+
+
+# noinspection PyUnresolvedReferences
+@mock.patch('proxysql_tools.connection.execute')
+@mock.patch('proxysql_tools.proxysql.proxysql.pymysql.connect')
+def test_proxysql_execute_is_recorded(mock_connect, mock_execute,
+                                      stats, tmpdir):
+    mock_execute.return_value = ()
+    proxysql = ProxySQL()
+    proxysql.execute('SELECT 1')
+    proxysql.execute('SELECT 1')
+
+    path = str(tmpdir.join('stats.json'))
+    stats.save(path)
+    with open(path) as stats_file:
+        result = json.load(stats_file)
+    assert mock_connect.call_count == 1
+    assert [(c['source'], c['count']) for c in result['connects']] == [
+        ('proxysql', 1)
+    ]
+    assert [(q['source'], q['statement'], q['count'])
+            for q in result['queries']] == [('proxysql', 'SELECT 1', 2)]
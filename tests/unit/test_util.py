@@ -3,6 +3,8 @@ from mock import mock_open, mock
 from pymysql import OperationalError
 
 from proxysql_tools.util.bug1258464 import get_my_cnf, get_pid, bug1258464
+from proxysql_tools.util.password import mysql_native_password, \
+    is_mysql_native_password_hash, hash_password
 
 
 def test__get_my_cnf_when_dist_not_supported(mocker):
@@ -81,3 +83,36 @@ def test__bug1258464_when_raise_OperationalError(mocker):
     mock_pymysql.connect.return_value.cursor.return_value.__enter__.return_value = mock_cursor
     mock_pymysql.connect.side_effect = OperationalError
     assert not bug1258464('some path')
+
+
+@pytest.mark.parametrize('password, result', [
+    ('', ''),
+    (None, ''),
+    ('password', '*2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19'),
+    (u'password', '*2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19'),
+    ('root', '*81F5E21E35407D884A6CD4A731AEBFB6AF209E1B')
+])
+def test_mysql_native_password(password, result):
+    assert mysql_native_password(password) == result
+
+
+@pytest.mark.parametrize('value, result', [
+    ('*2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19', True),
+    ('*2470c0c06dee42fd1618bb99005adca2ec9d1e19', False),
+    ('2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19', False),
+    ('password', False),
+    ('', False),
+    (None, False)
+])
+def test_is_mysql_native_password_hash(value, result):
+    assert is_mysql_native_password_hash(value) == result
+
+
+@pytest.mark.parametrize('value, result', [
+    ('password', '*2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19'),
+    ('*2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19',
+     '*2470C0C06DEE42FD1618BB99005ADCA2EC9D1E19'),
+    ('', '')
+])
+def test_hash_password(value, result):
+    assert hash_password(value) == result